@@ -0,0 +1,28 @@
+import sys
+
+COMMANDS = {
+    "batch": "Apply an edit recipe to many images (python -m app batch --help)",
+    "serve": "Serve previews and recipes to local tools (python -m app serve --help)",
+    "call": "Send a request to a running service (python -m app call --help)",
+}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 0 or argv[0] not in COMMANDS:
+        print("usage: python -m app COMMAND [options]\n")
+        for name, text in COMMANDS.items():
+            print(f"  {name:10} {text}")
+        return 2
+    if argv[0] == "batch":
+        from . import batch
+        return batch.main(argv[1:])
+    if argv[0] == "serve":
+        from . import service
+        return service.main(argv[1:])
+    if argv[0] == "call":
+        from . import client
+        return client.main(argv[1:])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import numpy as np
+from . import trace
+
+# Tonal adjustments. Brightness, contrast and levels (black point, white point and gamma, per channel) are
+# all functions of a pixel's value alone, so together they make one 256 entry lookup table per channel
+# and are applied in a single Image.point() pass, whatever the number of sliders moved. The edit is kept
+# as its parameters (see operations.adjust), so replaying it on a proxy or the full image gives the same result.
+
+AUTO_CLIP = 0.005       # Auto levels ignores this fraction of the darkest and of the brightest pixels
+AUTO_PIXELS = 500000    # Larger images are sampled down to about this before counting
+MODES = ("L", "LA", "P", "PA", "RGB", "RGBA", "RGBX")  # 8 bit greys and colours; others (16 bit, CMYK...) aren't adjusted
+
+def can_adjust(mode):
+    return mode in MODES
+
+def is_identity(op):
+    return op['brightness'] == 0 and op['contrast'] == 0 and op['gamma'] == 1.0 and all(b == 0 for b in op['black']) and all(w == 255 for w in op['white'])
+
+def tables(op):
+    # The three lookup tables (red, green, blue) for an adjustment record, as a (3, 256) array of uint8
+    x = np.arange(256, dtype=np.float64)
+    black = np.array(op['black'], dtype=np.float64)[:, None]
+    white = np.array(op['white'], dtype=np.float64)[:, None]
+    v = np.clip((x - black) / np.maximum(white - black, 1), 0, 1) ** (1 / op['gamma']) * 255    # Levels
+    c = op['contrast'] * 2.55
+    v = (v - 128) * (259 * (c + 255)) / (255 * (259 - c)) + 128                                 # Contrast, around mid grey
+    v = v + op['brightness'] * 2.55                                                             # Brightness
+    return np.clip(np.rint(v), 0, 255).astype(np.uint8)
+
+@trace.traced("adjust")
+def apply_adjustment(image, op):
+    # Apply an adjustment record to an image, returning the new image
+    if is_identity(op):
+        return image
+    lut = tables(op)
+    trace.annotate(size=image.size, mode=image.mode)
+    if image.mode in ("P", "PA"):
+        # Adjust the palette rather than every pixel
+        image = image.copy()
+        palette = np.array(image.getpalette(), dtype=np.uint8).reshape(-1, 3)
+        image.putpalette(np.stack([lut[i][palette[:, i]] for i in range(3)], axis=1).ravel().tolist())
+        return image
+    if image.mode not in MODES:
+        raise ValueError(f"Can't adjust {image.mode} images")
+    if image.mode in ("L", "LA"):
+        lut = lut.mean(axis=0).round().astype(np.uint8)[None, :]
+    extra = len(image.getbands()) - len(lut)   # Alpha (or padding) is left as it is
+    return image.point(lut.ravel().tolist() + list(range(256)) * extra)
+
+@trace.traced("auto_levels")
+def auto_levels(image, clip=AUTO_CLIP):
+    # Per channel (black, white) points that stretch each of red, green and blue over the full range,
+    # ignoring the `clip` fraction of outliers at either end. Returns ((black r, g, b), (white r, g, b))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    step = max(1, int((image.size[0] * image.size[1] / AUTO_PIXELS) ** 0.5))
+    pixels = np.asarray(image)[::step, ::step].reshape(-1, 3)  # Every step'th pixel: averaging would pull in the extremes
+    counts = np.stack([np.bincount(pixels[:, i], minlength=256) for i in range(3)])
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    black = (cumulative <= total * clip).sum(axis=1)                # First level past the darkest outliers
+    white = 255 - (cumulative >= total * (1 - clip)).sum(axis=1) + 1  # Last level before the brightest
+    white = np.maximum(white, black + 1)
+    return tuple(int(b) for b in black), tuple(int(min(255, w)) for w in white)
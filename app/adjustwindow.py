@@ -0,0 +1,90 @@
+import tkinter as tk
+from . import operations
+
+class AdjustWindow():
+    # Brightness, contrast and levels sliders. Every change is previewed (on_preview, with an adjustment record,
+    # see app/adjust.py); Auto asks on_auto() for per channel black and white points; Apply calls on_apply(record).
+    # Closing it any other way calls on_cancel()
+    def __init__(self, parent, on_preview, on_auto, on_apply, on_cancel):
+        self.on_preview = on_preview
+        self.on_auto = on_auto
+        self.on_apply = on_apply
+        self.on_cancel = on_cancel
+        self.window = tk.Toplevel()
+        self.window.title("Adjust")
+        self.window.geometry("360x330")
+        self.window.transient(parent)
+        self.black = (0, 0, 0)          # Per channel, set together by the slider or separately by Auto
+        self.white = (255, 255, 255)
+        self.updating = False
+        self.brightness = self.slider("Brightness", -100, 100, 0, 0)
+        self.contrast = self.slider("Contrast", -100, 100, 0, 1)
+        self.black_point = self.slider("Black point", 0, 254, 0, 2, lambda: self.levels('black'))
+        self.white_point = self.slider("White point", 1, 255, 255, 3, lambda: self.levels('white'))
+        self.gamma = self.slider("Gamma", 0.25, 4.0, 1.0, 4, resolution=0.05)
+        buttons = tk.Frame(self.window)
+        buttons.grid(row=5, column=0, columnspan=2, sticky="we", padx=10, pady=10)
+        tk.Button(buttons, text="Auto", command=self.auto).pack(side=tk.LEFT)
+        tk.Button(buttons, text="Reset", command=self.reset).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="Cancel", command=self.cancel).pack(side=tk.RIGHT)
+        tk.Button(buttons, text="Apply", command=self.apply).pack(side=tk.RIGHT, padx=5)
+        self.window.columnconfigure(1, weight=1)
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.window.bind('<Return>', lambda event: self.apply())
+        self.window.bind('<Escape>', lambda event: self.cancel())
+        self.window.grab_set()  # Nothing else in the editor until this is closed
+
+    def slider(self, text, low, high, value, row, changed=None, resolution=1):
+        tk.Label(self.window, text=text).grid(row=row, column=0, sticky="sw", padx=10, pady=2)
+        scale = tk.Scale(self.window, from_=low, to=high, resolution=resolution, orient=tk.HORIZONTAL, command=lambda value: (changed or self.changed)())
+        scale.set(value)
+        scale.grid(row=row, column=1, sticky="we", padx=10)
+        return scale
+
+    def levels(self, moved):
+        # The black and white point sliders set every channel (undoing Auto's per channel points)
+        if self.updating:
+            return
+        if moved == 'black':
+            self.black = (self.black_point.get(),) * 3
+        else:
+            self.white = (self.white_point.get(),) * 3
+        self.changed()
+
+    def record(self):
+        return operations.adjust(self.brightness.get(), self.contrast.get(), self.black, self.white, self.gamma.get())
+
+    def changed(self):
+        if not self.updating:
+            self.on_preview(self.record())
+
+    def set_levels(self, black, white):
+        self.updating = True
+        self.black, self.white = black, white
+        self.black_point.set(min(black))
+        self.white_point.set(max(white))
+        self.window.update_idletasks() # Let the sliders' callbacks run while they are ignored
+        self.updating = False
+        self.changed()
+
+    def auto(self):
+        black, white = self.on_auto()
+        self.set_levels(black, white)
+
+    def reset(self):
+        self.updating = True
+        self.brightness.set(0)
+        self.contrast.set(0)
+        self.gamma.set(1.0)
+        self.set_levels((0, 0, 0), (255, 255, 255))
+
+    def apply(self):
+        record = self.record()
+        self.window.grab_release()
+        self.window.destroy()
+        self.on_apply(record)
+
+    def cancel(self):
+        self.window.grab_release()
+        self.window.destroy()
+        self.on_cancel()
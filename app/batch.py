@@ -0,0 +1,103 @@
+import os
+import sys
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from . import engine, resize, encode
+
+SUPPORTED_IMAGE_EXTENSIONS = ("jpg", "jpeg", "png")
+
+def find_images(paths, recursive=False):
+    # Yield (filename, root) for every image in the given files, folders or glob patterns, without listing everything first
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, subfolders, files in os.walk(path):
+                subfolders.sort()
+                for name in sorted(files):
+                    if name.split(".")[-1].lower() in SUPPORTED_IMAGE_EXTENSIONS:
+                        yield os.path.join(folder, name), path
+                if not recursive:
+                    break
+        else:
+            for filename in sorted(glob.iglob(path, recursive=recursive)):
+                if os.path.isfile(filename) and filename.split(".")[-1].lower() in SUPPORTED_IMAGE_EXTENSIONS:
+                    yield filename, None
+
+def init_worker():
+    # The pool already has a process per core, so big resizes work through their bands one at a time
+    resize.BAND_WORKERS = 1
+    encode.TRIAL_WORKERS = 1
+
+def run_one(filename, steps, output_dir, root):
+    # Runs in a worker process
+    started = time.perf_counter()
+    try:
+        target, method, report = engine.process_file(filename, steps, output_dir, root)
+        if report is not None:
+            method = f"{method} {encode.describe(report)}"
+        return filename, target, method, time.perf_counter() - started, None
+    except Exception as e:
+        return filename, None, None, time.perf_counter() - started, f"{type(e).__name__}: {e}"
+
+def run(steps, files, workers=None, output_dir=None, queue_size=None, report=print):
+    # Process (filename, root) pairs through a process pool, keeping at most `queue_size` files in flight
+    # so memory stays flat however many files there are. Returns (done, failures)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if queue_size is None:
+        queue_size = workers * 2
+    done = 0
+    failures = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        pending = set()
+        files = iter(files)
+        finished = False
+        while not finished or len(pending) > 0:
+            while not finished and len(pending) < queue_size:
+                try:
+                    filename, root = next(files)
+                except StopIteration:
+                    finished = True
+                    break
+                pending.add(pool.submit(run_one, filename, steps, output_dir, root))
+            if len(pending) == 0:
+                break
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                filename, target, method, elapsed, error = future.result()
+                done += 1
+                rate = done / max(time.perf_counter() - started, 1e-6)
+                if error is None:
+                    report(f"[{done}] {filename} -> {target} ({method}, {elapsed*1000:.0f} ms, {rate:.1f} files/s)")
+                else:
+                    failures.append((filename, error))
+                    report(f"[{done}] {filename} FAILED {error}")
+    elapsed = time.perf_counter() - started
+    report(f"{done} files in {elapsed:.1f} s ({done / max(elapsed, 1e-6):.1f} files/s), {len(failures)} failed")
+    for filename, error in failures:
+        report(f"  {filename}: {error}")
+    return done, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app batch", description="Apply an edit recipe to many images without the GUI")
+    parser.add_argument("recipe", help='Steps separated by commas, eg: "rotate:-90,crop:ratio=1.0:center,resize:long=2048,convert:png". Rotations are anticlockwise degrees')
+    parser.add_argument("paths", nargs="+", help="Image files, folders or glob patterns")
+    parser.add_argument("-o", "--output", help="Write results into this folder instead of saving over the originals")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include sub folders (and ** in patterns)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (default: one per core)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args(argv)
+    try:
+        steps = engine.parse_recipe(args.recipe)
+    except ValueError as e:
+        parser.error(str(e))
+    def report(line):
+        if not args.quiet or not line.startswith("["):
+            print(line, flush=True)
+    done, failures = run(steps, find_images(args.paths, args.recursive), args.workers, args.output, report=report)
+    return 1 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import sys
+import json
+import time
+import socket
+import argparse
+import http.client
+from urllib.parse import urlencode
+
+# A client for the local service (see app/service.py), and the "call" command built on it:
+#
+#   client = Client("/tmp/image-editor.sock")     Or Client(port=8765) for localhost
+#   data = client.preview("photos/a.jpg", 1024, "rotate:-90")
+#   client.process("photos/a.jpg", "resize:long=2048,save:web", output="out")
+
+DEFAULT_PORT = 8765
+RETRIES = 5     # Times a request turned away because the service is busy is tried again
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+class Client():
+    def __init__(self, unix=None, port=DEFAULT_PORT, timeout=300, retries=RETRIES):
+        self.unix = unix
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+
+    def connection(self):
+        if self.unix is not None:
+            return UnixHTTPConnection(self.unix, self.timeout)
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None):
+        # Returns (content type, data). Waits and tries again while the service is busy
+        for attempt in range(self.retries + 1):
+            connection = self.connection()
+            try:
+                connection.request(method, path, body, {'Content-Type': "application/json"} if body is not None else {})
+                response = connection.getresponse()
+                data = response.read()
+            finally:
+                connection.close()
+            if response.status == 503 and attempt < self.retries:
+                time.sleep(float(response.getheader("Retry-After") or 1))
+                continue
+            if response.status != 200:
+                try:
+                    message = json.loads(data)['error']
+                except (ValueError, KeyError, TypeError):
+                    message = data.decode("utf-8", "replace")
+                raise ServiceError(response.status, message)
+            return response.getheader("Content-Type"), data
+
+    def preview(self, filename, size=1024, recipe=""):
+        # JPEG data of the image after `recipe`, fitting size x size
+        return self.request("GET", "/preview?" + urlencode({'file': filename, 'size': size, 'recipe': recipe}))[1]
+
+    def process(self, filename, recipe, output=None):
+        body = json.dumps({'file': filename, 'recipe': recipe, 'output': output})
+        return json.loads(self.request("POST", "/process", body)[1])
+
+    def metrics(self):
+        return json.loads(self.request("GET", "/metrics")[1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app call", description="Send a request to a running service (python -m app serve)")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help=f"Port on localhost (default: {DEFAULT_PORT})")
+    parser.add_argument("-u", "--unix", help="Unix socket the service is listening on")
+    commands = parser.add_subparsers(dest="command", required=True)
+    preview = commands.add_parser("preview", help="Save a JPEG preview of a file")
+    preview.add_argument("file")
+    preview.add_argument("output", help="Where to write the preview")
+    preview.add_argument("-s", "--size", type=int, default=1024, help="Longest edge (default: 1024)")
+    preview.add_argument("-r", "--recipe", default="", help="Steps to apply first, as for the batch command")
+    process = commands.add_parser("process", help="Apply a recipe to a file and save it")
+    process.add_argument("file")
+    process.add_argument("recipe")
+    process.add_argument("-o", "--output", help="Write the result into this folder instead of over the original")
+    commands.add_parser("metrics", help="Print the service's latency, queue and cache counters")
+    args = parser.parse_args(argv)
+    client = Client(args.unix, args.port)
+    try:
+        if args.command == "preview":
+            started = time.perf_counter()
+            data = client.preview(args.file, args.size, args.recipe)
+            with open(args.output, "wb") as f:
+                f.write(data)
+            print(f"{args.output} ({len(data) / 1024:.0f} KB, {(time.perf_counter() - started) * 1000:.0f} ms)")
+        elif args.command == "process":
+            result = client.process(args.file, args.recipe, args.output)
+            print(f"{result['file']} -> {result['target']} ({result['method']}, {result['ms']:.0f} ms)")
+        else:
+            print(json.dumps(client.metrics(), indent=2))
+    except (ServiceError, OSError) as e:
+        print(f"Failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+from PIL import ImageDraw
+from . import operations
+from . import trace
+
+# Drawing tools. A stroke is drawn as the mouse moves, one piece at a time, straight onto the full resolution
+# image and onto the display proxy, and only the proxy pixels each piece touched are sent to the screen, so
+# the cost of a mouse move depends on the length of the piece rather than the size of the image. The
+# full resolution tiles a stroke is about to draw over are saved first, for undo; the stroke itself is kept
+# as a vector operation record (see app/operations.py).
+
+TOOLS = operations.FREEHAND + operations.SHAPES
+MODES = ("L", "LA", "RGB", "RGBA", "RGBX")   # Others (palette, 1 and 16 bit, CMYK...) would get a different colour than the display shows
+
+def can_draw(mode):
+    return mode in MODES
+
+class Stroke():
+    def __init__(self, tool, colour, width, image, proxy, renderer, history):
+        self.tool = tool
+        self.colour = colour
+        self.width = width
+        self.image = image
+        self.proxy = proxy
+        self.renderer = renderer
+        self.history = history
+        self.scale = proxy.size[0] / image.size[0]
+        self.proxy_width = max(1, round(width * self.scale))
+        self.same = proxy is image  # Small images are shown at full size, so there is only one to draw on
+        self.draw = ImageDraw.Draw(image)
+        self.proxy_draw = ImageDraw.Draw(proxy)
+        self.points = []
+        self.saved = {}             # Tiles of the image saved before the stroke drew over them (see History.save_tiles)
+        self.under = None           # (box, pixels) of the proxy under a shape's preview
+
+    def scaled(self, point):
+        return (point[0] * self.scale, point[1] * self.scale)
+
+    @trace.traced("stroke_add")
+    def add(self, point):
+        # Continue the stroke to `point` (full resolution coordinates)
+        point = (int(point[0]), int(point[1]))
+        if len(self.points) > 0 and point == self.points[-1]:
+            return
+        self.points.append(point)
+        if self.tool in operations.FREEHAND:
+            previous = self.points[-2] if len(self.points) > 1 else point
+            self.paint(lambda draw, p0, p1, width: operations.draw_segment(draw, p0, p1, self.colour, width), previous, point)
+        else:
+            self.preview()
+
+    def paint(self, function, p0, p1):
+        # Draw a piece onto the image and the proxy, and update the screen where it landed
+        box = operations.stroke_box((p0, p1), self.width, self.image.size)
+        self.history.save_tiles(self.image, box, self.saved)
+        function(self.draw, p0, p1, self.width)
+        proxy_points = (self.scaled(p0), self.scaled(p1))
+        if not self.same:
+            function(self.proxy_draw, proxy_points[0], proxy_points[1], self.proxy_width)
+            box = operations.stroke_box(proxy_points, self.proxy_width, self.proxy.size)
+        self.renderer.display_region(self.proxy, box)
+
+    def preview(self):
+        # Lines and shapes are drawn only on the proxy until the mouse is released
+        p0, p1 = self.scaled(self.points[0]), self.scaled(self.points[-1])
+        box = operations.stroke_box((p0, p1), self.proxy_width, self.proxy.size)
+        dirty = self.restore_under()
+        self.under = (box, self.proxy.crop(box))
+        operations.draw_shape(self.proxy_draw, self.tool, p0, p1, self.colour, self.proxy_width)
+        if dirty is not None:
+            box = (min(box[0], dirty[0]), min(box[1], dirty[1]), max(box[2], dirty[2]), max(box[3], dirty[3]))
+        self.renderer.display_region(self.proxy, box)
+
+    def restore_under(self):
+        if self.under is None:
+            return None
+        box, pixels = self.under
+        self.proxy.paste(pixels, box[:2])
+        self.under = None
+        return box
+
+    def finish(self):
+        # End the stroke. Returns (op, snapshot) for the history, or None if nothing was drawn
+        if len(self.points) == 0:
+            return None
+        if self.tool not in operations.FREEHAND:
+            self.restore_under() # The shape is drawn over the same box as its last preview
+            self.paint(lambda draw, p0, p1, width: operations.draw_shape(draw, self.tool, p0, p1, self.colour, width), self.points[0], self.points[-1])
+        self.renderer.edited(self.proxy)
+        return operations.stroke(self.tool, self.points, self.colour, self.width), self.history.tile_snapshot(self.image, self.saved)
@@ -0,0 +1,160 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageFilter, ImageStat
+from .thumbnails import make_thumbnail, file_key
+from . import trace
+
+# Finding near-duplicate shots (bursts) in a folder. Each image gets a 64 bit difference hash made from its
+# thumbnail, and the hashes of a whole folder are compared at once with NumPy. Hashes are kept in a table
+# next to the thumbnails, so a folder only needs hashing again for the files added or changed since last time.
+
+HASH_SIZE = 8           # 8 x 8 bits
+MAX_DISTANCE = 6        # Hashes differing in at most this many bits are counted as near-duplicates
+BLOCK_ROWS = 512        # Rows of the distance matrix worked out at a time, to bound memory
+
+def dhash(image):
+    # Difference hash: is each pixel brighter than its right hand neighbour, on a tiny greyscale copy
+    small = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+def sharpness(image):
+    # Rough measure of focus (variance of the edges), for suggesting which frame of a burst to keep
+    return ImageStat.Stat(image.convert("L").filter(ImageFilter.FIND_EDGES)).var[0]
+
+def hash_file(filename, store=None):
+    # (hash, sharpness) of an image, from its cached thumbnail if there is one
+    key = file_key(filename)
+    data = store.get(filename, key) if store is not None else None
+    if data is None:
+        data = make_thumbnail(filename)
+        if store is not None and key is not None:
+            store.put(filename, key, data)
+    with Image.open(io.BytesIO(data)) as thumbnail:
+        thumbnail.load()
+        return dhash(thumbnail), sharpness(thumbnail)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    BIT_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    def popcount(values):
+        return BIT_COUNTS[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+@trace.traced("group_duplicates")
+def group(hashes, max_distance=MAX_DISTANCE):
+    # Indexes of near-duplicate groups (each at least two long) among a list of hashes
+    count = len(hashes)
+    trace.annotate(files=count)
+    if count < 2:
+        return []
+    values = np.array(hashes, dtype=np.uint64)
+    parent = list(range(count))
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for start in range(0, count, BLOCK_ROWS):
+        block = values[start:start+BLOCK_ROWS]
+        distances = popcount(block[:, None] ^ values[None, start:])   # Pairs before the block were done already
+        rows, columns = np.nonzero(distances <= max_distance)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            i, j = start + row, start + column
+            if j > i:
+                a, b = root(i), root(j)
+                if a != b:
+                    parent[b] = a
+    groups = {}
+    for i in range(count):
+        groups.setdefault(root(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+class HashIndex():
+    # Hashes of the images in folders, kept in a table of the thumbnail database and brought up to date incrementally
+    def __init__(self, store, workers=None):
+        self.store = store      # ThumbnailStore whose database we share, and whose thumbnails we hash
+        self.lock = store.lock
+        self.db = store.db
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, folder TEXT, mtime REAL, size INTEGER, hash INTEGER, sharpness REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hashes_folder ON hashes (folder)")
+        self.db.commit()
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hashes")
+        self.pending = {}   # path -> future
+        self.failed = {}    # path -> file_key when it couldn't be hashed, tried again once the file changes
+
+    def known(self, folder):
+        # {path: (mtime, size, hash, sharpness)} stored for a folder
+        with self.lock:
+            rows = self.db.execute("SELECT path, mtime, size, hash, sharpness FROM hashes WHERE folder=?", (folder,)).fetchall()
+        return {row[0]: (row[1], row[2], row[3], row[4]) for row in rows}
+
+    def update(self, folder, paths):
+        # Forget files no longer in the folder and start hashing new or changed ones. Returns the number queued
+        known = self.known(folder)
+        wanted = set(paths)
+        gone = [path for path in known if path not in wanted]
+        if len(gone) > 0:
+            with self.lock:
+                self.db.executemany("DELETE FROM hashes WHERE path=?", [(path,) for path in gone])
+                self.db.commit()
+        queued = 0
+        for path in paths:
+            stored = known.get(path)
+            key = file_key(path)
+            if stored is not None and (stored[0], stored[1]) == key:
+                continue
+            with self.lock:
+                if path in self.pending or self.failed.get(path) == key:
+                    continue
+                self.failed.pop(path, None)
+                self.pending[path] = self.executor.submit(self._hash, folder, path)
+            queued += 1
+        return queued
+
+    def _hash(self, folder, path):
+        key = file_key(path)
+        try:
+            value, sharp = hash_file(path, self.store)
+        except Exception:
+            value = None
+        with self.lock:
+            self.pending.pop(path, None)
+            if value is None:
+                self.failed[path] = key
+                return
+            # SQLite integers are signed 64 bit
+            self.db.execute("INSERT OR REPLACE INTO hashes (path, folder, mtime, size, hash, sharpness) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, folder, key[0], key[1], value - (1 << 64) if value >= 1 << 63 else value, sharp))
+            self.store.changed()
+
+    def busy(self):
+        with self.lock:
+            return len(self.pending)
+
+    def groups(self, folder, paths, max_distance=MAX_DISTANCE):
+        # Near-duplicate groups among `paths` (in their order), each a list of (path, sharpness), sharpest first
+        known = self.known(folder)
+        hashed = [path for path in paths if path in known]
+        hashes = [known[path][2] % (1 << 64) for path in hashed]
+        result = []
+        for members in group(hashes, max_distance):
+            result.append(sorted(((hashed[i], known[hashed[i]][3]) for i in members), key=lambda item: -item[1]))
+        return result
+
+    def discard(self, path):
+        with self.lock:
+            self.db.execute("DELETE FROM hashes WHERE path=?", (path,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,106 @@
+import io
+import os
+import tkinter as tk
+from tkinter import messagebox
+from PIL import Image, ImageTk
+from .thumbnails import THUMBNAIL_SIZE, file_key
+
+POLL_MS = 200
+
+class DuplicatesWindow():
+    # Groups of near-duplicate images in a folder (see app/duplicates.py), each with the frame to keep
+    # (the sharpest, unless another is picked) and a button to delete the rest
+    def __init__(self, parent, hash_index, folder, paths, on_delete):
+        self.parent = parent
+        self.hash_index = hash_index
+        self.folder = folder
+        self.paths = paths
+        self.on_delete = on_delete  # Called with a list of paths to delete, returns the ones that were
+        self.groups = []
+        self.keep = []              # One StringVar per group: the path to keep
+        self.photos = []
+        self.window = tk.Toplevel()
+        self.window.geometry("900x600")
+        self.window.title("Duplicates in " + folder)
+        self.status = tk.Label(self.window, text="", font=('Arial', 14), anchor="w")
+        self.status.pack(side=tk.TOP, fill=tk.X, padx=10, pady=5)
+        buttons = tk.Frame(self.window)
+        buttons.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
+        self.delete_all_button = tk.Button(buttons, text="Delete all but the chosen frame of every group", command=self.delete_all, state=tk.DISABLED)
+        self.delete_all_button.pack(side=tk.LEFT)
+        tk.Button(buttons, text="Close", command=self.close).pack(side=tk.RIGHT)
+        self.canvas = tk.Canvas(self.window, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self.window, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.config(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.rows = tk.Frame(self.canvas)
+        self.canvas.create_window(0, 0, window=self.rows, anchor="nw")
+        self.rows.bind('<Configure>', lambda event: self.canvas.config(scrollregion=self.canvas.bbox("all")))
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.closed = False
+        queued = self.hash_index.update(folder, paths)
+        self.status.config(text=f"Hashing {queued} image(s)..." if queued > 0 else "")
+        self.poll()
+
+    def poll(self):
+        # Wait for the hashing to finish, then group
+        if self.closed:
+            return
+        busy = self.hash_index.busy()
+        if busy > 0:
+            self.status.config(text=f"Hashing, {busy} image(s) to go...")
+            self.window.after(POLL_MS, self.poll)
+            return
+        self.show_groups()
+
+    def show_groups(self):
+        for row in self.rows.winfo_children():
+            row.destroy()
+        self.photos = []
+        self.groups = self.hash_index.groups(self.folder, [path for path in self.paths if os.path.exists(path)])
+        self.keep = []
+        for members in self.groups:
+            self.keep.append(tk.StringVar(value=members[0][0]))  # Sharpest first
+            self.add_row(len(self.keep) - 1, members)
+        extra = sum(len(members) - 1 for members in self.groups)
+        self.status.config(text=f"{len(self.groups)} group(s) of near-duplicates, {extra} file(s) that could go")
+        self.delete_all_button.config(state=tk.NORMAL if len(self.groups) > 0 else tk.DISABLED)
+
+    def add_row(self, g, members):
+        row = tk.Frame(self.rows, borderwidth=1, relief=tk.GROOVE)
+        row.pack(side=tk.TOP, fill=tk.X, padx=5, pady=3)
+        for path, sharp in members:
+            photo = self.thumbnail(path)
+            self.photos.append(photo)
+            tk.Radiobutton(row, image=photo, text=f"{os.path.basename(path)}\nsharpness {sharp:.0f}", compound=tk.TOP,
+                variable=self.keep[g], value=path, indicatoron=False, selectcolor="pale green").pack(side=tk.LEFT, padx=2, pady=2)
+        tk.Button(row, text="Delete others", command=lambda: self.delete_group(g)).pack(side=tk.RIGHT, padx=5)
+
+    def thumbnail(self, path):
+        data = self.hash_index.store.get(path, file_key(path))
+        if data is None:
+            return ImageTk.PhotoImage(Image.new("RGB", THUMBNAIL_SIZE, "gray80"), master=self.window)
+        return ImageTk.PhotoImage(Image.open(io.BytesIO(data)), master=self.window)
+
+    def others(self, g):
+        return [path for path, sharp in self.groups[g] if path != self.keep[g].get()]
+
+    def delete_group(self, g):
+        doomed = self.others(g)
+        if messagebox.askyesno("Confirm file delete?", f"Delete {len(doomed)} file(s), keeping {os.path.basename(self.keep[g].get())}?", parent=self.window):
+            self.delete(doomed)
+
+    def delete_all(self):
+        doomed = [path for g in range(len(self.groups)) for path in self.others(g)]
+        if messagebox.askyesno("Confirm file delete?", f"Delete {len(doomed)} file(s) from {len(self.groups)} group(s)?", parent=self.window):
+            self.delete(doomed)
+
+    def delete(self, paths):
+        deleted = set(self.on_delete(paths))
+        self.paths = [path for path in self.paths if path not in deleted]
+        self.show_groups()
+
+    def close(self):
+        self.closed = True
+        self.window.destroy()
@@ -0,0 +1,148 @@
+from . import operations
+from . import trace
+
+# Edits made in the editor are kept as a list of operation records and only run on the full resolution
+# image when its pixels are actually needed (saving, drawing, zooming in); until then the display is
+# drawn by running the same list on a small proxy. Before running, the list is optimised: each run of
+# rotations, crops and resizes becomes at most one crop (mapped back into the coordinates of the image the
+# run starts from), one resize and one rotation, in that order. So the full image is only cropped once,
+# the resize and rotation only touch the pixels that are kept, and rotating round to where you started
+# costs nothing at all. A resize moved ahead of a rotation can differ from the original order by rounding
+# (Pillow resamples one axis before the other); every other change gives exactly the same pixels.
+
+def rotated_size(size, angle):
+    return size if angle % 180 == 0 else (size[1], size[0])
+
+def unrotate_box(box, size, angle):
+    # A box in the coordinates of an image of `size` after it has been rotated anticlockwise by `angle`,
+    # mapped back into the coordinates of the image before the rotation
+    w, h = size
+    x0, y0, x1, y1 = box
+    angle = angle % 360
+    if angle == 90:
+        return (w - y1, x0, w - y0, x1)
+    elif angle == 180:
+        return (w - x1, h - y1, w - x0, h - y0)
+    elif angle == 270:
+        return (y0, h - x1, y1, h - x0)
+    return tuple(box)
+
+class Run():
+    # Rotations, crops and resizes since the last barrier, as crop `box` then `resize` then rotate `angle`
+    def __init__(self, size):
+        self.size = size        # Size of the image the run starts from
+        self.box = (0, 0, size[0], size[1])
+        self.resize = None      # (size, filter), in the orientation before the rotation
+        self.angle = 0
+
+    def unrotated(self):
+        # Size after the crop and resize, before the rotation
+        if self.resize is not None:
+            return self.resize[0]
+        return (self.box[2] - self.box[0], self.box[3] - self.box[1])
+
+    def current(self):
+        return rotated_size(self.unrotated(), self.angle)
+
+    def add(self, op):
+        # Fold `op` into the run. Returns False if it can't be: a crop after a resize would crop different pixels,
+        # and a resize after a resize is kept (a deliberate downscale and upscale loses detail that one resize wouldn't)
+        if op['op'] == 'rotate':
+            self.angle = (self.angle + op['angle']) % 360
+        elif op['op'] == 'crop':
+            if self.resize is not None:
+                return False
+            x0, y0, x1, y1 = unrotate_box(op['box'], self.unrotated(), self.angle)
+            self.box = (self.box[0] + x0, self.box[1] + y0, self.box[0] + x1, self.box[1] + y1)
+        elif op['op'] == 'resize':
+            if self.resize is not None:
+                return False
+            self.resize = (rotated_size(op['size'], self.angle), op['filter'])
+        else:
+            return False
+        return True
+
+    def ops(self):
+        result = []
+        if self.box != (0, 0, self.size[0], self.size[1]):
+            result.append(operations.crop(self.box))
+        if self.resize is not None and self.resize[0] != (self.box[2] - self.box[0], self.box[3] - self.box[1]):
+            result.append(operations.resize(self.resize[0], self.resize[1]))
+        if self.angle != 0:
+            result.append(operations.rotate(self.angle))
+        return result
+
+def defer_adjustments(ops):
+    # Tonal adjustments change each pixel on its own, so they give the same result after any rotations and
+    # crops that follow them: move them there, to run on fewer pixels and let the rotations and crops join up
+    result = []
+    held = []
+    for op in ops:
+        if op['op'] == 'adjust':
+            held.append(op)
+        elif op['op'] in ('rotate', 'crop'):
+            result.append(op)
+        else:
+            result.extend(held)
+            held = []
+            result.append(op)
+    return result + held
+
+def optimize(ops, size):
+    # An equivalent list of operations for an image of `size` that does as little work as possible
+    result = []
+    run = Run(size)
+    for op in defer_adjustments(ops):
+        if run.add(op):
+            continue
+        result.extend(run.ops())
+        run = Run(run.current())
+        if not run.add(op):
+            # Something that isn't a rotation, crop or resize (eg: a stroke) is left where it is
+            result.append(op)
+            run = Run(operations.result_size(run.size, op))
+    result.extend(run.ops())
+    return result
+
+def result_size(ops, size):
+    for op in ops:
+        size = operations.result_size(size, op)
+    return size
+
+def source_scale(ops, size, target):
+    # How far an image of `size` can be scaled down before running `ops` on it and still give a result
+    # with at least the detail of one `target` in size (at most 1: full resolution)
+    factor = 1.0
+    for op in optimize(ops, size):
+        after = operations.result_size(size, op)
+        if op['op'] == 'resize':
+            factor *= size[0] / after[0]
+        size = after
+    return min(1.0, factor * max(target[0] / size[0], target[1] / size[1]))
+
+def scale_op(op, scale):
+    # The operation for a copy of the image scaled by `scale` (eg: a display proxy)
+    if op['op'] == 'crop':
+        x0, y0, x1, y1 = [round(v * scale) for v in op['box']]
+        return operations.crop((x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)))
+    elif op['op'] == 'resize':
+        return operations.resize((max(1, round(op['size'][0] * scale)), max(1, round(op['size'][1] * scale))), op['filter'])
+    elif op['op'] == 'stroke':
+        return operations.stroke(op['tool'], [(x * scale, y * scale) for x, y in op['points']], op['colour'], max(1, round(op['width'] * scale)))
+    return op
+
+@trace.traced("apply_edits")
+def apply(image, ops):
+    # Run the optimised list on an image
+    trace.annotate(size=image.size, ops=len(ops))
+    for op in optimize(ops, image.size):
+        image = operations.apply(image, op)
+    return image
+
+@trace.traced("preview_edits")
+def preview(proxy, size, ops):
+    # Run the list on `proxy`, a scaled copy of an image of `size`
+    scale = proxy.size[0] / size[0]
+    for op in optimize(ops, size):
+        proxy = operations.apply(proxy, scale_op(op, scale))
+    return proxy
@@ -0,0 +1,162 @@
+import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, JpegImagePlugin
+from . import trace
+
+# Saving JPEG and PNG files. A named profile chooses the settings; the default, "original", reuses the
+# source file's own quantisation tables and chroma subsampling so an edited JPEG comes back out looking
+# (and weighing) the same as it went in. Every profile keeps the ICC colour profile, and all but the web
+# ones keep the EXIF data, with the orientation reset because the pixels are saved upright.
+# Given a byte budget, JPEGs are saved at the highest quality that fits: trial encodes into memory, a few
+# qualities at a time on a thread pool (Pillow releases the GIL while encoding), closing in on the answer.
+
+PROFILES = {
+    'original': {},     # The source's own tables and subsampling (Pillow's defaults if it wasn't a JPEG)
+    'high': {'quality': 92, 'subsampling': 0, 'optimize': True},
+    'web': {'quality': 82, 'subsampling': 2, 'progressive': True, 'optimize': True, 'strip': True},
+    'small': {'quality': 65, 'subsampling': 2, 'progressive': True, 'optimize': True, 'strip': True},
+}
+DEFAULT_PROFILE = "original"
+DEFAULT_QUALITY = 90        # For "original" when the source has no tables to reuse
+MIN_QUALITY = 10            # Lowest quality tried when fitting a byte budget
+MAX_QUALITY = 95
+TRIAL_WORKERS = min(4, os.cpu_count() or 1)
+ORIENTATION = 0x0112
+EXIF_IFD = 0x8769
+EXIF_WIDTH = 0xA002
+EXIF_HEIGHT = 0xA003
+# The IJG (libjpeg) luminance table that qualities are scaled from
+STANDARD_LUMINANCE = (16, 11, 12, 14, 12, 10, 16, 14, 13, 14, 18, 17, 16, 19, 24, 40, 26, 24, 22, 22, 24, 49, 35, 37,
+    29, 40, 58, 51, 61, 60, 57, 51, 56, 55, 64, 72, 92, 78, 64, 68, 87, 69, 55, 56, 80, 109, 81, 87, 95, 98, 103, 104,
+    103, 62, 77, 113, 121, 112, 100, 120, 92, 101, 103, 99)
+
+def source_settings(filename):
+    # What a save should carry over from the file an image was opened from, read from its header without decoding it
+    try:
+        with Image.open(filename) as image:
+            source = {'format': image.format, 'icc_profile': image.info.get('icc_profile'), 'exif': image.info.get('exif')}
+            if image.format == "JPEG":
+                source['qtables'] = dict(image.quantization)
+                source['subsampling'] = JpegImagePlugin.get_sampling(image)
+                source['progressive'] = bool(image.info.get('progressive'))
+    except OSError:
+        return {}
+    return source
+
+def estimate_quality(qtables):
+    # The libjpeg quality setting that would have made these tables (roughly: files from cameras use their own)
+    scale = 100 * sum(qtables[0]) / sum(STANDARD_LUMINANCE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+def upright_exif(data, size):
+    # The source's EXIF data for the saved pixels: already upright, and `size`
+    exif = Image.Exif()
+    exif.load(data)
+    exif[ORIENTATION] = 1
+    ifd = exif.get_ifd(EXIF_IFD)
+    if EXIF_WIDTH in ifd or EXIF_HEIGHT in ifd:
+        ifd[EXIF_WIDTH] = size[0]
+        ifd[EXIF_HEIGHT] = size[1]
+    return exif.tobytes()
+
+def options(image, fmt, profile=DEFAULT_PROFILE, source=None, quality=None):
+    # Keyword arguments for Image.save. `quality` overrides the profile's (when fitting a byte budget)
+    settings = PROFILES[profile]
+    source = source or {}
+    kwargs = {}
+    if source.get('icc_profile'):
+        kwargs['icc_profile'] = source['icc_profile']
+    if source.get('exif') and not settings.get('strip'):
+        kwargs['exif'] = upright_exif(source['exif'], image.size)
+    if fmt == "png":
+        kwargs['optimize'] = settings.get('optimize', False)
+        return kwargs
+    subsampling = settings.get('subsampling', source.get('subsampling', -1))
+    if subsampling != -1 and image.mode != "L":
+        kwargs['subsampling'] = subsampling
+    qtables = source.get('qtables')
+    if quality is None and 'quality' not in settings and qtables and len(qtables) >= (1 if image.mode == "L" else 2):
+        kwargs['qtables'] = qtables
+    else:
+        kwargs['quality'] = quality or settings.get('quality', DEFAULT_QUALITY)
+    kwargs['progressive'] = settings.get('progressive', source.get('progressive', False))
+    kwargs['optimize'] = settings.get('optimize', False)
+    return kwargs
+
+def encodable(image, fmt):
+    # JPEG has no alpha or palette
+    if fmt == "jpeg" and image.mode not in ("RGB", "L", "CMYK"):
+        return image.convert("RGB")
+    return image
+
+def encode_bytes(image, fmt, kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+@trace.traced("encode")
+def encode(image, fmt, profile=DEFAULT_PROFILE, source=None, max_bytes=None, workers=None):
+    # Encode `image` as fmt ("jpeg" or "png"). Returns (data, report) where report says how it went (see describe)
+    started = time.perf_counter()
+    image = encodable(image, fmt)
+    image.load()
+    report = {'format': fmt, 'profile': profile, 'quality': None, 'trials': 1, 'over_budget': False}
+    if max_bytes is None or fmt != "jpeg":
+        kwargs = options(image, fmt, profile, source)
+        data = encode_bytes(image, fmt, kwargs)
+        report['quality'] = kwargs.get('quality')
+        report['over_budget'] = max_bytes is not None and len(data) > max_bytes # PNG is lossless, there is nothing to trade
+    else:
+        data, report['quality'], report['trials'] = fit(image, max_bytes, profile, source, workers)
+        report['over_budget'] = len(data) > max_bytes
+    report['bytes'] = len(data)
+    report['ms'] = (time.perf_counter() - started) * 1000
+    trace.annotate(**report)
+    return data, report
+
+def fit(image, max_bytes, profile, source, workers=None):
+    # The highest JPEG quality whose file fits in max_bytes, assuming size grows with quality. Each round encodes
+    # up to `workers` qualities spread over the range still in doubt. Returns (data, quality, trials)
+    high = MAX_QUALITY
+    if source and source.get('qtables') and 'quality' not in PROFILES[profile]:
+        high = min(high, estimate_quality(source['qtables'])) # Above the source's quality is just bigger
+    high = max(high, MIN_QUALITY)
+    good, good_data = MIN_QUALITY - 1, None     # Highest quality known to fit
+    bad, bad_data = high + 1, None              # Lowest quality known not to
+    workers = workers or TRIAL_WORKERS
+    trials = 0
+    local = threading.local()
+    def trial(quality):
+        # Image.save keeps its settings on the image object while it saves, so each thread saves from its own copy
+        if not hasattr(local, 'image'):
+            local.image = image.copy()
+        return quality, encode_bytes(local.image, "jpeg", options(image, "jpeg", profile, source, quality))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode") as pool:
+        while bad - good > 1:
+            count = min(workers, bad - good - 1)
+            qualities = sorted(set(good + max(1, (bad - good) * (i + 1) // (count + 1)) for i in range(count)))
+            for quality, data in pool.map(trial, qualities):
+                trials += 1
+                if len(data) <= max_bytes:
+                    if quality > good:
+                        good, good_data = quality, data
+                elif quality < bad:
+                    bad, bad_data = quality, data
+    if good_data is None:
+        return bad_data, bad, trials # Even the lowest quality is too big, give the smallest we have
+    return good_data, good, trials
+
+def describe(report):
+    # eg: "245 KB, quality 82 (6 trials), 38 ms"
+    text = f"{report['bytes'] / 1024:.0f} KB"
+    if report['quality'] is not None:
+        text += f", quality {report['quality']}"
+        if report['trials'] > 1:
+            text += f" ({report['trials']} trials)"
+    if report['over_budget']:
+        text += ", over the size limit"
+    return text + f", {report['ms']:.0f} ms"
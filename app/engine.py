@@ -0,0 +1,227 @@
+import os
+from PIL import Image
+from . import operations, loader, exiforient, resize, editgraph, encode
+from .writer import atomic_write
+
+# Headless versions of the editor's operations, shared by the GUI, the batch command line and the service
+
+CROP_ANCHORS = ("center", "top", "bottom", "left", "right")
+DRAFT_GAP = 2   # A resize that starts the recipe decodes JPEGs at no less than this many times the target size
+
+def ratio_crop_box(size, ratio, anchor="center"):
+    # Largest box of the given ratio (width / height) that fits in an image of `size`
+    if size[0] / size[1] > ratio:
+        h = size[1] # Full height
+        w = max(1, int(h * ratio))
+    else:
+        w = size[0] # Full width
+        h = max(1, int(w / ratio))
+    x = int(size[0] / 2) - int(w / 2)
+    y = int(size[1] / 2) - int(h / 2)
+    if anchor == "top":
+        y = 0
+    elif anchor == "bottom":
+        y = size[1] - h
+    elif anchor == "left":
+        x = 0
+    elif anchor == "right":
+        x = size[0] - w
+    return (x, y, x + w, y + h)
+
+def output_filename(filename, convert_to=None):
+    # The name file_save writes to: the same file, or the same name with the extension changed
+    parts = filename.split(".")
+    if convert_to is not None:
+        parts[-1] = convert_to
+    return ".".join(parts)
+
+def save_format(filename):
+    # The format the editor saves a filename as, or None if it is not one we write
+    ext = filename.split(".")[-1].lower()
+    if ext in ("jpg", "jpeg"):
+        return "jpeg"
+    elif ext == "png":
+        return "png"
+    return None
+
+def encoder(image, filename, profile=encode.DEFAULT_PROFILE, source=None, max_bytes=None):
+    # A function that writes `image` to a file object the way the editor saves `filename` (for atomic_write),
+    # with the settings of `profile` and what it carries over from `source` (see app/encode.py). It returns the encode report
+    fmt = save_format(filename)
+    def write(f):
+        data, report = encode.encode(image, fmt, profile, source, max_bytes)
+        f.write(data)
+        return report
+    return write
+
+def save_image(image, filename, profile=encode.DEFAULT_PROFILE, source=None, max_bytes=None):
+    # Save exactly as the editor does. Returns the encode report, or None if the extension is not one we write
+    if save_format(filename) is None:
+        return None
+    return atomic_write(filename, encoder(image, filename, profile, source, max_bytes))
+
+def parse_recipe(text):
+    # Turn "rotate:-90,crop:ratio=1.0:center,resize:long=2048,convert:png" into a list of steps.
+    # Rotations are anticlockwise degrees (so -90 is the editor's rotate right). Resizes are given as
+    # resize:50%, resize:1920x1080, resize:width=1920 (or height=), or resize:long=2048, with filter=lanczos etc.
+    # save:web (or high, small, original) picks the encoder profile, and save:kb=300 a size to fit JPEGs in
+    steps = []
+    for item in text.split(","):
+        item = item.strip()
+        if item == "":
+            continue
+        fields = item.split(":")
+        name = fields[0].lower()
+        args = {}
+        positional = []
+        for field in fields[1:]:
+            if "=" in field:
+                key, value = field.split("=", 1)
+                args[key.strip().lower()] = value.strip()
+            else:
+                positional.append(field.strip())
+        if name == "rotate":
+            angle = int(args.get('angle', positional[0] if positional else 90))
+            if angle % 90 != 0:
+                raise ValueError(f"Rotation must be a multiple of 90 degrees: {item}")
+            steps.append(operations.rotate(angle))
+        elif name == "crop":
+            ratio = args.get('ratio', 1.0)
+            anchor = args.get('anchor', "center").lower()
+            for field in positional:
+                try:
+                    ratio = float(field)
+                except ValueError:
+                    anchor = field.lower()
+            ratio = float(ratio)
+            if anchor == "centre":
+                anchor = "center"
+            if ratio <= 0 or anchor not in CROP_ANCHORS:
+                raise ValueError(f"Invalid crop: {item}")
+            steps.append({'op': 'ratio_crop', 'ratio': ratio, 'anchor': anchor})
+        elif name == "resize":
+            step = {'op': 'resize_to', 'mode': None, 'width': None, 'height': None, 'percent': None, 'long_edge': None, 'filter': args.get('filter', resize.DEFAULT_FILTER).lower()}
+            try:
+                for field in positional:
+                    if field.endswith("%"):
+                        step['mode'] = "percent"
+                        step['percent'] = float(field[:-1])
+                    elif "x" in field:
+                        step['mode'] = "pixels"
+                        step['width'], step['height'] = (int(v) for v in field.split("x"))
+                    else:
+                        raise ValueError
+                if 'percent' in args:
+                    step['mode'] = "percent"
+                    step['percent'] = float(args['percent'].rstrip("%"))
+                if 'width' in args or 'height' in args:
+                    step['mode'] = "pixels"
+                    step['width'] = int(args['width']) if 'width' in args else None
+                    step['height'] = int(args['height']) if 'height' in args else None
+                if 'long' in args:
+                    step['mode'] = "long_edge"
+                    step['long_edge'] = int(args['long'])
+            except ValueError:
+                raise ValueError(f"Invalid resize: {item}")
+            if step['mode'] is None or step['filter'] not in resize.FILTERS or any(step[key] is not None and step[key] <= 0 for key in ('width', 'height', 'percent', 'long_edge')):
+                raise ValueError(f"Invalid resize: {item}")
+            steps.append(step)
+        elif name == "convert":
+            fmt = args.get('format', positional[0] if positional else "").lower()
+            if fmt not in ("jpg", "jpeg", "png"):
+                raise ValueError(f"Can only convert to jpg or png: {item}")
+            steps.append({'op': 'convert', 'format': fmt})
+        elif name == "save":
+            profile = args.get('profile', positional[0] if positional else encode.DEFAULT_PROFILE).lower()
+            try:
+                max_kb = int(args['kb']) if 'kb' in args else None
+            except ValueError:
+                raise ValueError(f"Invalid save: {item}")
+            if profile not in encode.PROFILES or (max_kb is not None and max_kb <= 0):
+                raise ValueError(f"Invalid save: {item}")
+            steps.append({'op': 'save', 'profile': profile, 'max_bytes': max_kb * 1024 if max_kb is not None else None})
+        else:
+            raise ValueError(f"Unknown recipe step: {item}")
+    return steps
+
+def resolve(steps, size):
+    # Turn recipe steps into operation records for an image of `size`. Returns (ops, convert_to)
+    ops = []
+    convert_to = None
+    for step in steps:
+        if step['op'] == 'convert':
+            convert_to = step['format']
+            continue
+        if step['op'] == 'save':
+            continue
+        if step['op'] == 'ratio_crop':
+            step = operations.crop(ratio_crop_box(size, step['ratio'], step['anchor']))
+        elif step['op'] == 'resize_to':
+            step = operations.resize(resize.target_size(size, step['mode'], step['width'], step['height'], step['percent'], step['long_edge']), step['filter'])
+        ops.append(step)
+        size = operations.result_size(size, step)
+    return ops, convert_to
+
+def save_settings(steps):
+    # The encoder profile and byte budget a recipe asks for (see app/encode.py)
+    profile, max_bytes = encode.DEFAULT_PROFILE, None
+    for step in steps:
+        if step['op'] == 'save':
+            profile, max_bytes = step['profile'], step['max_bytes']
+    return profile, max_bytes
+
+def target_filename(filename, convert_to=None, output_dir=None, root=None):
+    # Where a processed file is written: in place like the editor, or mirrored into output_dir
+    target = output_filename(filename, convert_to)
+    if output_dir is not None:
+        if root is not None:
+            relative = os.path.relpath(target, root)
+        else:
+            relative = os.path.basename(target)
+        target = os.path.join(output_dir, relative)
+    return target
+
+def process_file(filename, steps, output_dir=None, root=None):
+    # Apply a recipe to one file and save the result the way the editor's file_save would.
+    # Returns (output filename, method, report) where method is "orientation" or "encode", and report is
+    # the encoder's (see app/encode.py), None for orientation
+    info = {}
+    image = None
+    profile, max_bytes = save_settings(steps)
+    if all(step['op'] in ('rotate', 'convert', 'save') for step in steps) and profile == encode.DEFAULT_PROFILE and max_bytes is None:
+        ops, convert_to = resolve(steps, (1, 1))
+    else:
+        size = loader.upright_size(filename)
+        ops, convert_to = resolve(steps, size)
+        ops = editgraph.optimize(ops, size) # eg: rotate then resize becomes resize then rotate, which the draft decode below suits
+        if len(ops) > 0 and ops[0]['op'] == 'resize' and ops[0]['size'][0] * DRAFT_GAP <= size[0] and ops[0]['size'][1] * DRAFT_GAP <= size[1]:
+            # A large reduction first: don't decode more pixels than it needs
+            image = loader.open_reduced(filename, (ops[0]['size'][0] * DRAFT_GAP, ops[0]['size'][1] * DRAFT_GAP), info)
+        else:
+            image = loader.open_full(filename, info)
+    target = target_filename(filename, convert_to, output_dir, root)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    if image is None and output_filename(filename, convert_to) == filename and filename.split(".")[-1].lower() in ("jpg", "jpeg"):
+        # Rotations only: rewrite the EXIF orientation as the editor does, no re-encode
+        with open(filename, "rb") as f:
+            data = f.read()
+        try:
+            with Image.open(filename) as probe:
+                is_jpeg = probe.format == "JPEG"
+                orientation = exiforient.get_orientation(probe)
+        except Exception:
+            is_jpeg = False
+        if is_jpeg:
+            angle = sum(op['angle'] for op in ops) % 360
+            data = exiforient.set_orientation(data, exiforient.rotate(orientation, angle))
+            if data is not None:
+                atomic_write(target, lambda f: f.write(data))
+                return target, "orientation", None
+    if image is None:
+        image = loader.open_full(filename, info)
+    for op in ops:
+        image = operations.apply(image, op)
+    report = save_image(image, target, profile, encode.source_settings(filename), max_bytes)
+    if report is None:
+        raise ValueError(f"Don't know how to save {target}")
+    return target, "encode", report
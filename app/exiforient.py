@@ -0,0 +1,151 @@
+import os
+import struct
+from PIL import Image
+from .writer import atomic_write
+
+# Reading and rewriting the EXIF Orientation tag of JPEG files without touching the compressed image data
+
+ORIENTATION_TAG = 0x0112
+
+# Transpose that turns the stored pixels into the displayed image, for each orientation value
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+ROTATE_TRANSPOSE = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+def get_orientation(image):
+    # Orientation value (1-8) of an opened image, 1 if it has none
+    try:
+        orientation = image.getexif().get(ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+    if orientation not in ORIENTATION_TRANSPOSE:
+        return 1
+    return orientation
+
+def swaps_axes(orientation):
+    return orientation in (5, 6, 7, 8)
+
+def orient(image, orientation):
+    # Apply an orientation value to stored pixels, giving the image as it should be displayed
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    if method is None:
+        return image
+    return image.transpose(method)
+
+def _build_rotation_table():
+    # rotated[(orientation, angle)] = orientation that displays the same pixels rotated anticlockwise by angle.
+    # Worked out by applying the transforms to a tiny image with distinct pixels
+    probe = Image.new("L", (3, 2))
+    probe.putdata([0, 1, 2, 3, 4, 5])
+    def signature(image):
+        return (image.size, image.tobytes())
+    by_signature = {}
+    for orientation in range(1, 9):
+        by_signature[signature(orient(probe, orientation))] = orientation
+    table = {}
+    for orientation in range(1, 9):
+        for angle in (0, 90, 180, 270):
+            shown = orient(probe, orientation)
+            if angle in ROTATE_TRANSPOSE:
+                shown = shown.transpose(ROTATE_TRANSPOSE[angle])
+            table[(orientation, angle)] = by_signature[signature(shown)]
+    return table
+
+ROTATED = _build_rotation_table()
+
+def rotate(orientation, angle):
+    # Orientation value after rotating the displayed image anticlockwise by angle (a multiple of 90)
+    return ROTATED[(orientation, angle % 360)]
+
+def _segments(data):
+    # Yield (marker, start of segment data, length of segment data) for the JPEG header segments
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return
+        marker = data[pos+1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack(">H", data[pos+2:pos+4])[0]
+        yield marker, pos + 4, length - 2
+        if marker == 0xDA:  # Start of scan, compressed data follows
+            return
+        pos += 2 + length
+
+def find_orientation(data):
+    # Byte offset of the Orientation value in a JPEG's EXIF block, or None if it has no such tag.
+    # Returns (offset, endian) or (None, None)
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+    for marker, start, length in _segments(data):
+        if marker == 0xE1 and data[start:start+6] == b"Exif\x00\x00":
+            tiff = start + 6
+            endian = {b"II": "<", b"MM": ">"}.get(data[tiff:tiff+2])
+            if endian is None:
+                return None, None
+            ifd = tiff + struct.unpack(endian + "I", data[tiff+4:tiff+8])[0]
+            count = struct.unpack(endian + "H", data[ifd:ifd+2])[0]
+            for i in range(count):
+                entry = ifd + 2 + i * 12
+                tag, kind = struct.unpack(endian + "HH", data[entry:entry+4])
+                if tag == ORIENTATION_TAG and kind == 3:
+                    return entry + 8, endian
+            return None, None
+    return None, None
+
+def exif_segment(orientation):
+    # A minimal APP1 segment holding only an Orientation tag
+    tiff = b"MM\x00\x2a" + struct.pack(">I", 8) + struct.pack(">H", 1)
+    tiff += struct.pack(">HHIHH", ORIENTATION_TAG, 3, 1, orientation, 0) + struct.pack(">I", 0)
+    payload = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+def set_orientation(data, orientation):
+    # Return the JPEG bytes with the orientation changed (the compressed image data is untouched),
+    # or None if the file has EXIF data but no orientation tag we can patch
+    offset, endian = find_orientation(data)
+    if offset is not None:
+        return data[:offset] + struct.pack(endian + "H", orientation) + data[offset+2:]
+    for marker, start, length in _segments(data):
+        if marker == 0xE1 and data[start:start+6] == b"Exif\x00\x00":
+            return None
+    # No EXIF at all: insert our own segment after SOI and any APP0 (JFIF) segment
+    insert = 2
+    for marker, start, length in _segments(data):
+        if marker == 0xE0:
+            insert = start + length
+        break
+    return data[:insert] + exif_segment(orientation) + data[insert:]
+
+def write_orientation(filename, orientation):
+    # Change the orientation of a JPEG file in place. Returns False if that can't be done losslessly
+    with open(filename, "rb") as f:
+        data = f.read()
+    try:
+        offset, endian = find_orientation(data)
+    except ValueError:
+        return False
+    if offset is not None:
+        # Same length, so just overwrite the two bytes
+        with open(filename, "r+b") as f:
+            f.seek(offset)
+            f.write(struct.pack(endian + "H", orientation))
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    data = set_orientation(data, orientation)
+    if data is None:
+        return False
+    atomic_write(filename, lambda f: f.write(data))
+    return True
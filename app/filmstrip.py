@@ -0,0 +1,160 @@
+import io
+import os
+import tkinter as tk
+from PIL import Image, ImageTk
+from .thumbnails import THUMBNAIL_SIZE, ThumbnailGenerator, file_key
+
+CELL_PADDING = 4
+PRELOAD = 10        # Thumbnails either side of the visible ones to generate in advance
+POLL_MS = 50
+
+class Filmstrip():
+    # A horizontally scrolling strip of thumbnails for the files in a folder. Only the cells in view have
+    # canvas items and PhotoImages; everything else is just a position in `files`
+    def __init__(self, parent, store, on_select, background="gray90"):
+        self.store = store
+        self.generator = ThumbnailGenerator(store)
+        self.on_select = on_select     # Called with the name of the file clicked on
+        self.folder = None
+        self.files = []
+        self.current = -1
+        self.shown = {}     # index -> (canvas image item, PhotoImage)
+        self.failed = set() # paths that could not be thumbnailed
+        self.polling = False
+        self.cell = (THUMBNAIL_SIZE[0] + CELL_PADDING, THUMBNAIL_SIZE[1] + CELL_PADDING)
+        self.frame = tk.Frame(parent, background=background)
+        self.canvas = tk.Canvas(self.frame, height=self.cell[1], background=background, highlightthickness=0, xscrollincrement=self.cell[0])
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.scroll)
+        self.canvas.config(xscrollcommand=self.scrolled)
+        self.scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.highlight = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2, state=tk.HIDDEN)
+        self.canvas.bind('<Configure>', lambda event: self.refresh())
+        self.canvas.bind('<ButtonRelease-1>', self.click)
+        self.canvas.bind('<MouseWheel>', self.wheel)
+        self.canvas.bind('<Button-4>', self.wheel)
+        self.canvas.bind('<Button-5>', self.wheel)
+
+    def path(self, i):
+        return self.folder + "/" + self.files[i]
+
+    def set_folder(self, folder, files, current):
+        # Show `files` (names relative to `folder`, in order), with `current` highlighted and scrolled into view
+        if folder != self.folder or files != self.files:
+            self.folder = folder
+            self.files = list(files)
+            for item, photo in self.shown.values():
+                self.canvas.delete(item)
+            self.shown = {}
+            self.canvas.config(scrollregion=(0, 0, len(self.files) * self.cell[0], self.cell[1]))
+        self.current = current
+        if current >= 0:
+            x = current * self.cell[0]
+            self.canvas.coords(self.highlight, x + 1, 1, x + self.cell[0] - 1, self.cell[1] - 1)
+            self.canvas.itemconfig(self.highlight, state=tk.NORMAL)
+            self.canvas.tag_raise(self.highlight)
+            self.scroll_into_view(current)
+        else:
+            self.canvas.itemconfig(self.highlight, state=tk.HIDDEN)
+        self.refresh()
+
+    def scroll_into_view(self, i):
+        width = max(1, self.canvas.winfo_width())
+        total = max(1, len(self.files) * self.cell[0])
+        left = self.canvas.canvasx(0)
+        x = i * self.cell[0]
+        if x < left or x + self.cell[0] > left + width:
+            self.canvas.xview_moveto(max(0, x + self.cell[0] / 2 - width / 2) / total)
+
+    def visible(self):
+        # Range of file indexes in view
+        left = self.canvas.canvasx(0)
+        width = max(1, self.canvas.winfo_width())
+        first = max(0, int(left // self.cell[0]))
+        last = min(len(self.files), int((left + width) // self.cell[0]) + 1)
+        return first, last
+
+    def refresh(self):
+        # Draw the thumbnails now in view from the cache, and ask for the missing ones to be made (visible ones first)
+        if self.folder is None:
+            return
+        first, last = self.visible()
+        for i in list(self.shown):
+            if i < first or i >= last:
+                self.canvas.delete(self.shown.pop(i)[0])
+        wanted = []
+        for i in range(first, last):
+            if i not in self.shown and not self.draw(i):
+                wanted.append(self.path(i))
+        for i in list(range(last, min(len(self.files), last + PRELOAD))) + list(range(max(0, first - PRELOAD), first)):
+            path = self.path(i)
+            if path not in self.failed and not self.store.has(path, file_key(path)):
+                wanted.append(path)
+        wanted = [path for path in wanted if path not in self.failed]
+        self.generator.request(wanted)
+        if len(wanted) > 0 and not self.polling:
+            self.poll()
+
+    def draw(self, i, data=None):
+        # Put thumbnail i on the canvas. Returns False if there isn't one yet
+        path = self.path(i)
+        if data is None:
+            data = self.store.get(path, file_key(path))
+            if data is None:
+                return False
+        photo = ImageTk.PhotoImage(Image.open(io.BytesIO(data)), master=self.canvas)
+        x = i * self.cell[0] + self.cell[0] // 2
+        item = self.canvas.create_image(x, self.cell[1] // 2, image=photo)
+        if i in self.shown:
+            self.canvas.delete(self.shown[i][0])
+        self.shown[i] = (item, photo)
+        self.canvas.tag_raise(self.highlight)
+        return True
+
+    def poll(self):
+        # Draw thumbnails as the generator finishes them, checking back while it is busy
+        self.polling = False
+        if self.folder is None:
+            return
+        first, last = self.visible()
+        for path, data in self.generator.poll():
+            if data is None:
+                self.failed.add(path)
+                continue
+            name = os.path.relpath(path, self.folder).replace(os.sep, "/")
+            if name.startswith(".."):
+                continue # From a folder we have since left
+            for i in range(first, last):
+                if self.files[i] == name:
+                    self.draw(i, data)
+                    break
+        if self.generator.busy() and not self.polling:
+            self.polling = True
+            self.canvas.after(POLL_MS, self.poll)
+
+    def scroll(self, *args):
+        self.canvas.xview(*args)
+        self.refresh()
+
+    def scrolled(self, first, last):
+        self.scrollbar.set(first, last)
+
+    def wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.xview_scroll(-1, "units")
+        else:
+            self.canvas.xview_scroll(1, "units")
+        self.refresh()
+
+    def click(self, event):
+        i = int(self.canvas.canvasx(event.x) // self.cell[0])
+        if 0 <= i < len(self.files) and i != self.current:
+            self.on_select(self.files[i])
+
+    def clear(self):
+        self.current = -1
+        self.canvas.itemconfig(self.highlight, state=tk.HIDDEN)
+
+    def shutdown(self):
+        self.generator.shutdown()
+        self.store.close()
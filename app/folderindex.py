@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import time
+import bisect
+import logging
+from . import trace
+from .writer import atomic_write
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+MAX_FOLDERS = 20            # Number of folder indexes kept in the index file
+REFRESH_INTERVAL = 1.0      # Minimum seconds between checks of the folder for changes
+
+def natural_key(name):
+    # Sort key where "img2.jpg" comes before "img10.jpg"
+    parts = re.split(r'(\d+)', name.lower())
+    return [int(part) if i % 2 else part for i, part in enumerate(parts)]
+
+class FolderIndex():
+    # Sorted list of the image files in a folder, kept up to date from directory modification times
+    def __init__(self, folder, extensions, recursive=False, natural=True):
+        self.folder = folder
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.recursive = recursive
+        self.natural = natural
+        self.files = []         # Paths relative to self.folder, in sorted order
+        self.keys = []          # Sort key of each entry in self.files
+        self.dirs = {}          # Relative directory -> modification time when it was last scanned
+        self.checked = 0        # When we last looked for changes
+
+    def sort_key(self, name):
+        if self.natural:
+            return (natural_key(name), name)
+        return name
+
+    def path(self, name):
+        return self.folder + "/" + name
+
+    def relative_name(self, filename):
+        return os.path.relpath(filename, self.folder).replace(os.sep, "/")
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        return self.files[i]
+
+    def position(self, name):
+        # Index of `name` in the sorted list, or -1 (binary search)
+        key = self.sort_key(name)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.files) and self.files[i] == name:
+            return i
+        return -1
+
+    def neighbour(self, name, offset):
+        # The file `offset` places away from `name`, wrapping around at either end.
+        # A name no longer in the folder (eg: just deleted) counts as sitting where it would sort
+        if len(self.files) == 0 or name is None:
+            return None
+        i = self.position(name)
+        if i < 0:
+            i = bisect.bisect_left(self.keys, self.sort_key(name))
+            if offset > 0:
+                offset -= 1
+        return self.files[(i + offset) % len(self.files)]
+
+    def insert(self, name):
+        key = self.sort_key(name)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.files) and self.files[i] == name:
+            return
+        self.keys.insert(i, key)
+        self.files.insert(i, name)
+
+    def remove(self, name):
+        i = self.position(name)
+        if i >= 0:
+            del self.keys[i]
+            del self.files[i]
+
+    @trace.traced("scan_dir")
+    def scan_dir(self, rel):
+        # Stream one directory, returning the image files and sub directories it contains
+        files = []
+        subdirs = []
+        path = self.folder if rel == "" else self.path(rel)
+        prefix = "" if rel == "" else rel + "/"
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        if entry.name.split(".")[-1].lower() in self.extensions:
+                            files.append(prefix + entry.name)
+                    elif self.recursive and entry.is_dir() and not entry.name.startswith("."):
+                        subdirs.append(prefix + entry.name)
+                except OSError:
+                    pass
+        trace.annotate(dir=rel, files=len(files))
+        return files, subdirs
+
+    def files_in_dir(self, rel):
+        prefix = "" if rel == "" else rel + "/"
+        return [f for f in self.files if f.startswith(prefix) and "/" not in f[len(prefix):]]
+
+    @trace.traced("folder_rebuild")
+    def rebuild(self):
+        self.files = []
+        self.keys = []
+        self.dirs = {}
+        names = []
+        todo = [""]
+        while len(todo) > 0:
+            rel = todo.pop()
+            try:
+                mtime = os.stat(self.folder if rel == "" else self.path(rel)).st_mtime
+                files, subdirs = self.scan_dir(rel)
+            except OSError:
+                continue
+            self.dirs[rel] = mtime
+            names.extend(files)
+            todo.extend(subdirs)
+        names.sort(key=self.sort_key)
+        self.files = names
+        self.keys = [self.sort_key(name) for name in names]
+        self.checked = time.monotonic()
+        trace.annotate(folder=self.folder, files=len(names))
+
+    def refresh(self, force=False):
+        # Rescan only the directories whose modification time has changed. Returns True if the list changed
+        if not force and time.monotonic() - self.checked < REFRESH_INTERVAL:
+            return False
+        with trace.span("folder_refresh", folder=self.folder):
+            return self._refresh()
+
+    def _refresh(self):
+        self.checked = time.monotonic()
+        if len(self.dirs) == 0:
+            self.rebuild()
+            return True
+        changed = False
+        todo = list(self.dirs)
+        while len(todo) > 0:
+            rel = todo.pop()
+            try:
+                mtime = os.stat(self.folder if rel == "" else self.path(rel)).st_mtime
+            except OSError:
+                # Directory has gone, forget everything we knew about it
+                for name in self.files_in_dir(rel):
+                    self.remove(name)
+                self.dirs.pop(rel, None)
+                changed = True
+                continue
+            if self.dirs.get(rel) == mtime:
+                continue
+            try:
+                files, subdirs = self.scan_dir(rel)
+            except OSError:
+                continue
+            self.dirs[rel] = mtime
+            current = set(self.files_in_dir(rel))
+            found = set(files)
+            for name in current - found:
+                self.remove(name)
+            for name in found - current:
+                self.insert(name)
+            for subdir in subdirs:
+                if subdir not in self.dirs:
+                    todo.append(subdir)
+            if current != found:
+                changed = True
+        return changed
+
+    def to_dict(self):
+        return {'recursive': self.recursive, 'natural': self.natural, 'dirs': self.dirs, 'files': self.files}
+
+    @classmethod
+    def from_dict(cls, folder, extensions, data):
+        index = cls(folder, extensions, recursive=data['recursive'], natural=data['natural'])
+        index.files = list(data['files'])
+        index.keys = [index.sort_key(name) for name in index.files]
+        index.dirs = dict(data['dirs'])
+        return index
+
+class FolderIndexStore():
+    # Folder indexes for recently used folders, persisted between sessions in one JSON file
+    def __init__(self, filename, extensions):
+        self.filename = filename
+        self.extensions = extensions
+        self.indexes = {}
+        self.saved = {}         # Raw data loaded from the file, turned into FolderIndex objects on first use
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self.saved = data['folders']
+            except:
+                log.warning("Error reading %s. Invalid content?", self.filename)
+
+    def save(self):
+        if not self.dirty:
+            return
+        folders = dict(self.saved)
+        for folder, index in self.indexes.items():
+            folders.pop(folder, None)
+            folders[folder] = index.to_dict()
+        # Most recently used folders are last, keep the newest
+        folders = dict(list(folders.items())[-MAX_FOLDERS:])
+        data = json.dumps({'version': INDEX_VERSION, 'folders': folders}, separators=(",", ":"))
+        try:
+            atomic_write(self.filename, lambda f: f.write(data.encode("utf-8")))
+            self.dirty = False
+        except OSError:
+            log.warning("Unable to write %s", self.filename)
+
+    def get(self, folder, recursive=False, natural=True):
+        # Return the up to date index for a folder
+        key = os.path.abspath(folder)
+        index = self.indexes.get(key)
+        if index is not None and (index.recursive != recursive or index.natural != natural):
+            index = None
+        if index is None:
+            data = self.saved.pop(key, None)
+            if data is not None and data['recursive'] == recursive and data['natural'] == natural:
+                index = FolderIndex.from_dict(folder, self.extensions, data)
+            else:
+                index = FolderIndex(folder, self.extensions, recursive=recursive, natural=natural)
+            self.indexes.pop(key, None)
+            self.indexes[key] = index
+            self.dirty = True
+        else:
+            index.folder = folder
+        if index.refresh(force=index.checked == 0):
+            self.dirty = True
+        return index
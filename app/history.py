@@ -0,0 +1,269 @@
+import zlib
+import tempfile
+import threading
+from PIL import Image
+from . import operations, editgraph, loader
+
+TILE_SIZE = 256
+
+def tile_boxes(size, bbox):
+    # The tiles of an image of `size` that intersect bbox
+    for y in range((bbox[1] // TILE_SIZE) * TILE_SIZE, bbox[3], TILE_SIZE):
+        for x in range((bbox[0] // TILE_SIZE) * TILE_SIZE, bbox[2], TILE_SIZE):
+            yield (x, y, min(x + TILE_SIZE, size[0]), min(y + TILE_SIZE, size[1]))
+
+class TileStore():
+    # Compressed image tiles held in RAM up to a budget, older tiles spilled to a temporary file
+    def __init__(self, budget):
+        self.budget = budget
+        self.blobs = {}         # id -> bytes (in RAM) or (offset, length) (spilled)
+        self.order = []         # Blob ids oldest first, for spilling
+        self.ram = 0
+        self.next_id = 0
+        self.spill_file = None
+        self.spill_end = 0
+        self.lock = threading.Lock()
+
+    def put(self, data):
+        with self.lock:
+            blob_id = self.next_id
+            self.next_id += 1
+            self.blobs[blob_id] = data
+            self.order.append(blob_id)
+            self.ram += len(data)
+            while self.ram > self.budget and len(self.order) > 0:
+                self._spill(self.order.pop(0))
+            return blob_id
+
+    def get(self, blob_id):
+        with self.lock:
+            blob = self.blobs[blob_id]
+            if isinstance(blob, tuple):
+                self.spill_file.seek(blob[0])
+                return self.spill_file.read(blob[1])
+            return blob
+
+    def release(self, blob_id):
+        with self.lock:
+            blob = self.blobs.pop(blob_id, None)
+            if isinstance(blob, bytes):
+                self.ram -= len(blob)
+                self.order.remove(blob_id)
+
+    def _spill(self, blob_id):
+        blob = self.blobs[blob_id]
+        if not isinstance(blob, bytes):
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="image-editor-history-")
+        self.spill_file.seek(self.spill_end)
+        self.spill_file.write(blob)
+        self.blobs[blob_id] = (self.spill_end, len(blob))
+        self.spill_end += len(blob)
+        self.ram -= len(blob)
+
+    def shrink(self, nbytes):
+        # Spill the oldest tiles in RAM until `nbytes` are freed. Returns the bytes freed
+        with self.lock:
+            before = self.ram
+            while len(self.order) > 0 and before - self.ram < nbytes:
+                self._spill(self.order.pop(0))
+            return before - self.ram
+
+    def spilled(self):
+        return self.spill_end
+
+    def clear(self):
+        with self.lock:
+            self.blobs = {}
+            self.order = []
+            self.ram = 0
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+            self.spill_end = 0
+
+class History():
+    # Undo/redo history made of operation records (see operations.py).
+    # Rotations, crops and resizes are lazy (see add): they are only listed in `pending` until the image's
+    # pixels are needed, when materialize() runs them all at once (see app/editgraph.py). Undoing or redoing
+    # one that is still pending costs nothing. Edits applied straight away (strokes) keep a snapshot of the
+    # tiles they destroy, compressed, within a RAM budget (older tiles spill to disk), as does materialize().
+    def __init__(self, budget):
+        self.store = TileStore(budget)
+        self.undo_stack = []    # {'op': record, 'snapshot': snapshot or None, 'lazy': bool, 'group': checkpoint or None}
+        self.redo_stack = []
+        self.pending = []       # Lazy ops not yet applied to the image
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def clear(self):
+        self.undo_stack = []
+        self.redo_stack = []
+        self.pending = []
+        self.store.clear()
+
+    def snapshot(self, image, bbox=None, keep=None):
+        # Compress the tiles of `image` that intersect bbox (default: all), except those entirely
+        # inside `keep`, a box whose pixels survive the edit (eg: the area kept by a crop)
+        if bbox is None:
+            bbox = (0, 0, image.size[0], image.size[1])
+        tiles = []
+        for box in tile_boxes(image.size, bbox):
+            if keep is not None and box[0] >= keep[0] and box[1] >= keep[1] and box[2] <= keep[2] and box[3] <= keep[3]:
+                continue
+            data = zlib.compress(image.crop(box).tobytes(), 1)
+            tiles.append((box, self.store.put(data)))
+        return {'size': image.size, 'mode': image.mode, 'palette': image.getpalette() if image.mode == "P" else None, 'tiles': tiles, 'keep': keep, 'full': bbox == (0, 0, image.size[0], image.size[1])}
+
+    def save_tiles(self, image, bbox, saved):
+        # For edits made in place (strokes): before drawing inside bbox, add the tiles there that aren't in
+        # `saved` yet ({box: blob id}), so each tile is kept as it was before the edit began
+        for box in tile_boxes(image.size, bbox):
+            if box not in saved:
+                saved[box] = self.store.put(zlib.compress(image.crop(box).tobytes(), 1))
+
+    def tile_snapshot(self, image, saved):
+        # Snapshot made from save_tiles() for the image the tiles were saved from
+        return {'size': image.size, 'mode': image.mode, 'palette': image.getpalette() if image.mode == "P" else None, 'tiles': list(saved.items()), 'keep': None, 'full': False}
+
+    def restore(self, snapshot, current):
+        # Rebuild the image a snapshot was taken from, given the image as it is now
+        if snapshot['keep'] is not None:
+            image = Image.new(snapshot['mode'], snapshot['size'])
+            image.paste(current, snapshot['keep'][:2])
+        elif snapshot['full']:
+            image = Image.new(snapshot['mode'], snapshot['size'])
+        else:
+            image = current.copy()
+        for box, blob_id in snapshot['tiles']:
+            data = zlib.decompress(self.store.get(blob_id))
+            tile = Image.frombytes(snapshot['mode'], (box[2] - box[0], box[3] - box[1]), data)
+            image.paste(tile, box[:2])
+        if snapshot['palette'] is not None:
+            image.putpalette(snapshot['palette'])
+        return image
+
+    def release(self, entry):
+        if entry['snapshot'] is not None:
+            for box, blob_id in entry['snapshot']['tiles']:
+                self.store.release(blob_id)
+
+    def record(self, op, before, bbox=None, snapshot=None):
+        # Remember `op`, which has just been applied to `before` (with nothing pending). `bbox` limits the snapshot
+        # to the pixels the op changed. An op applied in place passes the snapshot made while it was applied instead (see save_tiles)
+        if snapshot is None and operations.invert(op) is None:
+            keep = op['box'] if op['op'] == 'crop' else None
+            snapshot = self.snapshot(before, bbox, keep)
+        self.forget_redo()
+        self.undo_stack.append({'op': op, 'snapshot': snapshot, 'lazy': False, 'group': None})
+
+    def add(self, op):
+        # Remember `op` without applying it to anything yet
+        self.forget_redo()
+        self.undo_stack.append({'op': op, 'snapshot': None, 'lazy': True, 'group': None})
+        self.pending.append(op)
+
+    def forget_redo(self):
+        for entry in self.redo_stack:
+            self.release(entry)
+        self.redo_stack = []
+
+    def materialize(self, image):
+        # Apply the pending ops to `image` as one optimised chain and return the result. Enough of `image`
+        # is kept to undo any of them: the ops are put back to pending and the image restored (see undo)
+        if len(self.pending) == 0:
+            return image
+        ops = editgraph.optimize(self.pending, image.size)
+        rotation = ops.pop(-1) if len(ops) > 0 and ops[-1]['op'] == 'rotate' else None
+        if len(ops) == 0:
+            snapshot = None # Rotation only, undone by rotating back
+        elif len(ops) == 1 and ops[0]['op'] == 'crop':
+            snapshot = self.snapshot(image, keep=ops[0]['box'])
+        else:
+            snapshot = self.snapshot(image)
+        group = {'ops': self.pending, 'rotation': rotation, 'snapshot': snapshot}
+        for entry in self.undo_stack:
+            if entry['lazy'] and entry['group'] is None:
+                entry['group'] = group
+        with loader.large_images():   # Image.crop checks Pillow's limit too, and the user may have opened a larger image
+            image = editgraph.apply(image, self.pending)
+        self.pending = []
+        return image
+
+    def unmaterialize(self, group, image):
+        # Undo a materialize(): the image as it was, with its ops pending again
+        if group['rotation'] is not None:
+            image = operations.apply(image, operations.invert(group['rotation']))
+        if group['snapshot'] is not None:
+            image = self.restore(group['snapshot'], image)
+            for box, blob_id in group['snapshot']['tiles']:
+                self.store.release(blob_id)
+        for entry in self.undo_stack:
+            if entry['group'] is group:
+                entry['group'] = None
+        self.pending = list(group['ops'])
+        return image
+
+    def net_rotation(self):
+        # Total anticlockwise rotation if every step in the history is a rotation, otherwise None
+        angle = 0
+        for entry in self.undo_stack:
+            if entry['op']['op'] != 'rotate':
+                return None
+            angle += entry['op']['angle']
+        return angle % 360
+
+    def peek(self):
+        # The operation that undo() would revert
+        if len(self.undo_stack) > 0:
+            return self.undo_stack[-1]['op']
+        return None
+
+    def undo(self, image):
+        entry = self.undo_stack[-1]
+        if entry['group'] is not None:
+            image = self.unmaterialize(entry['group'], image)
+        self.undo_stack.pop(-1)
+        if entry['lazy']:
+            self.pending.pop(-1)
+        elif entry['snapshot'] is None:
+            image = operations.apply(image, operations.invert(entry['op']))
+        else:
+            image = self.restore(entry['snapshot'], image)
+        self.redo_stack.append(entry)
+        return image
+
+    def redo_needs_image(self):
+        # Does redo() need the image's pixels (rather than just adding a lazy op)?
+        return len(self.redo_stack) > 0 and not self.redo_stack[-1]['lazy']
+
+    def redo(self, image):
+        entry = self.redo_stack.pop(-1)
+        if entry['lazy']:
+            self.pending.append(entry['op'])
+        else:
+            image = self.materialize(image)
+            image = operations.apply(image, entry['op'])
+            # The snapshot was taken from the same state, so it is still valid for undo
+        self.undo_stack.append(entry)
+        return entry['op'], image
+
+    def rewind(self):
+        # Forget position without losing anything: everything becomes redo-able from the original image
+        for entry in self.undo_stack:
+            if entry['group'] is not None and entry['group']['snapshot'] is not None:
+                for box, blob_id in entry['group']['snapshot']['tiles']:
+                    self.store.release(blob_id)
+                entry['group']['snapshot'] = None
+            entry['group'] = None
+        self.redo_stack.extend(reversed(self.undo_stack))
+        self.undo_stack = []
+        self.pending = []
+
+    def nbytes(self):
+        return self.store.ram
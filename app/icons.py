@@ -0,0 +1,75 @@
+import os
+import tkinter as tk
+from PIL import Image, ImageTk
+
+# Toolbar icons are packed into one sprite atlas per state (assets/icons-enabled.png, assets/icons-disabled.png),
+# built from the matching assets/icons-<state>/ folder. An atlas is only decoded when the first icon in that
+# state is asked for, and each icon is cut out of it on first use.
+
+ICON_SIZE = 50
+ICON_FILES = {
+    "previous": "icons8-back-50.png",
+    "crop": "icons8-crop-50.png",
+    "delete": "icons8-delete-bin-50.png",
+    "erase": "icons8-erase-50.png",
+    "fill-color": "icons8-fill-color-50.png",
+    "next": "icons8-forward-50.png",
+    "line": "icons8-line-50.png",
+    "ellipse": "icons8-oval-50.png",
+    "paint": "icons8-paint-palette-50.png",
+    "pen": "icons8-pen-50.png",
+    "rectangle": "icons8-rectangular-50.png",
+    "resize": "icons8-resize-50.png",
+    "save": "icons8-save-50.png",
+    "text": "icons8-text-box-50.png",
+    "rotate-left": "icons8-rotate-left-50.png",
+    "rotate-right": "icons8-rotate-right-50.png",
+}
+ICON_NAMES = tuple(ICON_FILES)  # Position of each icon in the atlas, left to right
+STATES = ("enabled", "disabled")
+
+def atlas_path(assets, state):
+    return os.path.join(assets, f"icons-{state}.png")
+
+def build_atlas(assets, state):
+    # Paste the separate icon files side by side into a single image
+    atlas = Image.new("RGBA", (ICON_SIZE * len(ICON_NAMES), ICON_SIZE))
+    for i, name in enumerate(ICON_NAMES):
+        with Image.open(os.path.join(assets, f"icons-{state}", ICON_FILES[name])) as icon:
+            atlas.paste(icon.convert("RGBA"), (i * ICON_SIZE, 0))
+    return atlas
+
+def save_atlases(assets):
+    # Regenerate the atlas files after changing the icons: python -m app.icons [assets folder]
+    for state in STATES:
+        build_atlas(assets, state).save(atlas_path(assets, state), optimize=True)
+
+class IconAtlas():
+    def __init__(self, master, assets):
+        self.master = master
+        self.assets = assets
+        self.sheets = {}    # state -> PhotoImage holding the whole atlas
+        self.icons = {}     # (name, state) -> PhotoImage
+
+    def sheet(self, state):
+        if state not in self.sheets:
+            filename = atlas_path(self.assets, state)
+            if os.path.exists(filename):
+                self.sheets[state] = tk.PhotoImage(master=self.master, file=filename)
+            else:
+                self.sheets[state] = ImageTk.PhotoImage(build_atlas(self.assets, state), master=self.master)
+        return self.sheets[state]
+
+    def get(self, name, enabled=True):
+        state = STATES[0] if enabled else STATES[1]
+        key = (name, state)
+        if key not in self.icons:
+            i = ICON_NAMES.index(name)
+            icon = tk.PhotoImage(master=self.master, width=ICON_SIZE, height=ICON_SIZE)
+            icon.tk.call(icon, "copy", self.sheet(state), "-from", i * ICON_SIZE, 0, (i + 1) * ICON_SIZE, ICON_SIZE, "-to", 0, 0)
+            self.icons[key] = icon
+        return self.icons[key]
+
+if __name__ == "__main__":
+    import sys
+    save_atlases(sys.argv[1] if len(sys.argv) > 1 else "assets")
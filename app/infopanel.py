@@ -0,0 +1,100 @@
+import tkinter as tk
+from .metadata import read_metadata, histogram
+
+ROWS = 12           # Metadata lines; the labels are made once and reused for every image
+GRAPH_SIZE = (256, 80)
+POLL_MS = 50
+CHANNELS = (("luminance", "gray40"), ("red", "red"), ("green", "green3"), ("blue", "blue"))
+
+class InfoPanel():
+    # File details, EXIF data and a histogram of the image on screen, worked out on a background thread
+    # (see app/metadata.py) while the panel is open. Nothing is done for images passed while it is closed
+    def __init__(self, parent, worker, background="gray90"):
+        self.worker = worker
+        self.frame = tk.Frame(parent, background=background, borderwidth=1, relief=tk.GROOVE)
+        self.rows = []
+        for i in range(ROWS):
+            label = tk.Label(self.frame, text="", font=('Arial', 10), bg=background, anchor="w", justify=tk.LEFT)
+            label.pack(side=tk.TOP, fill=tk.X, padx=5)
+            self.rows.append(label)
+        self.graph = tk.Canvas(self.frame, width=GRAPH_SIZE[0], height=GRAPH_SIZE[1], background="white", highlightthickness=0)
+        self.graph.pack(side=tk.TOP, padx=5, pady=5)
+        self.lines = {name: self.graph.create_line(0, GRAPH_SIZE[1], GRAPH_SIZE[0], GRAPH_SIZE[1], fill=colour) for name, colour in CHANNELS}
+        self.clipping = tk.Label(self.frame, text="", font=('Arial', 10), bg=background, anchor="w")
+        self.clipping.pack(side=tk.TOP, fill=tk.X, padx=5, pady=(0, 5))
+        self.visible = False
+        self.polling = False
+        self.image = None           # (filename, mtime, proxy, edits) of the image on screen
+        self.keys = {}              # kind -> key of what is shown (or asked for)
+
+    def set_visible(self, visible):
+        self.visible = visible
+        if visible:
+            self.frame.place(relx=1, x=-8, y=8, anchor="ne")
+            self.frame.lift()
+            if self.image is not None:
+                self.show(*self.image)
+        else:
+            self.frame.place_forget()
+
+    def show(self, filename, mtime, proxy, edits):
+        # The image on screen is `proxy`, a reduced copy of `filename` after `edits` edits
+        self.image = (filename, mtime, proxy, edits)
+        if not self.visible:
+            return
+        wanted = {'metadata': (filename, mtime), 'histogram': (filename, mtime) if edits == 0 else (filename, mtime, edits, id(proxy))}
+        if wanted == self.keys:
+            return
+        self.keys = wanted
+        metadata = self.worker.request('metadata', wanted['metadata'], read_metadata, filename)
+        self.show_metadata(metadata)
+        if proxy is not None:
+            result = self.worker.get('histogram', wanted['histogram'])
+            if result is None:
+                # The worker gets its own copy: drawing and the renderer change the proxies on screen in place
+                result = self.worker.request('histogram', wanted['histogram'], histogram, proxy.copy(), cache=edits == 0)
+            self.show_histogram(result)
+        else:
+            self.show_histogram(False)
+        if not self.polling and self.worker.busy():
+            self.polling = True
+            self.frame.after(POLL_MS, self.poll)
+
+    def poll(self):
+        self.polling = False
+        for kind, key, result in self.worker.poll():
+            if self.keys.get(kind) != key:
+                continue # For an image we have moved on from
+            if kind == 'metadata':
+                self.show_metadata(result)
+            else:
+                self.show_histogram(result)
+        if self.visible and self.worker.busy():
+            self.polling = True
+            self.frame.after(POLL_MS, self.poll)
+
+    def show_metadata(self, rows):
+        if rows is None:
+            rows = [("", "Reading...")]
+        elif rows is False:
+            rows = [("", "No details")]
+        for i, label in enumerate(self.rows):
+            if i < len(rows):
+                name, text = rows[i]
+                label.config(text=f"{name}: {text}" if name != "" else text)
+            else:
+                label.config(text="")
+
+    def show_histogram(self, counts):
+        if not counts:
+            for name, colour in CHANNELS:
+                self.graph.coords(self.lines[name], 0, GRAPH_SIZE[1], GRAPH_SIZE[0], GRAPH_SIZE[1])
+            self.clipping.config(text="" if counts is None else "No histogram")
+            return
+        w, h = GRAPH_SIZE
+        top = max(1, max(int(counts[name][1:255].max()) for name, colour in CHANNELS)) # Ignore the clipped ends when scaling
+        for name, colour in CHANNELS:
+            heights = h - 1 - (h - 1) * counts[name].clip(0, top) / top
+            points = [v for i in range(256) for v in (i * w / 256, heights[i])]
+            self.graph.coords(self.lines[name], *points)
+        self.clipping.config(text=f"Clipped: {counts['shadows'] * 100:.1f}% black, {counts['highlights'] * 100:.1f}% white")
@@ -0,0 +1,190 @@
+import os
+import io
+import threading
+from contextlib import contextmanager
+from PIL import Image, ExifTags
+from .exiforient import get_orientation, orient, swaps_axes
+from . import trace, resources
+
+MAX_PIXELS = 2000000000     # Largest image the user can open. Pillow's own limit (179 MP) turns away the scans zooming is for
+
+max_pixels = MAX_PIXELS
+large_lock = threading.Lock()
+large_users = 0             # Threads inside large_images()
+pillow_limit = None         # Image.MAX_IMAGE_PIXELS while nobody is
+
+def set_max_pixels(pixels):
+    global max_pixels
+    max_pixels = pixels
+
+@contextmanager
+def large_images():
+    # Pillow refuses to open (or crop out) more than twice Image.MAX_IMAGE_PIXELS (DecompressionBombError), and
+    # warns above it. Inside this block the limit is max_pixels instead. Only for images the user opens in the
+    # editor and work on them: prefetching, thumbnails, batch and the service keep Pillow's protection
+    global large_users, pillow_limit
+    with large_lock:
+        if large_users == 0:
+            pillow_limit = Image.MAX_IMAGE_PIXELS
+            if pillow_limit is not None:
+                Image.MAX_IMAGE_PIXELS = max(pillow_limit, max_pixels)
+        large_users += 1
+    try:
+        yield
+    finally:
+        with large_lock:
+            large_users -= 1
+            if large_users == 0:
+                Image.MAX_IMAGE_PIXELS = pillow_limit
+
+def open_image(f, large=False):
+    # Image.open, allowing images up to max_pixels with `large` (see large_images)
+    if not large:
+        return Image.open(f)
+    with large_images():
+        image = Image.open(f)
+    if image.size[0] * image.size[1] > max_pixels:
+        raise Image.DecompressionBombError(f"Image size ({image.size[0] * image.size[1]} pixels) exceeds limit of {max_pixels} pixels")
+    return image
+
+def too_large(filename, error):
+    # The message for an image over the limit (error is the DecompressionBombError)
+    return f"{os.path.basename(filename)} is too large to open ({error})"
+
+def image_bytes(image):
+    # Approximate memory held by a decoded PIL image
+    if image is None:
+        return 0
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+def reducible(image):
+    # The image in a mode Image.reduce and smooth resampling work on: palette images become RGB (RGBA if
+    # they have transparency), 1 bit become L and 16 bit become I. Other modes are returned as they are
+    if image.mode in ("P", "PA"):
+        return image.convert("RGBA" if image.mode == "PA" or 'transparency' in image.info else "RGB")
+    elif image.mode == "1":
+        return image.convert("L")
+    elif image.mode.startswith("I;16"):
+        return image.convert("I")
+    return image
+
+def fit_size(image_size, frame_size):
+    # Size of an image scaled to fit inside the frame, keeping its aspect ratio
+    frame_ratio = frame_size[0] / frame_size[1]
+    image_ratio = image_size[0] / image_size[1]
+    if frame_ratio > image_ratio:
+        # Scale to fill vertically, empty space on the horizontal
+        return (max(1, int(frame_size[1] * image_ratio)), frame_size[1])
+    else:
+        # Scale to fill horizontally, empty space on the vertical
+        return (frame_size[0], max(1, int(frame_size[0] / image_ratio)))
+
+def exif_thumbnail(image):
+    # The JPEG thumbnail embedded in the EXIF data (IFD1) of an opened image, without decoding the main image
+    exif_data = image.info.get('exif')
+    if not exif_data:
+        return None
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1[0x0201]     # JPEGInterchangeFormat, relative to the TIFF header
+        length = ifd1[0x0202]     # JPEGInterchangeFormatLength
+        start = 6 if exif_data.startswith(b"Exif\x00\x00") else 0
+        thumbnail = Image.open(io.BytesIO(exif_data[start+offset:start+offset+length]))
+        thumbnail.load()
+        return thumbnail
+    except Exception:
+        return None
+
+@trace.traced("decode_full")
+def open_full(filename, info=None, large=False):
+    # Decode the whole image at full resolution, turned upright according to its EXIF orientation.
+    # If `info` is a dict it is filled in with the file's format and orientation. See open_image for `large`
+    with resources.open_file(filename) as f:
+        image = open_image(f, large)
+        orientation = get_orientation(image)
+        if info is not None:
+            info['format'] = image.format
+            info['orientation'] = orientation
+        image.load()
+    return orient(image, orientation)
+
+def header(filename, large=False):
+    # Size (upright), mode, format and orientation of an image, read from its header without decoding it
+    with open_image(filename, large) as image:
+        orientation = get_orientation(image)
+        size = (image.size[1], image.size[0]) if swaps_axes(orientation) else image.size
+        return {'size': size, 'mode': image.mode, 'format': image.format, 'orientation': orientation}
+
+def upright_size(filename, large=False):
+    # Size of an image once turned upright, read from its header without decoding it
+    return header(filename, large)['size']
+
+@trace.traced("decode_reduced")
+def open_reduced(filename, size, info=None, large=False):
+    # Like open_full, but a JPEG is only decoded as large as it needs to be to cover `size` (upright):
+    # libjpeg scales by 1/2, 1/4 or 1/8 while decoding. Used before large reductions
+    with resources.open_file(filename) as f:
+        image = open_image(f, large)
+        orientation = get_orientation(image)
+        if info is not None:
+            info['format'] = image.format
+            info['orientation'] = orientation
+        if image.format == "JPEG":
+            image.draft(image.mode, (size[1], size[0]) if swaps_axes(orientation) else size)
+        image.load()
+    trace.annotate(size=image.size)
+    return orient(image, orientation)
+
+@trace.traced("decode_preview")
+def open_preview(filename, frame_size, large=False):
+    # Decode only as many pixels as needed to fill the frame.
+    # Returns a dict with the preview, the full (upright) size and mode, the file format and orientation,
+    # and the method used: "thumbnail", "draft" or "full"
+    with resources.open_file(filename) as f:
+        image = open_image(f, large)
+        orientation = get_orientation(image)
+        raw_size = image.size
+        mode = image.mode
+        size = (raw_size[1], raw_size[0]) if swaps_axes(orientation) else raw_size
+        target = fit_size(size, frame_size)
+        raw_target = (target[1], target[0]) if swaps_axes(orientation) else target
+        info = {'size': size, 'mode': mode, 'format': image.format, 'orientation': orientation, 'method': "full"}
+        source = None
+        if image.format == "JPEG":
+            thumbnail = exif_thumbnail(image)
+            if thumbnail is not None and thumbnail.size[0] >= raw_target[0] and thumbnail.size[1] >= raw_target[1]:
+                source = thumbnail
+                info['method'] = "thumbnail"
+            else:
+                # Let libjpeg scale by 1/2, 1/4 or 1/8 during decoding (DCT scaling)
+                image.draft(mode, raw_target)
+                if image.size != raw_size:
+                    info['method'] = "draft"
+        if source is None:
+            image.load()
+            source = image
+    if source.mode != mode:
+        source = source.convert(mode)
+    info['preview'] = orient(source, orientation).resize(target)
+    trace.annotate(size=size, mode=mode, method=info['method'])
+    return info
+
+@trace.traced("load_image")
+def load_image(filename, frame_size=None, draft=False, large=False):
+    # Decode an image file into a cache entry. With draft, only a display sized preview is decoded and 'image' is None
+    trace.annotate(file=os.path.basename(filename), draft=draft)
+    mtime = os.stat(filename).st_mtime
+    if draft and frame_size is not None:
+        entry = open_preview(filename, frame_size, large)
+        entry['image'] = None
+        entry['mtime'] = mtime
+        return entry
+    entry = {'mtime': mtime, 'method': "full"}
+    image = open_full(filename, entry, large)
+    entry['image'] = image
+    entry['size'] = image.size
+    entry['mode'] = image.mode
+    entry['preview'] = None
+    if frame_size is not None:
+        entry['preview'] = image.resize(fit_size(image.size, frame_size))
+    return entry
@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ExifTags
+from . import trace, loader
+
+# Information for the properties panel: file and EXIF details read from the file's header (no pixels are
+# decoded), and a histogram of the display proxy. Both are made on a background thread, only while the
+# panel is open, and kept per image so flicking back and forth through a folder doesn't redo them.
+
+HISTOGRAM_PIXELS = 500000   # Larger proxies are reduced to about this before counting
+CACHE_ENTRIES = 64
+LUMA = np.array([299, 587, 114], dtype=np.uint32)   # Rec. 601 weights, in thousandths
+EXIF_FIELDS = (     # (label, IFD or None for the main one, tag)
+    ("Camera", None, ExifTags.Base.Model),
+    ("Lens", ExifTags.IFD.Exif, ExifTags.Base.LensModel),
+    ("Taken", ExifTags.IFD.Exif, ExifTags.Base.DateTimeOriginal),
+    ("Exposure", ExifTags.IFD.Exif, ExifTags.Base.ExposureTime),
+    ("Aperture", ExifTags.IFD.Exif, ExifTags.Base.FNumber),
+    ("ISO", ExifTags.IFD.Exif, ExifTags.Base.ISOSpeedRatings),
+    ("Focal length", ExifTags.IFD.Exif, ExifTags.Base.FocalLength),
+)
+
+def exif_value(label, value):
+    # EXIF values as people write them
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    if isinstance(value, tuple) and len(value) > 0:
+        value = value[0]
+    if label == "Exposure":
+        value = float(value)
+        return f"1/{round(1 / value)} s" if 0 < value < 1 else f"{value:g} s"
+    elif label == "Aperture":
+        return f"f/{float(value):.1f}"
+    elif label == "Focal length":
+        return f"{float(value):g} mm"
+    return str(value).strip("\x00 ")
+
+@trace.traced("read_metadata")
+def read_metadata(filename):
+    # [(label, text)] for the file, from os.stat and the image header
+    stat = os.stat(filename)
+    rows = [("Size", f"{stat.st_size / 1024 / 1024:.1f} MB" if stat.st_size >= 1024 * 1024 else f"{stat.st_size / 1024:.0f} KB"),
+            ("Modified", time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime)))]
+    with loader.open_image(filename, large=True) as image:   # Only the header is read
+        rows.append(("Format", f"{image.format} {image.mode}" + (" progressive" if image.info.get('progressive') else "")))
+        if 'icc_profile' in image.info:
+            rows.append(("Colour", "ICC profile"))
+        exif = image.getexif()
+    make = str(exif.get(ExifTags.Base.Make, "")).strip("\x00 ")
+    for label, ifd, tag in EXIF_FIELDS:
+        values = exif if ifd is None else exif.get_ifd(ifd)
+        if tag in values:
+            try:
+                text = exif_value(label, values[tag])
+            except (ValueError, TypeError, ZeroDivisionError):
+                continue
+            if label == "Camera" and make != "" and not text.startswith(make):
+                text = f"{make} {text}"
+            rows.append((label, text))
+    if len(exif.get_ifd(ExifTags.IFD.GPSInfo)) > 0:
+        rows.append(("Location", "GPS recorded"))
+    return rows
+
+@trace.traced("histogram")
+def histogram(image):
+    # Counts of each level of red, green, blue and luminance, and the fraction of pixels clipped to black or white
+    if image.mode != "RGB":
+        image = image.convert("RGB") # Before reducing, which palette images don't support
+    while image.size[0] * image.size[1] > HISTOGRAM_PIXELS * 2:
+        image = image.reduce(2)
+    pixels = np.asarray(image).reshape(-1, 3).astype(np.uint32) # uint8 * uint32 stays 16 bit on numpy 1.x
+    red, green, blue = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+    luma = (red * LUMA[0] + green * LUMA[1] + blue * LUMA[2] + 500) // 1000
+    brightest = np.bincount(np.maximum(np.maximum(red, green), blue), minlength=256)
+    total = max(1, len(pixels))
+    return {
+        'red': np.bincount(red, minlength=256),
+        'green': np.bincount(green, minlength=256),
+        'blue': np.bincount(blue, minlength=256),
+        'luminance': np.bincount(luma, minlength=256),
+        'shadows': brightest[0] / total,        # Black in every channel
+        'highlights': brightest[255] / total,   # White in at least one
+        'pixels': total,
+    }
+
+class InfoWorker():
+    # Reads metadata and counts histograms on one background thread, newest request first: a request for
+    # another image replaces any that hasn't started. Results are kept by key and collected with poll()
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="info")
+        self.cache = OrderedDict()  # (kind, key) -> result, most recently used last
+        self.pending = {}           # kind -> (key, future)
+        self.done = []              # (kind, key, result) finished since the last poll()
+        self.lock = threading.Lock()
+
+    def get(self, kind, key):
+        with self.lock:
+            if (kind, key) in self.cache:
+                self.cache.move_to_end((kind, key))
+                return self.cache[(kind, key)]
+        return None
+
+    def request(self, kind, key, function, *args, cache=True):
+        # Run function(*args) for `key` unless the result is known or on its way. Returns the result if it is known
+        result = self.get(kind, key)
+        if result is not None:
+            return result
+        with self.lock:
+            if kind in self.pending:
+                if self.pending[kind][0] == key:
+                    return None
+                self.pending.pop(kind)[1].cancel()
+            self.pending[kind] = (key, self.executor.submit(self._run, kind, key, function, args, cache))
+        return None
+
+    def _run(self, kind, key, function, args, cache):
+        try:
+            result = function(*args)
+        except Exception:
+            result = False  # Not None, so it isn't asked for again
+        with self.lock:
+            if kind in self.pending and self.pending[kind][0] == key:
+                self.pending.pop(kind)
+            if cache:
+                self.cache[(kind, key)] = result
+                while len(self.cache) > CACHE_ENTRIES:
+                    self.cache.popitem(last=False)
+            self.done.append((kind, key, result))
+
+    def poll(self):
+        with self.lock:
+            done = self.done
+            self.done = []
+            return done
+
+    def busy(self):
+        with self.lock:
+            return len(self.pending) > 0 or len(self.done) > 0
+
+    def shutdown(self):
+        with self.lock:
+            for key, future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+        self.executor.shutdown(wait=True, cancel_futures=True)
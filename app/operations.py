@@ -0,0 +1,122 @@
+from PIL import Image, ImageDraw
+from .resize import resize_image
+from .adjust import apply_adjustment
+
+# Edits are described by small operation records (plain dicts) so they can be stored,
+# undone, replayed and sent to other processes cheaply:
+#   {'op': 'rotate', 'angle': 90}                  Anticlockwise, multiples of 90 (-90 is clockwise)
+#   {'op': 'crop', 'box': (left, top, right, bottom)}
+#   {'op': 'resize', 'size': (width, height), 'filter': 'lanczos'}   Filters as in app/resize.py
+#   {'op': 'stroke', 'tool': 'pen', 'points': ((x, y), ...), 'colour': "#rrggbb", 'width': 8}
+#                                                  Freehand through the points ('pen', 'erase'), or a 'line',
+#                                                  'rectangle' or 'ellipse' from the first point to the last
+#   {'op': 'adjust', 'brightness': 0, 'contrast': 0, 'black': (0, 0, 0), 'white': (255, 255, 255), 'gamma': 1.0}
+#                                                  Brightness and contrast -100 to 100, levels per channel (see app/adjust.py)
+
+TRANSPOSE = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+FREEHAND = ("pen", "erase")
+SHAPES = ("line", "rectangle", "ellipse")
+
+def rotate(angle):
+    return {'op': 'rotate', 'angle': angle}
+
+def crop(box):
+    return {'op': 'crop', 'box': tuple(int(v) for v in box)}
+
+def resize(size, filter="lanczos"):
+    return {'op': 'resize', 'size': (int(size[0]), int(size[1])), 'filter': filter}
+
+def stroke(tool, points, colour, width):
+    return {'op': 'stroke', 'tool': tool, 'points': tuple((int(x), int(y)) for x, y in points), 'colour': colour, 'width': int(width)}
+
+def adjust(brightness=0, contrast=0, black=(0, 0, 0), white=(255, 255, 255), gamma=1.0):
+    return {'op': 'adjust', 'brightness': int(brightness), 'contrast': int(contrast), 'black': tuple(int(v) for v in black), 'white': tuple(int(v) for v in white), 'gamma': round(float(gamma), 2)}
+
+def transpose_method(angle):
+    # The Image.transpose() method for an anticlockwise rotation, or None for no rotation
+    return TRANSPOSE.get(angle % 360)
+
+def apply(image, op):
+    # Apply an operation record to an image, returning the new image
+    if op['op'] == 'rotate':
+        method = transpose_method(op['angle'])
+        if method is None:
+            return image
+        return image.transpose(method)
+    elif op['op'] == 'crop':
+        return image.crop(op['box'])
+    elif op['op'] == 'resize':
+        return resize_image(image, op['size'], op['filter'])
+    elif op['op'] == 'stroke':
+        image = image.copy()
+        draw_stroke(ImageDraw.Draw(image), op)
+        return image
+    elif op['op'] == 'adjust':
+        return apply_adjustment(image, op)
+    raise ValueError(f"Unknown operation {op['op']}")
+
+# Strokes are drawn a piece at a time while the mouse moves (see app/drawing.py) and all at once by
+# apply(); both go through the functions below so they produce the same pixels
+
+def draw_segment(draw, p0, p1, colour, width):
+    # One piece of a freehand stroke, with a round end so the pieces join smoothly
+    if p0 != p1:
+        draw.line((p0, p1), fill=colour, width=width)
+    if width > 2:
+        r = width / 2
+        draw.ellipse((p1[0] - r, p1[1] - r, p1[0] + r, p1[1] + r), fill=colour)
+    elif p0 == p1:
+        draw.point(p1, fill=colour)
+
+def draw_shape(draw, tool, p0, p1, colour, width):
+    box = (min(p0[0], p1[0]), min(p0[1], p1[1]), max(p0[0], p1[0]), max(p0[1], p1[1]))
+    if tool == "line":
+        draw_segment(draw, p0, p0, colour, width)
+        draw_segment(draw, p0, p1, colour, width)
+    elif tool == "rectangle":
+        draw.rectangle(box, outline=colour, width=width)
+    elif tool == "ellipse":
+        draw.ellipse(box, outline=colour, width=width)
+
+def draw_stroke(draw, op, scale=1.0):
+    # Draw a whole stroke record, optionally scaled (eg: onto a display proxy)
+    points = [(x * scale, y * scale) for x, y in op['points']]
+    width = max(1, round(op['width'] * scale))
+    if len(points) == 0:
+        return
+    if op['tool'] in FREEHAND:
+        draw_segment(draw, points[0], points[0], op['colour'], width)
+        for p0, p1 in zip(points, points[1:]):
+            draw_segment(draw, p0, p1, op['colour'], width)
+    else:
+        draw_shape(draw, op['tool'], points[0], points[-1], op['colour'], width)
+
+def stroke_box(points, width, size):
+    # Pixels that drawing through `points` with a pen `width` wide can touch, within an image of `size`
+    pad = width // 2 + 2
+    x0 = max(0, int(min(x for x, y in points)) - pad)
+    y0 = max(0, int(min(y for x, y in points)) - pad)
+    x1 = min(size[0], int(max(x for x, y in points)) + pad + 1)
+    y1 = min(size[1], int(max(y for x, y in points)) + pad + 1)
+    return (x0, y0, max(x0, x1), max(y0, y1))
+
+def invert(op):
+    # The operation that exactly undoes `op`, or None if it loses information
+    if op['op'] == 'rotate':
+        return rotate(-op['angle'])
+    return None
+
+def result_size(size, op):
+    # Size of an image of `size` after applying `op`
+    if op['op'] == 'rotate':
+        if op['angle'] % 180 == 0:
+            return size
+        return (size[1], size[0])
+    elif op['op'] == 'crop':
+        box = op['box']
+        return (box[2] - box[0], box[3] - box[1])
+    elif op['op'] == 'resize':
+        return op['size']
+    elif op['op'] in ('stroke', 'adjust'):
+        return size
+    raise ValueError(f"Unknown operation {op['op']}")
@@ -0,0 +1,181 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .loader import image_bytes, load_image
+
+class ImageCache():
+    # Least recently used cache of decoded images, bounded by a memory budget in bytes
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def entry_bytes(self, entry):
+        return image_bytes(entry['image']) + image_bytes(entry['preview'])
+
+    def get(self, filename, count=True):
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is not None:
+                try:
+                    fresh = os.stat(filename).st_mtime == entry['mtime']
+                except OSError:
+                    fresh = False
+                if fresh:
+                    self.entries.move_to_end(filename)
+                    if count:
+                        self.hits += 1
+                    return entry
+                self._remove(filename)
+            if count:
+                self.misses += 1
+            return None
+
+    def take(self, filename, count=True):
+        # Remove and return an entry; the caller becomes the owner of the image
+        entry = self.get(filename, count)
+        if entry is not None:
+            self.discard(filename)
+        return entry
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, filename, entry):
+        with self.lock:
+            if filename in self.entries:
+                self._remove(filename)
+            size = self.entry_bytes(entry)
+            if size > self.budget:
+                return
+            self.entries[filename] = entry
+            self.total += size
+            while self.total > self.budget:
+                self._remove(next(iter(self.entries)))
+
+    def discard(self, filename):
+        with self.lock:
+            if filename in self.entries:
+                self._remove(filename)
+
+    def __contains__(self, filename):
+        with self.lock:
+            return filename in self.entries
+
+    def _remove(self, filename):
+        entry = self.entries.pop(filename)
+        self.total -= self.entry_bytes(entry)
+
+    def nbytes(self):
+        with self.lock:
+            return self.total
+
+    def shrink(self, nbytes):
+        # Evict least recently used entries until `nbytes` are freed (or the cache is empty). Returns the bytes freed
+        with self.lock:
+            before = self.total
+            while len(self.entries) > 0 and before - self.total < nbytes:
+                self._remove(next(iter(self.entries)))
+            return before - self.total
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total, 'budget': self.budget, 'hits': self.hits, 'misses': self.misses}
+
+class Prefetcher():
+    # Decodes the neighbours of the current image in a thread pool, ahead of the user
+    def __init__(self, cache, radius=2, workers=None, draft=False):
+        self.cache = cache
+        self.radius = radius
+        self.draft = draft      # Decode only display sized previews (see loader.load_image)
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.pending = {}   # filename -> future
+        self.lock = threading.Lock()
+
+    def neighbours(self, files, index, direction=0):
+        # Files around position `index` in priority order, reading further ahead in the direction of travel
+        if len(files) < 2 or self.radius <= 0:
+            return []
+        ahead = self.radius * 2 if direction else self.radius
+        behind = max(1, self.radius // 2) if direction else self.radius
+        if direction < 0:
+            forward, backward = behind, ahead
+        else:
+            forward, backward = ahead, behind
+        order = []
+        for step in range(1, max(forward, backward) + 1):
+            if step <= forward:
+                order.append(files[(index + step) % len(files)])
+            if step <= backward:
+                order.append(files[(index - step) % len(files)])
+        result = []
+        for f in order:
+            if f != files[index] and f not in result:
+                result.append(f)
+        return result
+
+    def request(self, filenames, frame_size):
+        # Queue decodes for `filenames` (closest first), cancelling work for anything no longer wanted
+        with self.lock:
+            for filename in list(self.pending):
+                if filename not in filenames:
+                    self.pending.pop(filename).cancel()
+            for filename in filenames:
+                if filename in self.pending or filename in self.cache:
+                    continue
+                self.pending[filename] = self.executor.submit(self._decode, filename, frame_size)
+
+    def _decode(self, filename, frame_size):
+        try:
+            entry = load_image(filename, frame_size, self.draft)
+        except Exception:
+            entry = None
+        with self.lock:
+            future = self.pending.get(filename)
+            if future is not None and future.done() is False:
+                # Still wanted (we are running inside this future), hand the result to the cache
+                del self.pending[filename]
+                if entry is not None:
+                    self.cache.put(filename, entry)
+        return entry
+
+    def is_ready(self, filename):
+        # True once nothing is decoding `filename` (it is in the cache, or the decode failed)
+        with self.lock:
+            return filename not in self.pending
+
+    def get(self, filename):
+        # Claim a prefetched image, waiting for it if its decode is already in progress
+        entry = self.cache.take(filename, count=False)
+        if entry is None:
+            with self.lock:
+                future = self.pending.pop(filename, None)
+            if future is not None and not future.cancel():
+                entry = future.result()
+            else:
+                # The decode may have finished while we were looking
+                entry = self.cache.take(filename, count=False)
+        self.cache.record(entry is not None)
+        return entry
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
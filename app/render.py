@@ -0,0 +1,292 @@
+from PIL import Image, ImageTk
+from .loader import fit_size, image_bytes, reducible
+from . import trace
+
+FAST_FILTER = Image.BILINEAR    # First paint
+FINE_FILTER = Image.LANCZOS     # Refinement once the UI is idle
+MAX_ZOOM = 8.0                  # Screen pixels per image pixel
+VIEW_REFINE_MS = 150            # While zooming/panning, refine only once the view has been still this long
+
+class Renderer():
+    # Draws one image into a Tk label through a single reused PhotoImage.
+    # Keeps reduced copies of the source (a 2x downscale pyramid plus the proxies it has
+    # already drawn) so redraws, window resizes and rotations never resample the full image again.
+    def __init__(self, widget, tile_cache=None):
+        self.widget = widget
+        self.tile_cache = tile_cache    # For drawing zoomed views from a tile pack (see app/tiles.py)
+        self.pack = None        # TilePack of the file being shown, if one has been built
+        self.zoom = None        # Screen pixels per image pixel, None to fit the frame
+        self.center = None      # Image coordinates at the centre of a zoomed view
+        self.source = None      # Full resolution PIL image, or None if only previews exist
+        self.size = None        # Full resolution size, known even when source is None
+        self.levels = {}        # size -> reduced image of the source
+        self.fine = set()       # Sizes in self.levels that were scaled with FINE_FILTER for display
+        self.photo = None       # The persistent ImageTk.PhotoImage
+        self.shown = None       # (target size, overlay) currently on screen
+        self.overlay = None     # Function that draws tool overlays onto a copy of the proxy
+        self.refine_job = None
+
+    def set_source(self, image, size=None, proxy=None):
+        # Start drawing a different image. `proxy` is an already scaled copy (eg: from the prefetcher)
+        self.cancel_refine()
+        self.set_pack(None)
+        self.zoom = None
+        self.source = image
+        self.size = image.size if image is not None else size
+        self.levels = {}
+        self.fine = set()
+        self.shown = None
+        if proxy is not None:
+            self.levels[proxy.size] = proxy
+            self.fine.add(proxy.size)
+
+    def set_full(self, image):
+        # The full resolution version of what is already displayed has been decoded, keep the proxies
+        self.source = image
+        self.size = image.size
+
+    def edit_surface(self, frame_size):
+        # Show the image fitted to the frame and return the proxy on screen, for drawing onto in place
+        # alongside the source (see app/drawing.py). May be the source itself if that fits the frame
+        self.cancel_refine()
+        self.zoom = None
+        target = fit_size(self.size, frame_size)
+        proxy = self.proxy(target, fine=True)
+        self.display(proxy)
+        self.shown = (target, None)
+        return proxy
+
+    def edited(self, proxy):
+        # The source has been drawn on in place along with `proxy`; every other reduced copy is now out of date
+        self.levels = {proxy.size: proxy}
+        self.fine = {proxy.size}
+
+    def set_pack(self, pack):
+        # Tiles of the file on disk, used for zoomed views while there is no full resolution source
+        if self.pack is not None:
+            self.pack.close()
+        self.pack = pack
+
+    def fit_zoom(self, frame_size):
+        return fit_size(self.size, frame_size)[0] / self.size[0]
+
+    def set_zoom(self, zoom, frame_size, anchor=None):
+        # Zoom so that the image point under `anchor` (frame coordinates, default the centre) stays put.
+        # Zooming out as far as the fitted size goes back to fitting the frame
+        if self.size is None:
+            return
+        fit = self.fit_zoom(frame_size)
+        if zoom is None or zoom <= fit:
+            self.zoom = None
+            return
+        zoom = min(zoom, MAX_ZOOM)
+        if anchor is None:
+            anchor = (frame_size[0] / 2, frame_size[1] / 2)
+        point = self.frame_to_image(anchor, frame_size)
+        self.zoom = zoom
+        # Put `point` back under the anchor
+        self.center = (point[0] - (anchor[0] - frame_size[0] / 2) / zoom, point[1] - (anchor[1] - frame_size[1] / 2) / zoom)
+        self.clamp(frame_size)
+
+    def frame_to_image(self, point, frame_size):
+        # Image coordinates of a point in the frame
+        if self.zoom is None:
+            zoom = self.fit_zoom(frame_size)
+            center = (self.size[0] / 2, self.size[1] / 2)
+        else:
+            zoom = self.zoom
+            center = self.center
+        return (center[0] + (point[0] - frame_size[0] / 2) / zoom, center[1] + (point[1] - frame_size[1] / 2) / zoom)
+
+    def pan(self, dx, dy, frame_size):
+        # Move a zoomed view by a distance in screen pixels
+        if self.zoom is not None:
+            self.center = (self.center[0] - dx / self.zoom, self.center[1] - dy / self.zoom)
+            self.clamp(frame_size)
+
+    def clamp(self, frame_size):
+        # Keep the view inside the image (centred on an axis where the image is smaller than the frame)
+        center = []
+        for axis in (0, 1):
+            half = frame_size[axis] / 2 / self.zoom
+            if half * 2 >= self.size[axis]:
+                center.append(self.size[axis] / 2)
+            else:
+                center.append(min(max(self.center[axis], half), self.size[axis] - half))
+        self.center = tuple(center)
+
+    def view_box(self, frame_size):
+        # Part of the image in a zoomed view (image coordinates) and its size on screen
+        zoom = self.zoom
+        x0 = max(0.0, self.center[0] - frame_size[0] / 2 / zoom)
+        y0 = max(0.0, self.center[1] - frame_size[1] / 2 / zoom)
+        x1 = min(float(self.size[0]), self.center[0] + frame_size[0] / 2 / zoom)
+        y1 = min(float(self.size[1]), self.center[1] + frame_size[1] / 2 / zoom)
+        out = (max(1, min(frame_size[0], round((x1 - x0) * zoom))), max(1, min(frame_size[1], round((y1 - y0) * zoom))))
+        return (x0, y0, x1, y1), out
+
+    def view_image(self, frame_size, fine):
+        # Draw a zoomed view, reading only the pixels inside it from the best available level
+        box, out = self.view_box(frame_size)
+        resample = FINE_FILTER if fine else FAST_FILTER
+        if self.source is None and self.pack is not None and self.tile_cache is not None:
+            level = self.pack.level_for(self.zoom)
+            scale = self.pack.levels[level][0] / self.size[0]
+            level_box = [c * scale for c in box]
+            whole = (int(level_box[0]), int(level_box[1]), min(self.pack.levels[level][0], int(level_box[2]) + 1), min(self.pack.levels[level][1], int(level_box[3]) + 1))
+            region = self.tile_cache.region(self.pack, level, whole)
+            return region.resize(out, resample, box=(level_box[0] - whole[0], level_box[1] - whole[1], level_box[2] - whole[0], level_box[3] - whole[1]))
+        if self.source is not None:
+            level = self.nearest_level((int(self.size[0] * self.zoom) + 1, int(self.size[1] * self.zoom) + 1))
+        else:
+            # Only previews so far: upscale the largest until something better is available
+            level = max(self.levels.values(), key=lambda level: level.size[0])
+        scale = level.size[0] / self.size[0]
+        return level.resize(out, resample, box=tuple(c * scale for c in box))
+
+    def clear(self):
+        self.set_source(None)
+        self.photo = None
+        self.widget.configure(image="")
+
+    def nbytes(self):
+        return sum(image_bytes(level) for level in self.levels.values())
+
+    def photo_bytes(self):
+        # The Tk photo image on screen, held by Tk as 32 bit pixels
+        return 0 if self.photo is None else self.photo.width() * self.photo.height() * 4
+
+    def shrink(self, nbytes):
+        # Drop reduced copies that are not on screen, largest first, until `nbytes` are freed. They are remade from
+        # the source when needed; without a source the largest is kept, as nothing else could replace it
+        keep = set()
+        if self.shown is not None and self.shown[0] in self.levels:
+            keep.add(self.shown[0])
+        if self.source is None and len(self.levels) > 0:
+            keep.add(max(self.levels, key=lambda size: size[0] * size[1]))
+        freed = 0
+        for size in sorted(self.levels, key=lambda size: size[0] * size[1], reverse=True):
+            if freed >= nbytes:
+                break
+            if size not in keep:
+                freed += image_bytes(self.levels.pop(size))
+                self.fine.discard(size)
+        return freed
+
+    def covers(self, target):
+        # Is there a source or reduced copy at least as large as target?
+        if self.source is not None:
+            return True
+        return any(w >= target[0] and h >= target[1] for (w, h) in self.levels)
+
+    def cached_proxy(self, frame_size):
+        # The high quality proxy for this frame size, if one has been drawn
+        target = fit_size(self.size, frame_size)
+        if target in self.fine:
+            return self.levels[target]
+        return None
+
+    def nearest_level(self, target):
+        # Smallest available image that is at least as large as target, building pyramid levels as needed
+        best = None
+        for (w, h), level in self.levels.items():
+            if w >= target[0] and h >= target[1] and (best is None or w < best.size[0]):
+                best = level
+        if best is None:
+            best = self.source
+        if best is None:
+            # Only smaller previews exist, upscale the largest
+            return max(self.levels.values(), key=lambda level: level.size[0])
+        converted = reducible(best)
+        if converted is not best:
+            best = self.levels[best.size] = converted # eg: a palette PNG, which would otherwise be scaled without smoothing
+        while best.size[0] // 2 >= target[0] and best.size[1] // 2 >= target[1]:
+            best = best.reduce(2)
+            self.levels[best.size] = best
+        return best
+
+    def proxy(self, target, fine):
+        if target in self.levels and (target in self.fine or not fine):
+            return self.levels[target]
+        level = self.nearest_level(target)
+        if level.size == target:
+            scaled = level
+        else:
+            scaled = level.resize(target, FINE_FILTER if fine else FAST_FILTER)
+        if fine:
+            self.levels[target] = scaled
+            self.fine.add(target)
+        return scaled
+
+    @trace.traced("display")
+    def display(self, image):
+        # Update the PhotoImage in place when it is the right size, otherwise allocate a new one
+        if self.photo is not None and (self.photo.width(), self.photo.height()) == image.size:
+            self.photo.paste(image)
+        else:
+            self.photo = ImageTk.PhotoImage(image)
+            self.widget.configure(image=self.photo)
+
+    @trace.traced("display_region")
+    def display_region(self, image, box):
+        # Send only the pixels of `image` (the picture on screen) inside box to the PhotoImage
+        box = (max(0, box[0]), max(0, box[1]), min(image.size[0], box[2]), min(image.size[1], box[3]))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.display(image)
+            return
+        region = ImageTk.PhotoImage(image.crop(box), master=self.widget)
+        self.widget.tk.call(str(self.photo), "copy", str(region), "-to", box[0], box[1])
+
+    def compose(self, proxy):
+        if self.overlay is None:
+            return proxy
+        return self.overlay(proxy)
+
+    @trace.traced("render")
+    def render(self, frame_size, overlay=None):
+        # Paint quickly with a fast filter, then refine on idle. Returns the size drawn on screen
+        if self.size is None:
+            return None
+        self.overlay = overlay
+        if self.zoom is not None:
+            return self.render_view(frame_size)
+        target = fit_size(self.size, frame_size)
+        if overlay is None and self.shown == (target, None) and target in self.fine:
+            return target
+        self.cancel_refine()
+        self.display(self.compose(self.proxy(target, fine=False)))
+        self.shown = (target, overlay)
+        if target not in self.fine:
+            self.refine_job = self.widget.after_idle(self.refine, target)
+        return target
+
+    @trace.traced("render_view")
+    def render_view(self, frame_size):
+        self.cancel_refine()
+        view = (self.zoom, self.center, frame_size)
+        image = self.view_image(frame_size, fine=False)
+        self.display(image)
+        self.shown = (image.size, view)
+        self.refine_job = self.widget.after(VIEW_REFINE_MS, self.refine_view, view)
+        return image.size
+
+    @trace.traced("refine_view")
+    def refine_view(self, view):
+        self.refine_job = None
+        if self.shown is None or self.shown[1] != view or self.size is None:
+            return
+        self.display(self.view_image(view[2], fine=True))
+
+    @trace.traced("refine")
+    def refine(self, target):
+        self.refine_job = None
+        if self.shown is None or self.shown[0] != target or self.size is None:
+            return
+        self.display(self.compose(self.proxy(target, fine=True)))
+
+    def cancel_refine(self):
+        if self.refine_job is not None:
+            self.widget.after_cancel(self.refine_job)
+            self.refine_job = None
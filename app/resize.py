@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from . import trace
+
+# Resizing. Large reductions first shrink by a whole factor with Image.reduce (reducing_gap), which is
+# much faster than resampling every source pixel and looks the same. Very large images are resized in
+# horizontal bands on a thread pool (Pillow releases the GIL while resampling): each band only needs the
+# source rows under it, so the intermediate buffers stay small and the bands run in parallel.
+
+FILTERS = {
+    'nearest': Image.NEAREST,
+    'box': Image.BOX,
+    'bilinear': Image.BILINEAR,
+    'hamming': Image.HAMMING,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+DEFAULT_FILTER = "lanczos"
+MODES = ("pixels", "percent", "long_edge")
+REDUCING_GAP = 3.0          # Reduce by whole factors until within this factor of the target, then resample
+BAND_THRESHOLD_MP = 24      # Images larger than this (in megapixels) are resized in bands
+BAND_ROWS = 256             # Output rows per band
+BAND_WORKERS = min(4, os.cpu_count() or 1)
+
+def target_size(size, mode, width=None, height=None, percent=None, long_edge=None):
+    # The size an image of `size` is resized to.
+    #   "pixels": width x height exactly, or the one given with the other keeping the aspect ratio
+    #   "percent": both sides scaled by percent
+    #   "long_edge": the longer side made long_edge pixels, keeping the aspect ratio
+    if mode == "pixels":
+        if width is None and height is None:
+            raise ValueError("Width or height needed")
+        if width is None:
+            width = size[0] * height / size[1]
+        elif height is None:
+            height = size[1] * width / size[0]
+    elif mode == "percent":
+        width = size[0] * percent / 100
+        height = size[1] * percent / 100
+    elif mode == "long_edge":
+        scale = long_edge / max(size)
+        width = size[0] * scale
+        height = size[1] * scale
+    else:
+        raise ValueError(f"Unknown resize mode {mode}")
+    return (max(1, round(width)), max(1, round(height)))
+
+@trace.traced("resize")
+def resize_image(image, size, filter=DEFAULT_FILTER, workers=None):
+    resample = FILTERS[filter]
+    trace.annotate(size=image.size, target=size, filter=filter)
+    gap = REDUCING_GAP if resample != Image.NEAREST else None
+    if image.size[0] * image.size[1] <= BAND_THRESHOLD_MP * 1000000 or size[1] <= BAND_ROWS:
+        return image.resize(size, resample, reducing_gap=gap)
+    image.load()
+    scale = image.size[1] / size[1]
+    def band(y0):
+        y1 = min(size[1], y0 + BAND_ROWS)
+        return image.resize((size[0], y1 - y0), resample, box=(0, y0 * scale, image.size[0], y1 * scale), reducing_gap=gap)
+    result = Image.new(image.mode, size)
+    if image.mode == "P":
+        result.putpalette(image.getpalette())
+    with ThreadPoolExecutor(max_workers=workers or BAND_WORKERS, thread_name_prefix="resize") as pool:
+        for y0, part in zip(range(0, size[1], BAND_ROWS), pool.map(band, range(0, size[1], BAND_ROWS))):
+            result.paste(part, (0, y0))
+    return result
+
+def preview(proxy, image_size, size, filter=DEFAULT_FILTER):
+    # How an image of `image_size` shown as `proxy` would look resized to `size`, at the proxy's scale:
+    # the proxy is resampled to the resized image's detail with `filter`, then enlarged back for display
+    scale = proxy.size[0] / image_size[0]
+    small = (max(1, min(size[0], round(size[0] * scale))), max(1, min(size[1], round(size[1] * scale))))
+    reduced = proxy.resize(small, FILTERS[filter])
+    ratio = min(proxy.size[0] / small[0], proxy.size[1] / small[1])
+    shown = (max(1, round(small[0] * ratio)), max(1, round(small[1] * ratio)))
+    if shown == small:
+        return reduced
+    return reduced.resize(shown, Image.NEAREST)
@@ -0,0 +1,120 @@
+import tkinter as tk
+from .resize import FILTERS, DEFAULT_FILTER, target_size
+
+class ResizeWindow():
+    # Resize dialog. While it is open every change is previewed (on_preview, with the new size and filter,
+    # or None while the entries don't make sense); Apply calls on_apply(size, filter, choices) where choices
+    # are the dialog's settings to offer next time. Closing it any other way calls on_cancel()
+    def __init__(self, parent, size, choices, on_preview, on_apply, on_cancel):
+        self.parent = parent
+        self.size = size
+        self.on_preview = on_preview
+        self.on_apply = on_apply
+        self.on_cancel = on_cancel
+        self.window = tk.Toplevel()
+        self.window.title("Resize")
+        self.window.geometry("360x280")
+        self.window.transient(parent)
+        self.mode = tk.StringVar(value=choices.get('mode', "percent"))
+        self.width = tk.StringVar(value=str(size[0]))
+        self.height = tk.StringVar(value=str(size[1]))
+        self.keep_ratio = tk.BooleanVar(value=choices.get('keep_ratio', True))
+        self.percent = tk.StringVar(value=str(choices.get('percent', 50)))
+        self.long_edge = tk.StringVar(value=str(choices.get('long_edge', max(size))))
+        self.filter = tk.StringVar(value=choices.get('filter', DEFAULT_FILTER))
+        self.updating = False
+        tk.Label(self.window, text=f"Now {size[0]} x {size[1]}", font=('Arial', 12)).grid(row=0, column=0, columnspan=4, sticky="w", padx=10, pady=5)
+        tk.Radiobutton(self.window, text="Pixels", variable=self.mode, value="pixels").grid(row=1, column=0, sticky="w", padx=10)
+        tk.Entry(self.window, textvariable=self.width, width=7).grid(row=1, column=1)
+        tk.Label(self.window, text="x").grid(row=1, column=2)
+        tk.Entry(self.window, textvariable=self.height, width=7).grid(row=1, column=3, sticky="w")
+        tk.Checkbutton(self.window, text="Keep proportions", variable=self.keep_ratio).grid(row=2, column=1, columnspan=3, sticky="w")
+        tk.Radiobutton(self.window, text="Percent", variable=self.mode, value="percent").grid(row=3, column=0, sticky="w", padx=10)
+        tk.Entry(self.window, textvariable=self.percent, width=7).grid(row=3, column=1)
+        tk.Radiobutton(self.window, text="Long edge", variable=self.mode, value="long_edge").grid(row=4, column=0, sticky="w", padx=10)
+        tk.Entry(self.window, textvariable=self.long_edge, width=7).grid(row=4, column=1)
+        tk.Label(self.window, text="Filter").grid(row=5, column=0, sticky="w", padx=10, pady=5)
+        tk.OptionMenu(self.window, self.filter, *FILTERS).grid(row=5, column=1, columnspan=3, sticky="w")
+        self.result = tk.Label(self.window, text="", font=('Arial', 12))
+        self.result.grid(row=6, column=0, columnspan=4, sticky="w", padx=10, pady=5)
+        self.apply_button = tk.Button(self.window, text="Apply", command=self.apply)
+        self.apply_button.grid(row=7, column=0, padx=10, pady=5, sticky="w")
+        tk.Button(self.window, text="Cancel", command=self.cancel).grid(row=7, column=3, pady=5, sticky="e")
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.window.bind('<Return>', lambda event: self.apply())
+        self.window.bind('<Escape>', lambda event: self.cancel())
+        self.width.trace_add("write", lambda *args: self.proportion("width"))
+        self.height.trace_add("write", lambda *args: self.proportion("height"))
+        for variable in (self.mode, self.keep_ratio, self.percent, self.long_edge, self.filter):
+            variable.trace_add("write", lambda *args: self.changed())
+        self.window.grab_set()  # Nothing else in the editor until this is closed
+        self.changed()
+
+    def proportion(self, edited):
+        # Keep width and height in proportion when asked to
+        if self.updating:
+            return
+        if self.keep_ratio.get():
+            self.updating = True
+            try:
+                if edited == "width":
+                    self.height.set(str(target_size(self.size, "pixels", width=int(self.width.get()))[1]))
+                else:
+                    self.width.set(str(target_size(self.size, "pixels", height=int(self.height.get()))[0]))
+            except ValueError:
+                pass
+            self.updating = False
+        self.mode.set("pixels")
+        self.changed()
+
+    def target(self):
+        # The size chosen, or None if the entries don't make one
+        try:
+            mode = self.mode.get()
+            if mode == "pixels":
+                values = (int(self.width.get()), int(self.height.get()))
+                size = target_size(self.size, mode, width=values[0], height=values[1])
+            elif mode == "percent":
+                values = (float(self.percent.get()),)
+                size = target_size(self.size, mode, percent=values[0])
+            else:
+                values = (int(self.long_edge.get()),)
+                size = target_size(self.size, mode, long_edge=values[0])
+        except ValueError:
+            return None
+        if min(values) <= 0:
+            return None
+        return size
+
+    def changed(self):
+        size = self.target()
+        if size is None:
+            self.result.config(text="")
+            self.apply_button.config(state=tk.DISABLED)
+        else:
+            self.result.config(text=f"Becomes {size[0]} x {size[1]}")
+            self.apply_button.config(state=tk.NORMAL)
+        self.on_preview(size, self.filter.get())
+
+    def choices(self):
+        choices = {'mode': self.mode.get(), 'keep_ratio': self.keep_ratio.get(), 'filter': self.filter.get()}
+        try:
+            choices['percent'] = float(self.percent.get())
+            choices['long_edge'] = int(self.long_edge.get())
+        except ValueError:
+            pass
+        return choices
+
+    def apply(self):
+        size = self.target()
+        if size is None:
+            return
+        choices = self.choices()
+        self.window.grab_release()
+        self.window.destroy()
+        self.on_apply(size, choices['filter'], choices)
+
+    def cancel(self):
+        self.window.grab_release()
+        self.window.destroy()
+        self.on_cancel()
@@ -0,0 +1,87 @@
+import threading
+from contextlib import contextmanager, nullcontext
+from . import trace
+
+# One memory budget for everything in the editor that holds decoded pixels (the image, its display proxies,
+# the prefetch cache, zoom tiles, undo snapshots...). Each component registers how to measure itself and,
+# if it can, how to give memory back. When the total is over budget the least valuable memory goes first:
+# components are asked to shrink in order of priority (prefetched neighbours before the undo history).
+# Image files are opened through open_file(), which closes them as soon as they are decoded and bounds how
+# many are open at once across the decoding threads.
+
+MAX_OPEN_FILES = 8      # Image files open at once across the background threads (more wait their turn)
+
+file_slots = threading.BoundedSemaphore(MAX_OPEN_FILES)
+file_lock = threading.Lock()
+files_open = 0
+
+@contextmanager
+def open_file(filename):
+    # The file to decode an image from. Pixels loaded inside the block stay valid after it is closed.
+    # The UI thread doesn't take a slot, so opening the image the user asked for never waits behind prefetching
+    global files_open
+    with file_slots if threading.current_thread() is not threading.main_thread() else nullcontext():
+        f = open(filename, "rb")
+        with file_lock:
+            files_open += 1
+        try:
+            yield f
+        finally:
+            f.close()
+            with file_lock:
+                files_open -= 1
+
+def open_files():
+    with file_lock:
+        return files_open
+
+class ResourceManager():
+    def __init__(self, budget):
+        self.budget = budget
+        self.consumers = []     # (priority, name, nbytes, shrink), cheapest to lose first
+        self.freed = {}         # name -> bytes given back so far
+
+    def register(self, name, nbytes, shrink=None, priority=0):
+        # nbytes() is the memory `name` holds now; shrink(bytes) frees up to that much and returns how much it freed.
+        # Without shrink, the memory is counted but can't be reclaimed (eg: the image being edited)
+        self.consumers.append((priority, name, nbytes, shrink))
+        self.consumers.sort(key=lambda consumer: consumer[0])
+        self.freed[name] = 0
+
+    def usage(self):
+        return {name: nbytes() for priority, name, nbytes, shrink in self.consumers}
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def available(self):
+        # Bytes left in the budget, for work that holds pixels for a while without registering them (eg: building tiles)
+        return max(0, self.budget - self.total())
+
+    @trace.traced("enforce_budget")
+    def enforce(self):
+        # Shrink the least valuable components until the total is within budget. Returns the bytes freed
+        usage = self.usage()
+        excess = sum(usage.values()) - self.budget
+        trace.annotate(total=sum(usage.values()), budget=self.budget)
+        trace.counter("memory_mb", **{name: round(used / 1024 / 1024, 1) for name, used in usage.items()})
+        freed = 0
+        for priority, name, nbytes, shrink in self.consumers:
+            if excess <= 0:
+                break
+            if shrink is None or usage[name] == 0:
+                continue
+            released = shrink(excess)
+            self.freed[name] += released
+            freed += released
+            excess -= released
+        trace.annotate(freed=freed)
+        return freed
+
+    def stats(self):
+        usage = self.usage()
+        return {'budget': self.budget, 'total': sum(usage.values()), 'usage': usage, 'freed': dict(self.freed), 'files_open': open_files()}
+
+    def describe(self):
+        # eg: "memory 640/1024 MB"
+        return f"memory {self.total() / 1024 / 1024:.0f}/{self.budget / 1024 / 1024:.0f} MB"
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+from . import trace
+
+FRAME_MS = 16   # Run queued work at most this often (about 60 times a second)
+
+class Scheduler():
+    # Coalesces work asked for by input events. Each task has a name; asking again for a task that is
+    # already queued replaces it, so a burst of key repeats costs one run of the latest request. Queued
+    # tasks run together at most once per frame, in the order they were first asked for
+    def __init__(self, widget, interval_ms=FRAME_MS):
+        self.widget = widget
+        self.interval = interval_ms / 1000
+        self.tasks = OrderedDict()  # name -> function
+        self.job = None
+        self.last = 0.0
+
+    def request(self, name, task):
+        self.tasks[name] = task     # A task already queued keeps its place
+        if self.job is None:
+            wait = self.interval - (time.perf_counter() - self.last)
+            if wait > 0:
+                self.job = self.widget.after(int(wait * 1000) + 1, self.run)
+            else:
+                self.job = self.widget.after_idle(self.run)
+
+    def pending(self, name):
+        return name in self.tasks
+
+    def cancel(self, name):
+        self.tasks.pop(name, None)
+
+    def flush(self, name=None):
+        # Run queued work now (just the task `name` if given), eg: before an action that depends on it
+        if name is None:
+            self.run()
+        elif name in self.tasks:
+            self.tasks.pop(name)()
+
+    def run(self):
+        if self.job is not None:
+            self.widget.after_cancel(self.job)
+            self.job = None
+        self.last = time.perf_counter()
+        tasks = self.tasks
+        self.tasks = OrderedDict()
+        if len(tasks) == 0:
+            return
+        with trace.span("frame", tasks=list(tasks)):
+            for task in tasks.values():
+                task()
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import stat
+import time
+import socketserver
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from . import engine, editgraph, loader, prefetch, encode, batch
+
+# The editor's engine as a long running local service, for other tools (ingest scripts, a web preview...)
+# that want its previews and recipes without starting Tk for each call. It listens on localhost or a Unix
+# socket and runs requests on a bounded process pool: once `capacity` requests are queued or running, more
+# are turned away with 503 and Retry-After rather than piling up. Rendered previews are cached in the
+# server, and identical requests that arrive together share one render; each worker keeps its recent
+# decodes, so previews of one file at other sizes or with other recipes skip the decode.
+#
+#   GET  /preview?file=PATH&size=1024&recipe=rotate:-90   JPEG preview, fitting size x size, after the recipe
+#   POST /process {"file": PATH, "recipe": "...", "output": DIR}   Apply a recipe and save, like the batch command
+#   GET  /metrics    Latency, queue depth and cache counters (JSON)
+#   GET  /health
+#
+# See app/client.py for a client and the "call" command.
+
+DEFAULT_PORT = 8765
+LOCALHOST = "127.0.0.1"
+PREVIEW_SIZE = 1024
+MAX_PREVIEW_SIZE = 8192
+PREVIEW_PROFILE = "web"
+PREVIEW_CACHE_MB = 64       # Encoded previews kept by the server
+DECODE_CACHE_MB = 128       # Decoded images kept by each worker
+LATENCY_SAMPLES = 1000      # Recent requests of each kind the latency percentiles are taken over
+MAX_BODY = 64 * 1024
+RETRY_AFTER = 1             # Seconds a client turned away should wait
+
+decoded = None              # Each worker's cache of decoded images (see init_worker)
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def init_worker():
+    global decoded
+    batch.init_worker()
+    decoded = prefetch.ImageCache(DECODE_CACHE_MB * 1024 * 1024)
+
+def decode(filename, need):
+    # The image upright, decoded at no less than `need`, from this worker's cache if it has one large enough
+    entry = decoded.get(filename) if decoded is not None else None
+    if entry is not None and entry['image'].size[0] >= need[0] and entry['image'].size[1] >= need[1]:
+        return entry['image']
+    mtime = os.stat(filename).st_mtime
+    image = loader.open_reduced(filename, need)
+    if decoded is not None:
+        decoded.put(filename, {'image': image, 'preview': None, 'mtime': mtime})
+    return image
+
+def render_preview(filename, size, steps):
+    # Runs in a worker process. Returns (JPEG data, seconds taken)
+    started = time.perf_counter()
+    full_size = loader.upright_size(filename)
+    ops, convert_to = engine.resolve(steps, full_size)
+    target = loader.fit_size(editgraph.result_size(ops, full_size), (size, size))
+    scale = editgraph.source_scale(ops, full_size, target)
+    need = (max(1, round(full_size[0] * scale)), max(1, round(full_size[1] * scale)))
+    proxy = decode(filename, need)
+    if proxy.size != need:
+        proxy = proxy.resize(need)
+    image = editgraph.preview(proxy, full_size, ops)
+    if image.size != target:
+        image = image.resize(target)
+    data, report = encode.encode(image, "jpeg", PREVIEW_PROFILE)
+    return data, time.perf_counter() - started
+
+class Service():
+    # The work behind the HTTP handler: path checks, the pool, the preview cache and the metrics
+    def __init__(self, workers=None, queue_size=None, roots=(os.curdir,), cache_budget=PREVIEW_CACHE_MB * 1024 * 1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + (queue_size if queue_size is not None else self.workers * 2)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.cache = OrderedDict()  # (file, mtime, size, preview size, recipe) -> JPEG data, most recently used last
+        self.cache_total = 0
+        self.cache_budget = cache_budget
+        self.rendering = {}         # Preview key -> future, for requests to share
+        self.active = 0             # Requests queued or running in the pool
+        self.counters = {'hits': 0, 'misses': 0, 'shared': 0, 'rejected': 0}
+        self.latency = {kind: {'count': 0, 'errors': 0, 'total': deque(maxlen=LATENCY_SAMPLES), 'queued': deque(maxlen=LATENCY_SAMPLES)} for kind in ("preview", "process")}
+        self.started = time.time()
+        self.lock = threading.RLock()
+
+    def path(self, filename, folder=False):
+        # A requested path, if it is inside one of the roots the service was started with
+        if not filename:
+            raise RequestError(400, "No file given")
+        path = os.path.realpath(filename)
+        if not any(path == root or path.startswith(root + os.sep) for root in self.roots):
+            raise RequestError(403, f"Outside the served folders: {filename}")
+        if not folder and not os.path.isfile(path):
+            raise RequestError(404, f"No such file: {filename}")
+        return path
+
+    def submit(self, function, *args):
+        # Call with the lock held. Queue work on the pool, or refuse it when the queue is full
+        if self.active >= self.capacity:
+            self.counters['rejected'] += 1
+            raise RequestError(503, "Busy, try again shortly")
+        future = self.pool.submit(function, *args)    # Counted only once it is queued, in case this raises
+        self.active += 1
+        # A job that has already finished calls finished() straight away in this thread, with the lock
+        # still held: hence the reentrant lock
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.active -= 1
+
+    def record(self, kind, started, worker_seconds=None, error=False):
+        total = time.perf_counter() - started
+        with self.lock:
+            stats = self.latency[kind]
+            stats['count'] += 1
+            stats['errors'] += error
+            stats['total'].append(total * 1000)
+            if worker_seconds is not None:
+                stats['queued'].append(max(0.0, total - worker_seconds) * 1000)
+
+    def preview(self, filename, size=PREVIEW_SIZE, recipe=""):
+        # Returns (JPEG data, "hit", "shared" or "miss")
+        started = time.perf_counter()
+        if not 0 < size <= MAX_PREVIEW_SIZE:
+            raise RequestError(400, f"Preview size must be 1 to {MAX_PREVIEW_SIZE}")
+        steps = engine.parse_recipe(recipe)
+        path = self.path(filename)
+        info = os.stat(path)
+        key = (path, info.st_mtime_ns, info.st_size, size, recipe.replace(" ", "").lower())
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache.move_to_end(key)
+                self.counters['hits'] += 1
+            elif key in self.rendering:
+                future = self.rendering[key]
+                self.counters['shared'] += 1
+                how = "shared"
+            else:
+                future = self.rendering[key] = self.submit(render_preview, path, size, steps)
+                self.counters['misses'] += 1
+                how = "miss"
+        if data is not None:
+            self.record("preview", started)
+            return data, "hit"
+        try:
+            data, worker_seconds = future.result()
+        except Exception:
+            self.record("preview", started, error=True)
+            raise
+        finally:
+            with self.lock:
+                if self.rendering.get(key) is future:
+                    del self.rendering[key]
+        with self.lock:
+            if key not in self.cache and len(data) <= self.cache_budget:
+                self.cache[key] = data
+                self.cache_total += len(data)
+                while self.cache_total > self.cache_budget:
+                    self.cache_total -= len(self.cache.popitem(last=False)[1])
+        self.record("preview", started, worker_seconds)
+        return data, how
+
+    def process(self, filename, recipe, output=None):
+        # Apply a recipe and save, as the batch command does. Returns {'file', 'target', 'method', 'ms'}
+        started = time.perf_counter()
+        steps = engine.parse_recipe(recipe)
+        path = self.path(filename)
+        output_dir = self.path(output, folder=True) if output else None
+        with self.lock:
+            future = self.submit(batch.run_one, path, steps, output_dir, None)
+        filename, target, method, elapsed, error = future.result()
+        self.record("process", started, elapsed, error is not None)
+        if error is not None:
+            raise RequestError(500, error)
+        return {'file': filename, 'target': target, 'method': method, 'ms': round(elapsed * 1000, 1)}
+
+    def metrics(self):
+        def percentile(samples, fraction):
+            return round(samples[min(len(samples) - 1, int(len(samples) * fraction))], 1) if samples else None
+        with self.lock:
+            result = {
+                'uptime_s': round(time.time() - self.started),
+                'workers': self.workers,
+                'capacity': self.capacity,
+                'in_flight': self.active,
+                'queue_depth': max(0, self.active - self.workers),
+                'rejected': self.counters['rejected'],
+                'cache': {'entries': len(self.cache), 'bytes': self.cache_total, 'budget': self.cache_budget,
+                          'hits': self.counters['hits'], 'misses': self.counters['misses'], 'shared': self.counters['shared']},
+            }
+            for kind, stats in self.latency.items():
+                total = sorted(stats['total'])
+                queued = list(stats['queued'])
+                result[kind] = {'count': stats['count'], 'errors': stats['errors'], 'p50_ms': percentile(total, 0.5), 'p95_ms': percentile(total, 0.95),
+                                'max_ms': percentile(total, 1.0), 'queued_ms': round(sum(queued) / len(queued), 1) if queued else None}
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "image-editor"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/preview":
+            self.respond(lambda: self.send_preview(query))
+        elif url.path == "/metrics":
+            self.respond(lambda: self.send_json(200, self.server.service.metrics()))
+        elif url.path == "/health":
+            self.send_json(200, {'ok': True})
+        else:
+            self.send_json(404, {'error': f"Unknown path: {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/process":
+            self.send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        self.respond(self.run_process)
+
+    def send_preview(self, query):
+        try:
+            size = int(query.get('size', PREVIEW_SIZE))
+        except ValueError:
+            raise RequestError(400, "Preview size must be a number")
+        data, how = self.server.service.preview(query.get('file'), size, query.get('recipe', ""))
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Cache", how)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def run_process(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            raise RequestError(413, "Request too large")
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise RequestError(400, "Request body must be JSON")
+        if not isinstance(request, dict):
+            raise RequestError(400, "Request body must be a JSON object")
+        self.send_json(200, self.server.service.process(request.get('file'), request.get('recipe', ""), request.get('output')))
+
+    def respond(self, handle):
+        # Turn failures into JSON error responses
+        try:
+            handle()
+        except RequestError as e:
+            self.send_json(e.status, {'error': str(e)}, {'Retry-After': str(RETRY_AFTER)} if e.status == 503 else {})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def send_json(self, status, value, headers={}):
+        data = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, text in headers.items():
+            self.send_header(name, text)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def make_server(service, port=DEFAULT_PORT, unix=None, verbose=False):
+    if unix is not None:
+        if os.path.exists(unix) and stat.S_ISSOCK(os.stat(unix).st_mode):
+            os.remove(unix) # Left behind by a service that didn't shut down
+        server = UnixHTTPServer(unix, Handler)
+    else:
+        server = ThreadingHTTPServer((LOCALHOST, port), Handler)
+        server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app serve", description="Serve previews and recipes to local tools over HTTP")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help=f"Port on {LOCALHOST} (default: {DEFAULT_PORT})")
+    parser.add_argument("-u", "--unix", help="Listen on this Unix socket instead")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (default: one per core)")
+    parser.add_argument("--queue", type=int, default=None, help="Requests waiting for a worker before more are refused (default: two per worker)")
+    parser.add_argument("--root", action="append", help="Only serve files inside this folder (repeatable, default: the current folder)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+    service = Service(args.workers, args.queue, args.root or [os.curdir])
+    server = make_server(service, args.port, args.unix, args.verbose)
+    where = args.unix if args.unix is not None else f"http://{LOCALHOST}:{args.port}"
+    print(f"Serving {', '.join(service.roots)} on {where} with {service.workers} worker(s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import pickle
+import logging
+from .writer import atomic_write
+
+log = logging.getLogger(__name__)
+
+SETTINGS_VERSION = 1
+MAX_FOLDERS = 100           # Folders whose state is kept, the most recently used
+APP_FOLDER = "pbtools-image-editor"
+
+def config_dir():
+    # Per-user folder for settings and caches
+    if sys.platform.startswith("win"):
+        base = os.environ.get("APPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+    return os.path.join(base, APP_FOLDER)
+
+def config_path(name):
+    folder = config_dir()
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name)
+
+class Settings(dict):
+    # Application settings held in memory. Any change marks them as needing to be saved and calls
+    # on_change (so the app can schedule a debounced save()). Saved as versioned JSON, written atomically.
+    # Also holds per-folder state (last image viewed, crop ratio...) under folder()
+    def __init__(self, filename, defaults=None, legacy_filename=None):
+        super().__init__()
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+        self.folders = {}
+        self.dirty = False
+        self.on_change = None
+        self.load_error = None  # Message for the user if the file could not be read
+        if defaults is not None:
+            super().update(defaults)
+        self.load()
+
+    def changed(self):
+        self.dirty = True
+        if self.on_change is not None:
+            self.on_change()
+
+    def __setitem__(self, key, value):
+        if key in self and self[key] == value:
+            return
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        result = super().pop(key)
+        self.changed()
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        # Through __setitem__, so only values that actually change mark the settings as changed
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def folder(self, folder):
+        # State kept for one folder (read only, use set_folder to change it)
+        return self.folders.get(os.path.abspath(folder), {})
+
+    def set_folder(self, folder, key, value):
+        # Most recently used folders are last, only the newest MAX_FOLDERS are kept
+        folder = os.path.abspath(folder)
+        state = self.folders[folder] = self.folders.pop(folder, {})
+        if state.get(key) != value:
+            state[key] = value
+            for old in list(self.folders)[:-MAX_FOLDERS]:
+                del self.folders[old]
+            self.changed()
+
+    def load(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as f:
+                    data = json.load(f)
+                if data.get('version') != SETTINGS_VERSION:
+                    raise ValueError(f"unsupported version {data.get('version')}")
+                super().update(data['settings'])
+                self.folders = dict(list(data.get('folders', {}).items())[-MAX_FOLDERS:])
+            except Exception as e:
+                # Keep the unreadable file for inspection rather than silently overwriting it
+                kept = self.filename + ".bad"
+                try:
+                    os.replace(self.filename, kept)
+                except OSError:
+                    kept = self.filename
+                self.load_error = f"Settings could not be read ({e}), defaults will be used. The old file was kept as {kept}"
+                log.warning(self.load_error)
+        elif self.legacy_filename is not None and os.path.exists(self.legacy_filename):
+            # Settings from older versions, pickled in the current folder
+            try:
+                with open(self.legacy_filename, "rb") as f:
+                    super().update(pickle.load(f))
+                self.dirty = True
+            except Exception:
+                log.warning("Error reading %s. Invalid content?", self.legacy_filename)
+
+    def save(self):
+        if not self.dirty:
+            return True
+        data = json.dumps({'version': SETTINGS_VERSION, 'settings': dict(self), 'folders': self.folders}, separators=(",", ":"))
+        try:
+            atomic_write(self.filename, lambda f: f.write(data.encode("utf-8")))
+        except OSError as e:
+            log.warning("Unable to save settings to %s: %s", self.filename, e)
+            return False
+        self.dirty = False
+        return True
@@ -0,0 +1,153 @@
+import os
+import io
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from .loader import exif_thumbnail
+from .exiforient import get_orientation, orient, swaps_axes
+from . import trace, resources
+
+# Small previews for the filmstrip, kept in a single SQLite file keyed by path, modification time and size,
+# so a folder that has been seen before can be painted without decoding anything
+
+THUMBNAIL_SIZE = (96, 72)
+THUMBNAIL_QUALITY = 80
+COMMIT_EVERY = 50   # New thumbnails are committed in batches
+
+@trace.traced("thumbnail")
+def make_thumbnail(filename, size=THUMBNAIL_SIZE):
+    # Encoded JPEG bytes of an upright thumbnail, using the EXIF thumbnail or a reduced (draft) decode where possible
+    with resources.open_file(filename) as f, Image.open(f) as image:
+        orientation = get_orientation(image)
+        raw_size = (size[1], size[0]) if swaps_axes(orientation) else size
+        source = None
+        if image.format == "JPEG":
+            thumbnail = exif_thumbnail(image)
+            if thumbnail is not None and (thumbnail.size[0] >= raw_size[0] or thumbnail.size[1] >= raw_size[1]):
+                source = thumbnail
+            else:
+                image.draft("RGB", raw_size)
+        if source is None:
+            image.load()
+            source = image
+        source = orient(source.convert("RGB"), orientation)
+        source.thumbnail(size)
+    data = io.BytesIO()
+    source.save(data, "JPEG", quality=THUMBNAIL_QUALITY)
+    return data.getvalue()
+
+def file_key(filename):
+    # (mtime, size) of a file, or None if it has gone
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return (info.st_mtime, info.st_size)
+
+class ThumbnailStore():
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        try:
+            self.create()
+        except sqlite3.DatabaseError:
+            # Not a database we can use, start again
+            self.db.close()
+            os.remove(filename)
+            self.db = sqlite3.connect(filename, check_same_thread=False)
+            self.create()
+
+    def create(self):
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS thumbnails (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, data BLOB)")
+
+    def get(self, path, key):
+        # Thumbnail bytes for `path` if we have one made from the file as it is now (`key` from file_key)
+        with self.lock:
+            row = self.db.execute("SELECT mtime, size, data FROM thumbnails WHERE path=?", (path,)).fetchone()
+        if row is None or key is None or (row[0], row[1]) != key:
+            return None
+        return row[2]
+
+    def has(self, path, key):
+        with self.lock:
+            row = self.db.execute("SELECT mtime, size FROM thumbnails WHERE path=?", (path,)).fetchone()
+        return row is not None and key is not None and (row[0], row[1]) == key
+
+    def put(self, path, key, data):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO thumbnails (path, mtime, size, data) VALUES (?, ?, ?, ?)", (path, key[0], key[1], data))
+            self.changed()
+
+    def changed(self):
+        # Count a write (made holding the lock) towards the next batch commit
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def discard(self, path):
+        with self.lock:
+            self.db.execute("DELETE FROM thumbnails WHERE path=?", (path,))
+            self.uncommitted += 1
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+class ThumbnailGenerator():
+    # Makes missing thumbnails on a thread pool, in the order they were asked for. Requests that are no
+    # longer wanted (scrolled out of view) are cancelled. Finished paths are collected with poll()
+    def __init__(self, store, workers=None):
+        self.store = store
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+        self.pending = {}   # path -> future
+        self.done = []      # paths finished since the last poll()
+        self.lock = threading.Lock()
+
+    def request(self, paths):
+        with self.lock:
+            for path in list(self.pending):
+                if path not in paths:
+                    self.pending.pop(path).cancel()
+            for path in paths:
+                if path not in self.pending:
+                    self.pending[path] = self.executor.submit(self._make, path)
+
+    def _make(self, path):
+        key = file_key(path)
+        data = None
+        if key is not None:
+            try:
+                data = make_thumbnail(path)
+                self.store.put(path, key, data)
+            except Exception:
+                data = None
+        with self.lock:
+            self.pending.pop(path, None)
+            self.done.append((path, data))
+
+    def poll(self):
+        # (path, thumbnail bytes or None if it could not be made) for everything finished since the last call
+        with self.lock:
+            done = self.done
+            self.done = []
+            return done
+
+    def busy(self):
+        with self.lock:
+            return len(self.pending) > 0 or len(self.done) > 0
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,266 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from . import trace, loader
+
+log = logging.getLogger(__name__)
+
+# Out-of-core viewing of very large images. The first time an image is zoomed into, it is decoded once
+# (JPEG and PNG can't be decoded a region at a time) and written out as a tile pyramid: every level half
+# the size of the one before, cut into fixed size tiles of raw pixels. The pack file is memory mapped, so
+# drawing a viewport only touches the tiles it intersects, at the level that suits the zoom.
+
+TILE_SIZE = 256
+PACK_MAGIC = b"PBTILES1"
+PACK_ALIGN = 4096
+PACK_MODES = {"1": "L", "L": "L", "RGB": "RGB", "RGBA": "RGBA"}   # Anything else is converted to RGB
+BANDS = {"L": 1, "RGB": 3, "RGBA": 4}
+DRAFT_FACTORS = (1, 2, 4, 8)   # JPEG reductions libjpeg can make while decoding
+
+def pack_levels(size):
+    # Sizes of the pyramid levels, from full size down to one that fits in a single tile
+    levels = [size]
+    while levels[-1][0] > TILE_SIZE or levels[-1][1] > TILE_SIZE:
+        levels.append(((levels[-1][0] + 1) // 2, (levels[-1][1] + 1) // 2)) # Same rounding as Image.reduce
+    return levels
+
+def tile_counts(size):
+    return ((size[0] + TILE_SIZE - 1) // TILE_SIZE, (size[1] + TILE_SIZE - 1) // TILE_SIZE)
+
+@trace.traced("build_tiles")
+def build_pack(filename, target, memory=None):
+    # Decode `filename` upright and write its tile pyramid to `target` (atomically, so a pack is always complete).
+    # The full size level is converted and written a row of tiles at a time, each row reduced into the next
+    # level as it goes, so besides the decode itself only a quarter size copy is held. If that would take more
+    # than `memory` bytes, a JPEG is decoded at 1/2, 1/4 or 1/8 size instead (the pack then has fewer pixels
+    # than the image, and zooming in further enlarges them); other formats can't be, and are refused
+    info = loader.header(filename, large=True)
+    full = info['size']
+    factor = 1
+    if memory is not None:
+        bands = max(Image.getmodebands(info['mode']), BANDS[PACK_MODES.get(info['mode'], "RGB")])
+        copies = 1.25 if info['orientation'] == 1 else 2.25    # Turning the decode upright copies it
+        factors = [f for f in (DRAFT_FACTORS if info['format'] == "JPEG" else (1,)) if full[0] * full[1] * bands * copies / (f * f) <= memory]
+        if len(factors) == 0:
+            raise MemoryError(f"{full[0]}x{full[1]} is too large to build tiles for in {memory / 1024 / 1024:.0f} MB")
+        factor = factors[0]
+    trace.annotate(size=full, factor=factor)
+    if factor == 1:
+        image = loader.open_full(filename, large=True)
+    else:
+        image = loader.open_reduced(filename, ((full[0] + factor - 1) // factor, (full[1] + factor - 1) // factor), large=True)
+    mode = PACK_MODES.get(image.mode, "RGB")
+    levels = pack_levels(image.size)
+    tile_bytes = TILE_SIZE * TILE_SIZE * BANDS[mode]
+    offsets = []
+    position = 0
+    for size in levels:
+        offsets.append(position)
+        columns, rows = tile_counts(size)
+        position += columns * rows * tile_bytes
+    header = json.dumps({'mode': mode, 'tile': TILE_SIZE, 'levels': levels, 'offsets': offsets, 'full': full}).encode("utf-8")
+    data_start = (len(PACK_MAGIC) + 4 + len(header) + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+    temp = target + ".tmp"
+    try:
+        with open(temp, "wb") as f:
+            f.write(PACK_MAGIC + struct.pack("<I", len(header)) + header)
+            f.seek(data_start)
+            reduced = Image.new(mode, levels[1]) if len(levels) > 1 else None
+            columns, rows = tile_counts(levels[0])
+            for ty in range(rows):
+                band = image.crop((0, ty * TILE_SIZE, levels[0][0], min(levels[0][1], (ty + 1) * TILE_SIZE)))
+                if band.mode != mode:
+                    band = band.convert(mode)
+                write_tiles(f, band, columns)
+                if reduced is not None:
+                    reduced.paste(band.reduce(2), (0, ty * TILE_SIZE // 2))
+            image = reduced # Let the full size decode go
+            for i, size in enumerate(levels[1:]):
+                if i > 0:
+                    image = image.reduce(2) # Replaces the larger level, so only one level is held at a time
+                columns, rows = tile_counts(size)
+                for ty in range(rows):
+                    write_tiles(f, image.crop((0, ty * TILE_SIZE, size[0], (ty + 1) * TILE_SIZE)), columns)
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return target
+
+def write_tiles(f, band, columns):
+    # Write one row of tiles from a band of the image TILE_SIZE pixels high (or less at the bottom)
+    for tx in range(columns):
+        f.write(band.crop((tx * TILE_SIZE, 0, (tx + 1) * TILE_SIZE, TILE_SIZE)).tobytes()) # Edge tiles are padded out to full size
+
+class TilePack():
+    # A memory mapped tile pyramid written by build_pack
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(PACK_MAGIC)] != PACK_MAGIC:
+            self.close()
+            raise ValueError(f"{filename} is not a tile pack")
+        length = struct.unpack("<I", self.map[len(PACK_MAGIC):len(PACK_MAGIC)+4])[0]
+        start = len(PACK_MAGIC) + 4
+        header = json.loads(self.map[start:start+length].decode("utf-8"))
+        self.mode = header['mode']
+        self.levels = [tuple(size) for size in header['levels']]
+        self.data_start = (start + length + PACK_ALIGN - 1) // PACK_ALIGN * PACK_ALIGN
+        self.offsets = [self.data_start + offset for offset in header['offsets']]
+        self.tile_bytes = TILE_SIZE * TILE_SIZE * BANDS[self.mode]
+        self.size = tuple(header.get('full', self.levels[0]))   # The image's size, more than the first level's if it was decoded reduced
+
+    def level_for(self, zoom):
+        # Smallest level with at least `zoom` level pixels per full size pixel
+        best = 0
+        for i, (w, h) in enumerate(self.levels):
+            if w / self.size[0] >= zoom:
+                best = i
+        return best
+
+    def tile(self, level, tx, ty):
+        columns = tile_counts(self.levels[level])[0]
+        start = self.offsets[level] + (ty * columns + tx) * self.tile_bytes
+        return Image.frombytes(self.mode, (TILE_SIZE, TILE_SIZE), self.map[start:start+self.tile_bytes])
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class TileCache():
+    # Least recently used tiles, bounded by a memory budget in bytes
+    def __init__(self, budget):
+        self.budget = budget
+        self.tiles = OrderedDict()  # (pack filename, level, tx, ty) -> image
+        self.total = 0
+
+    def get(self, pack, level, tx, ty):
+        key = (pack.filename, level, tx, ty)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        tile = pack.tile(level, tx, ty)
+        self.tiles[key] = tile
+        self.total += pack.tile_bytes
+        while self.total > self.budget and len(self.tiles) > 1:
+            key, old = self.tiles.popitem(last=False)
+            self.total -= len(old.getbands()) * TILE_SIZE * TILE_SIZE
+        return tile
+
+    def region(self, pack, level, box):
+        # The part of a level inside box (level pixel coordinates), assembled from tiles
+        x0, y0, x1, y1 = box
+        region = Image.new(pack.mode, (x1 - x0, y1 - y0))
+        for ty in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1):
+            for tx in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+                region.paste(self.get(pack, level, tx, ty), (tx * TILE_SIZE - x0, ty * TILE_SIZE - y0))
+        return region
+
+    def nbytes(self):
+        return self.total
+
+    def shrink(self, nbytes):
+        # Drop least recently used tiles until `nbytes` are freed; they are read back from their pack if needed
+        before = self.total
+        while len(self.tiles) > 0 and before - self.total < nbytes:
+            key, old = self.tiles.popitem(last=False)
+            self.total -= len(old.getbands()) * TILE_SIZE * TILE_SIZE
+        return before - self.total
+
+    def clear(self):
+        self.tiles.clear()
+        self.total = 0
+
+class PackStore():
+    # Tile packs for recently zoomed images, kept in one folder up to a disk budget (oldest removed first).
+    # Packs are built one at a time on a background thread
+    def __init__(self, folder, budget):
+        self.folder = folder
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tiles")
+        self.building = {}  # pack filename -> future
+        self.failed = set() # pack filenames that could not be built
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def pack_filename(self, filename):
+        # Packs are named after the file's path, modification time and size, so an edited file gets a new one
+        info = os.stat(filename)
+        key = f"{os.path.abspath(filename)}|{info.st_mtime}|{info.st_size}"
+        return os.path.join(self.folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".tiles")
+
+    def get(self, filename, memory=None):
+        # The pack for a file if it has been built, otherwise start building it (in `memory` bytes, see build_pack) and return None
+        try:
+            target = self.pack_filename(filename)
+        except OSError:
+            return None
+        with self.lock:
+            future = self.building.get(target)
+            if future is not None and not future.done():
+                return None
+            self.building.pop(target, None)
+            if target in self.failed:
+                return None
+            if not os.path.exists(target):
+                if future is None:
+                    self.building[target] = self.executor.submit(self._build, filename, target, memory)
+                else:
+                    self.failed.add(target)
+                return None
+        try:
+            os.utime(target)    # Recently used, see trim()
+            return TilePack(target)
+        except (OSError, ValueError):
+            return None
+
+    def is_building(self, filename):
+        try:
+            target = self.pack_filename(filename)
+        except OSError:
+            return False
+        with self.lock:
+            future = self.building.get(target)
+            return future is not None and not future.done()
+
+    def _build(self, filename, target, memory):
+        try:
+            build_pack(filename, target, memory)
+        except Exception as e:
+            log.warning("Unable to build tiles for %s: %s", filename, e)
+        self.trim(keep=target)
+
+    def trim(self, keep=None):
+        packs = []
+        for name in os.listdir(self.folder):
+            if name.endswith(".tiles"):
+                path = os.path.join(self.folder, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                packs.append((info.st_mtime, info.st_size, path))
+        packs.sort()
+        total = sum(size for mtime, size, path in packs)
+        for mtime, size, path in packs:
+            if total <= self.budget:
+                break
+            if path != keep:
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
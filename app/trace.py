@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import functools
+import threading
+from collections import deque
+
+# Timed spans around the editor's expensive operations, for finding out where time goes on real machines.
+# Off by default, when a span costs one flag test. When on, finished spans are kept (up to MAX_SPANS) for
+# export in Chrome's trace format (load the file in chrome://tracing or https://ui.perfetto.dev), and the
+# breakdown of the last top level span on the UI thread is passed to on_frame (for the on-screen HUD).
+#
+#   @trace.traced("file_open")          Time every call of a function
+#   with trace.span("decode", file=f):  Time a block
+#   trace.annotate(size=image.size)     Add attributes to the innermost open span
+#   trace.counter("memory_mb", image=12) Record values over time (drawn as a graph)
+
+MAX_SPANS = 200000
+
+enabled = False
+on_frame = None     # Called with (name, milliseconds, {child name: milliseconds}, attributes)
+spans = deque(maxlen=MAX_SPANS)
+counters = deque(maxlen=MAX_SPANS)
+local = threading.local()
+started = time.perf_counter()
+
+class Span():
+    __slots__ = ("name", "attrs", "start", "children", "parent")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.children = {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(local, "stack", None)
+        if stack is None:
+            stack = local.stack = []
+        self.parent = stack[-1] if len(stack) > 0 else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter()
+        local.stack.pop()
+        duration = end - self.start
+        spans.append((self.name, self.start, duration, threading.get_ident(), self.attrs))
+        if self.parent is not None:
+            self.parent.children[self.name] = self.parent.children.get(self.name, 0.0) + duration
+        elif on_frame is not None and threading.current_thread() is threading.main_thread():
+            on_frame(self.name, duration * 1000, {name: t * 1000 for name, t in self.children.items()}, self.attrs)
+        return False
+
+class NullSpan():
+    # Stands in for a span while tracing is off
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name, **attrs):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, attrs)
+
+def traced(name=None):
+    # Decorator timing every call of a function as a span
+    def decorate(function):
+        label = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(label, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def annotate(**attrs):
+    # Attach attributes to the innermost span open on this thread
+    if enabled:
+        stack = getattr(local, "stack", None)
+        if stack:
+            stack[-1].attrs.update(attrs)
+
+def counter(name, **values):
+    if enabled:
+        counters.append((name, time.perf_counter(), values))
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def clear():
+    spans.clear()
+    counters.clear()
+
+def summary():
+    # {name: (count, total ms, max ms)} over the recorded spans
+    result = {}
+    for name, start, duration, thread, attrs in list(spans):
+        count, total, longest = result.get(name, (0, 0.0, 0.0))
+        result[name] = (count + 1, total + duration * 1000, max(longest, duration * 1000))
+    return result
+
+def jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    return str(value)
+
+def export_chrome(filename):
+    # Write the recorded spans and counters as a Chrome trace ("X" complete and "C" counter events, microseconds)
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    pid = os.getpid()
+    events = []
+    threads = set()
+    for name, start, duration, thread, attrs in list(spans):
+        threads.add(thread)
+        events.append({
+            'name': name, 'cat': "app", 'ph': "X", 'pid': pid, 'tid': thread,
+            'ts': round((start - started) * 1000000, 1), 'dur': round(duration * 1000000, 1),
+            'args': {key: jsonable(value) for key, value in attrs.items()},
+        })
+    for name, moment, values in list(counters):
+        events.append({'name': name, 'ph': "C", 'pid': pid, 'ts': round((moment - started) * 1000000, 1), 'args': values})
+    for thread in threads:
+        events.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': thread, 'args': {'name': names.get(thread, str(thread))}})
+    with open(filename, "w") as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, f)
+    return len(events)
@@ -0,0 +1,112 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from . import trace
+
+@trace.traced("write_file")
+def atomic_write(filename, write):
+    # Call write(fileobj) to produce the file's contents in a temporary file next to it, flush it to disk,
+    # then rename it over `filename` so a crash never leaves a half written file behind. Returns what write returned
+    folder = os.path.dirname(os.path.abspath(filename))
+    temp = os.path.join(folder, f".{os.path.basename(filename)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp, "wb") as f:
+            result = write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp)
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable
+        try:
+            fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+    return result
+
+class BackgroundWriter():
+    # Saves files one at a time on a worker thread. A save queued for a file that is already waiting
+    # to be written replaces the earlier one. Results are collected on the UI thread with poll()
+    def __init__(self):
+        self.jobs = OrderedDict()   # filename -> write function, waiting to start
+        self.active = None          # filename being written now
+        self.results = []           # (filename, error or None, what the write function returned) not yet collected by poll()
+        self.failed = {}            # filename -> error, for saves that have not since succeeded
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, write):
+        with self.condition:
+            self.jobs.pop(filename, None)
+            self.jobs[filename] = write
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.jobs) == 0 and not self.stopping:
+                    self.condition.wait()
+                if len(self.jobs) == 0:
+                    return
+                filename, write = self.jobs.popitem(last=False)
+                self.active = filename
+            result = None
+            try:
+                result = atomic_write(filename, write)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            with self.condition:
+                self.active = None
+                self.results.append((filename, error, result))
+                if error is None:
+                    self.failed.pop(filename, None)
+                else:
+                    self.failed[filename] = error
+                self.condition.notify_all()
+
+    def poll(self):
+        # Saves finished since the last call, as (filename, error or None, result of the write function)
+        with self.condition:
+            results = self.results
+            self.results = []
+            return results
+
+    def failures(self):
+        # {filename: error} for saves that have failed and not since succeeded
+        with self.condition:
+            return dict(self.failed)
+
+    def pending(self):
+        with self.condition:
+            return len(self.jobs) + (1 if self.active is not None else 0)
+
+    def is_pending(self, filename):
+        with self.condition:
+            return filename in self.jobs or self.active == filename
+
+    def wait(self, filename=None, timeout=None):
+        # Block until `filename` (or everything) has been written
+        with self.condition:
+            if filename is None:
+                return self.condition.wait_for(lambda: len(self.jobs) == 0 and self.active is None, timeout)
+            return self.condition.wait_for(lambda: filename not in self.jobs and self.active != filename, timeout)
+
+    def shutdown(self):
+        # Finish everything that has been queued, then stop the thread
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import threading
+import importlib.util
+
+# Benchmarks for the editor's hot paths, driven through the real AppWindow with dialogs answered automatically.
+# Tk needs a display: on a machine without one run it under a virtual one, eg: xvfb-run python benchmarks/run.py
+#
+#   python benchmarks/run.py --quick                          Small images only
+#   python benchmarks/run.py --save-baseline                  Record benchmarks/baseline.json
+#   python benchmarks/run.py --baseline benchmarks/baseline.json --threshold 0.2
+#                                                             Exit 1 if any case's median is more than 20% slower
+#
+# Timings depend on the machine, so no baseline is kept in the repository: record one with --save-baseline
+# (on the machine and with the options that will be compared) before using --baseline.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_WORKDIR = os.path.join(ROOT, ".benchmarks")
+NOISE_FLOOR_MS = 1.0    # Differences smaller than this are never counted as regressions
+FOLDER_SIZES = (1000, 10000)
+QUICK_FOLDER_SIZES = (1000,)
+
+class MemorySampler():
+    # Peak resident memory while a case runs, sampled from /proc where available (Pillow's allocations
+    # are invisible to tracemalloc), otherwise the process' lifetime peak from getrusage
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.running = False
+        self.page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page
+        except OSError:
+            try:
+                import resource
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                return peak if sys.platform == "darwin" else peak * 1024
+            except ImportError:
+                return 0
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.rss())
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+def summarise(times, peak):
+    ms = [t * 1000 for t in times]
+    return {
+        'count': len(ms),
+        'p50': round(percentile(ms, 50), 3),
+        'p90': round(percentile(ms, 90), 3),
+        'p99': round(percentile(ms, 99), 3),
+        'max': round(max(ms), 3),
+        'mean': round(sum(ms) / len(ms), 3),
+        'peak_mb': round(peak / 1024 / 1024, 1),
+    }
+
+class FakeEvent():
+    # Just enough of a Tk key event for AppWindow.keyboard_handler and crop()
+    def __init__(self, keysym, state=0):
+        self.type = "KeyPress"
+        self.keysym = keysym
+        self.char = ""
+        self.state = state
+
+def load_editor():
+    # image-editor.py isn't importable by name (the hyphen), so load it from its path
+    spec = importlib.util.spec_from_file_location("image_editor", os.path.join(ROOT, "image-editor.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def patch_dialogs(editor):
+    # Answer every dialog without showing it: don't save changes, no file chosen, errors recorded
+    errors = []
+    editor.messagebox.askyesno = lambda *args, **kwargs: False
+    editor.messagebox.showerror = lambda title, message, **kwargs: errors.append(message)
+    editor.messagebox.showwarning = lambda title, message, **kwargs: errors.append(message)
+    editor.filedialog.askopenfilename = lambda *args, **kwargs: ""
+    editor.filedialog.asksaveasfilename = lambda *args, **kwargs: ""
+    return errors
+
+class Bench():
+    def __init__(self, app, repeat):
+        self.app = app
+        self.repeat = repeat
+        self.results = {}
+
+    def settle(self):
+        # Let deferred work (queued input, render refinement) finish so it is counted in the time taken
+        self.app.scheduler.flush()
+        self.app.window.update_idletasks()
+
+    def case(self, name, run, setup=None, repeat=None):
+        times = []
+        with MemorySampler() as memory:
+            for i in range(repeat or self.repeat):
+                if setup is not None:
+                    setup()
+                    self.settle()
+                started = time.perf_counter()
+                run()
+                self.settle()
+                times.append(time.perf_counter() - started)
+        self.results[name] = summarise(times, memory.peak)
+        print(f"{name:45} p50 {self.results[name]['p50']:9.1f} ms   p90 {self.results[name]['p90']:9.1f} ms   peak {self.results[name]['peak_mb']:7.0f} MB", flush=True)
+
+    def cold_open(self, filename):
+        def setup():
+            self.app.is_dirty(False)
+            self.app.file_open(filename)    # Something else open, so the open below is a real change of file
+            self.app.image_cache.clear()
+        return setup
+
+def image_cases(bench, filename, label):
+    app = bench.app
+    scratch = filename + ".open.tmp"
+    shutil.copyfile(filename, scratch)
+    bench.case(f"file_open {label}", lambda: app.file_open(filename), setup=bench.cold_open(scratch))
+    bench.case(f"show_image {label}", lambda: app.show_image())
+    def fresh():
+        app.file_open(scratch)
+        app.file_open(filename)
+    bench.case(f"rotate_left {label}", app.rotate_left, setup=fresh)
+    bench.case(f"rotate_right {label}", app.rotate_right)
+    keys = ["Right", "Down", "plus", "minus", "Left", "Up"] * 3
+    def crop_keys():
+        for key in keys:
+            app.keyboard_handler(FakeEvent(key))
+            bench.settle()
+    def crop_start():
+        fresh()
+        app.crop()
+    bench.case(f"crop 18 keystrokes {label}", crop_keys, setup=crop_start)
+    bench.case(f"crop return {label}", lambda: app.keyboard_handler(FakeEvent("Return")), setup=crop_start)
+    def edits():
+        fresh()
+        for i in range(4):
+            app.rotate_left()
+        app.crop()
+        app.keyboard_handler(FakeEvent("Return"))
+    def undo_all():
+        while len(app.history) > 0:
+            app.undo()
+    bench.case(f"undo chain x5 {label}", undo_all, setup=edits)
+    bench.case(f"revert {label}", app.revert, setup=edits)
+    saved = filename + ".save.tmp" + os.path.splitext(filename)[1]
+    def crop_to_save():
+        shutil.copyfile(filename, saved)
+        app.file_open(scratch)
+        app.file_open(saved)
+        app.crop()
+        app.keyboard_handler(FakeEvent("Return"))
+    def save():
+        app.file_save()
+        app.writer.wait()
+    bench.case(f"file_save {label}", save, setup=crop_to_save)
+    app.file_open(scratch)
+    for f in (saved, scratch):
+        app.image_cache.discard(f)
+        if os.path.exists(f):
+            os.remove(f)
+
+def folder_cases(bench, editor, workdir, sizes):
+    app = bench.app
+    for count in sizes:
+        folder = synthetic.large_folder(os.path.join(workdir, f"folder-{count}"), count)
+        def cold():
+            app.folder_indexes = editor.folderindex.FolderIndexStore(os.path.join(workdir, "index-scratch.json"), editor.SUPPORTED_IMAGE_EXTENSIONS)
+        bench.case(f"get_images_in_folder cold {count} files", lambda: app.get_images_in_folder(folder), setup=cold)
+        bench.case(f"get_images_in_folder warm {count} files", lambda: app.get_images_in_folder(folder))
+
+def compare(results, baseline, threshold):
+    # Cases whose median got slower than the baseline by more than `threshold` (a fraction)
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p50'] > before['p50'] * (1 + threshold) and result['p50'] - before['p50'] > NOISE_FLOOR_MS:
+            regressions.append((name, before['p50'], result['p50']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image editor's hot paths")
+    parser.add_argument("--quick", action="store_true", help=f"Only {', '.join(str(m) for m in synthetic.QUICK_MEGAPIXELS)} MP images and small folders")
+    parser.add_argument("--megapixels", type=int, nargs="+", help="Image sizes to test, in megapixels")
+    parser.add_argument("--modes", nargs="+", default=list(synthetic.MODES), choices=synthetic.MODES)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each case")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="Where synthetic images are generated (and kept for next time)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with this results file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slow down before a case counts as a regression (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Save the results as the baseline")
+    args = parser.parse_args(argv)
+    if args.baseline and not os.path.isfile(args.baseline):
+        parser.error(f"No baseline at {args.baseline}, record one first with --save-baseline")
+    megapixels = args.megapixels or (synthetic.QUICK_MEGAPIXELS if args.quick else synthetic.MEGAPIXELS)
+    folder_sizes = QUICK_FOLDER_SIZES if args.quick else FOLDER_SIZES
+    # Keep the benchmark's settings, indexes and thumbnails away from the user's own
+    editor = load_editor()
+    editor.settings.config_dir = lambda: os.path.join(args.workdir, "config")
+    errors = patch_dialogs(editor)
+    try:
+        root = editor.tk.Tk()
+    except editor.tk.TclError as e:
+        print(f"Tk could not start ({e}). Run under a display, eg: xvfb-run python benchmarks/run.py")
+        return 2
+    root.withdraw()
+    app = editor.AppWindow(root)
+    app.window.geometry("1600x1000")
+    app.window.update()
+    app.prefetcher.radius = 0   # No background decoding of neighbours competing with the cases
+    bench = Bench(app, args.repeat)
+    for mp in megapixels:
+        for mode in args.modes:
+            filename = synthetic.image_file(os.path.join(args.workdir, "images"), mp, mode)
+            image_cases(bench, filename, f"{mp}MP {mode}")
+    folder_cases(bench, editor, args.workdir, folder_sizes)
+    app.quit()
+    root.destroy()
+    report = {
+        'meta': {'python': platform.python_version(), 'pillow': editor.Image.__version__, 'platform': platform.platform(), 'repeat': args.repeat, 'time': time.strftime("%Y-%m-%d %H:%M:%S")},
+        'errors': errors,
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    status = 0
+    if len(errors) > 0:
+        print(f"{len(errors)} error(s) shown by the editor:")
+        for message in errors:
+            print(f"  {message}")
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(bench.results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.1f} ms -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)")
+        if len(regressions) > 0:
+            status = 1
+        else:
+            print(f"No regressions above {args.threshold * 100:.0f}% against {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import os
+from PIL import Image
+
+# Synthetic test images: smooth gradients with noise on top, so they compress (and decode) like photos
+# rather than like flat colour
+
+MEGAPIXELS = (1, 12, 24, 50, 100)
+QUICK_MEGAPIXELS = (1, 12)
+MODES = ("RGB", "RGBA", "L")
+EXTENSIONS = {"RGB": "jpg", "L": "jpg", "RGBA": "png"}
+
+def image_size(megapixels):
+    # 3:2 landscape with about `megapixels` million pixels
+    height = int((megapixels * 1000000 / 1.5) ** 0.5)
+    return (int(height * 1.5), height)
+
+def make_image(size, mode):
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    base = Image.blend(gradient, noise, 0.3)
+    if mode == "L":
+        return base
+    bands = [base, base.transpose(Image.FLIP_LEFT_RIGHT), base.transpose(Image.FLIP_TOP_BOTTOM)]
+    if mode == "RGBA":
+        bands.append(gradient.transpose(Image.ROTATE_180))
+    return Image.merge(mode, bands)
+
+def image_file(folder, megapixels, mode):
+    # Path of a synthetic image, generated the first time it is asked for
+    filename = os.path.join(folder, f"synthetic-{megapixels}mp-{mode.lower()}.{EXTENSIONS[mode]}")
+    if not os.path.exists(filename):
+        os.makedirs(folder, exist_ok=True)
+        image = make_image(image_size(megapixels), mode)
+        if EXTENSIONS[mode] == "jpg":
+            image.save(filename, quality=90)
+        else:
+            image.save(filename, compress_level=1)
+    return filename
+
+def large_folder(folder, count):
+    # A folder of `count` (empty) image files, for listing and sorting benchmarks
+    os.makedirs(folder, exist_ok=True)
+    existing = len(os.listdir(folder))
+    for i in range(existing, count):
+        open(os.path.join(folder, f"img_{i}.jpg"), "wb").close()
+    return folder
@@ -1,57 +1,107 @@
 # System package imports
 import tkinter as tk
 from tkinter import ttk
-from tkinter import messagebox, filedialog, simpledialog
+from tkinter import messagebox, filedialog, simpledialog, colorchooser
 import os, sys
-import pickle
+import time
+STARTED = time.perf_counter() # For --startup-profile
+import argparse
+import logging
 # 3rd party package imports
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont
 # Project imports
 import app
+from app import prefetch, folderindex, loader, render, history, operations, editgraph, encode, exiforient, engine, writer, settings, icons, thumbnails, filmstrip, tiles, scheduler, trace, duplicates, duplicatewindow, drawing, resize, resizewindow, metadata, infopanel, adjust, adjustwindow, resources
+
+log = logging.getLogger("image-editor")
 
 ALLOWED_FILES = (("JPEG files","*.jpg"),("PNG files","*.png"),("all files","*.*"))
 IMAGE_FRAME_BACKGROUND = "gray95"
 TOOLS_BACKGROUND = "gray90"
-SETTINGS_FILE = "image-editor-settings.pickle"
+SETTINGS_FILE = "image-editor-settings.json"          # Kept in the per-user config folder (see app/settings.py)
+LEGACY_SETTINGS_FILE = "image-editor-settings.pickle"  # Older versions pickled their settings into the current folder
+INDEX_FILE = "image-editor-index.json"
+THUMBNAIL_FILE = "image-editor-thumbnails.sqlite"
 SUPPORTED_IMAGE_EXTENSIONS = ("jpg", "jpeg", "png")
+SETTINGS_DEBOUNCE_MS = 2000  # Settings changes are written this long after the last one (and at exit)
+PREFETCH_RADIUS = 2         # Number of images either side of the current one to decode in advance
+CACHE_BUDGET_MB = 512       # Memory allowed for decoded images held by the prefetch cache
+FILMSTRIP_HEIGHT = 96      # Height of the thumbnail strip under the image
+TILE_CACHE_MB = 64          # Memory for tiles of zoomed very large images
+TILE_DISK_MB = 4096         # Disk space for their tile packs
+TILE_THRESHOLD_MP = 40      # Images larger than this (in megapixels) are zoomed from tiles rather than decoded in full
+ZOOM_STEP = 1.25
+HISTORY_BUDGET_MB = 256     # Memory allowed for undo snapshots before they spill to a temporary file
+PEN_WIDTH = 8               # Default width of the drawing tools, in image pixels
+MEMORY_BUDGET_MB = 1536     # Memory allowed for all decoded pixels together; least valuable first to go (see app/resources.py)
+MEMORY_CHECK_MS = 1000      # How often memory use is checked against it
 
 class AppWindow():
-    def __init__(self, parent):
+    def __init__(self, parent, startup_profile=False, trace_file=None, hud=False):
         # Create the window
+        self.startup = {'profile': startup_profile, 'window': None, 'paint': None, 'image': None}
         self.parent = parent                # Save a reference to our parent object
         self.window = tk.Toplevel()         # Create a window
         self.window.geometry("1200x700")     # Set pixel dimensions 400 wide by 200 high
         self.window.title("pbTools image editor")       # Set window title text
-        self.window.state('zoomed')         # Maximise window
-        self.window.protocol("WM_DELETE_WINDOW", self.window.quit) # Enable the close icon
-        self.window.update() # https://stackoverflow.com/a/49216638/10971929
-        dimensions = (max(1200,self.window.winfo_width()), max(700,self.window.winfo_height()))
-        print(f"Window size: {dimensions}")
+        try:
+            self.window.state('zoomed')     # Maximise window
+        except tk.TclError:
+            self.window.attributes('-zoomed', True) # X11 window managers
+        self.window.protocol("WM_DELETE_WINDOW", self.quit) # Enable the close icon
+        # Frames are placed relative to the window edges, so nothing has to wait for the window to be mapped to learn its size
         # Image display area...
         self.image_frame = tk.Frame(self.window)
-        self.image_frame.place(x=54, y=0, width=dimensions[0]-54, height=dimensions[1]-100)
+        self.image_frame.place(x=54, y=0, relwidth=1, width=-54, relheight=1, height=-100-FILMSTRIP_HEIGHT)
         self.image_frame.config(background=IMAGE_FRAME_BACKGROUND) # colour names @ http://www.science.smith.edu/dftwiki/images/3/3d/TkInterColorCharts.png
-        self.image_frame.update()
-        frame_size = (self.image_frame.winfo_width(), self.image_frame.winfo_height())
         self.image_container = tk.Label(self.image_frame, text="", bg=IMAGE_FRAME_BACKGROUND)
-        self.image_container.place(x=0, y=0, width=frame_size[0], height=frame_size[1])
+        self.image_container.place(x=0, y=0, relwidth=1, relheight=1)
+        self.tile_cache = tiles.TileCache(TILE_CACHE_MB * 1024 * 1024)
+        self.renderer = render.Renderer(self.image_container, self.tile_cache)
+        self.image_container.bind('<ButtonPress-1>', self.mouse_handler)
+        self.image_container.bind('<B1-Motion>', self.mouse_handler)
+        self.image_container.bind('<ButtonRelease-1>', self.mouse_handler)
+        self.image_container.bind('<MouseWheel>', self.mouse_wheel)
+        self.image_container.bind('<Button-4>', self.mouse_wheel)
+        self.image_container.bind('<Button-5>', self.mouse_wheel)
+        self.pan_from = None
+        self.scheduler = scheduler.Scheduler(self.window) # Coalesces redraws, navigation and rotations from repeating keys
+        self.nav_steps = 0      # Queued moves through the folder not yet acted on
+        self.pending_angle = 0  # Queued rotation not yet applied
+        self.pending_open = None # File being decoded in the background, to be opened when ready
         # Toolbars and property frames...
         self.toolbar_frame = tk.Frame(self.window)
-        self.toolbar_frame.place(x=0, y=0, width=54, height=dimensions[1])
+        self.toolbar_frame.place(x=0, y=0, width=54, relheight=1)
         self.toolbar_frame.config(background=TOOLS_BACKGROUND)
         self.toolsettings_frame = tk.Frame(self.window)
-        self.toolsettings_frame.place(x=0, y=dimensions[1]-100, width=dimensions[0]-216, height=100)
+        self.toolsettings_frame.place(x=0, rely=1, y=-100, relwidth=1, width=-216, height=100)
         self.toolsettings_frame.config(background=TOOLS_BACKGROUND)
         self.active_tool_text = tk.Label(self.toolsettings_frame, text="", font=("Arial",20), bg=TOOLS_BACKGROUND)
         self.active_tool_text.place(x=70,y=0)
+        self.timing_text = tk.Label(self.toolsettings_frame, text="", font=("Arial",12), bg=TOOLS_BACKGROUND)
+        self.timing_text.place(x=70,y=40)
         self.dirty_text = tk.Label(self.toolsettings_frame, text="", font=("Arial",20), bg=TOOLS_BACKGROUND, foreground="red")
         self.dirty_text.place(x=930,y=00)
+        self.save_status_text = tk.Label(self.toolsettings_frame, text="", font=("Arial",12), bg=TOOLS_BACKGROUND, foreground="red")
+        self.save_status_text.place(x=700,y=40)
+        self.memory_text = tk.Label(self.toolsettings_frame, text="", font=("Arial",10), bg=TOOLS_BACKGROUND, foreground="gray40")
+        self.memory_text.place(x=700,y=70)
+        self.hud_text = tk.Label(self.toolsettings_frame, text="", font=("Courier",10), bg=TOOLS_BACKGROUND, justify=tk.LEFT, anchor="nw")
+        self.hud = tk.BooleanVar(value=False)   # Show the cost of the last operation (see app/trace.py)
+        self.save_profile = tk.StringVar(value=encode.DEFAULT_PROFILE) # Encoder settings for saves (see app/encode.py)
+        self.trace_file = trace_file            # Where to save a trace of the session on exit
+        self.trace_requested = trace_file is not None   # Tracing asked for by the user, not just by the HUD
         self.bottombar_frame = tk.Frame(self.window)
-        self.bottombar_frame.place(x=dimensions[0]-216, y=dimensions[1]-100, width=216, height=54)
+        self.bottombar_frame.place(relx=1, x=-216, rely=1, y=-100, width=216, height=54)
         self.bottombar_frame.config(background=TOOLS_BACKGROUND)
         self.properties_frame = tk.Frame(self.window)
-        self.properties_frame.place(x=dimensions[0]-216, y=dimensions[1]-48, width=216, height=48)
+        self.properties_frame.place(relx=1, x=-216, rely=1, y=-48, width=216, height=48)
         self.properties_frame.config(background=TOOLS_BACKGROUND)
+        self.properties_filename_label = tk.Label(self.properties_frame, text="", font=('Arial', 12), bg=TOOLS_BACKGROUND, justify=tk.LEFT, anchor="w")
+        self.properties_filename_label.place(x=0, y=0, width=216)
+        self.properties_dimensions_label = tk.Label(self.properties_frame, text="", font=('Arial', 12), bg=TOOLS_BACKGROUND, justify=tk.LEFT, anchor="w")
+        self.properties_dimensions_label.place(x=0, y=20, width=216)
+        self.show_info = tk.BooleanVar(value=False) # Show the image info panel (see app/infopanel.py)
         # Set application path global (used for pyinstaller) 
         # From https://stackoverflow.com/a/404750
         if getattr(sys, 'frozen', False):
@@ -59,6 +109,10 @@ class AppWindow():
         elif __file__:
             self.application_path = os.path.dirname(__file__)
         # Setup remaining elements
+        if trace_file is not None or hud:
+            trace.enable()
+        self.hud.set(hud)
+        self.toggle_hud()
         self.load_assets()
         self.generate_menu()
         self.generate_toolbar(self.toolbar_frame)
@@ -67,13 +121,35 @@ class AppWindow():
         self.filename = ""
         self.fileopen = False
         self.__dirty = False
-        self.image = None       # The PIL image object
+        self.image = None       # The PIL image object (None until needed when only a draft preview has been decoded)
         self.imageTk = None     # The PIL imagetk object (note: self.image will be authoritative)
+        self.image_mtime = None # Modification time of the file when self.image was decoded
+        self.file_info = {}     # Format, size and EXIF orientation of the file on disk, and the rotation it represents (see save_orientation)
+        self.edit_base = None   # Reduced copy of the image before its pending edits, for previewing them (see preview_edits)
+        self.preview_key = None # (pending edits, frame size) of the preview on screen, None when showing the image itself
         self.properties = {}    # Information about the open file
-        self.settings = {}      # Application settings (default behaviours etc)
-        self.settings['default_folder'] = os.curdir
-        self.load_settings()
-        self.history = []
+        self.settings_pending = False
+        self.load_settings()    # Application settings (default behaviours etc)
+        loader.set_max_pixels(self.settings.get('max_image_mp', loader.MAX_PIXELS // 1000000) * 1000000)
+        self.save_profile.set(self.settings.get('save_profile', encode.DEFAULT_PROFILE))
+        self.history = history.History(self.settings.get('history_budget_mb', HISTORY_BUDGET_MB) * 1024 * 1024)
+        self.nav_direction = 0  # +1 browsing forwards, -1 backwards, 0 otherwise (for read-ahead)
+        self.image_cache = prefetch.ImageCache(self.settings.get('cache_budget_mb', CACHE_BUDGET_MB) * 1024 * 1024)
+        self.prefetcher = prefetch.Prefetcher(self.image_cache, radius=self.settings.get('prefetch_radius', PREFETCH_RADIUS), draft=self.settings.get('draft_decoding', True))
+        self.folder_indexes = folderindex.FolderIndexStore(settings.config_path(INDEX_FILE), SUPPORTED_IMAGE_EXTENSIONS)
+        self.filmstrip = filmstrip.Filmstrip(self.window, thumbnails.ThumbnailStore(settings.config_path(THUMBNAIL_FILE)), self.filmstrip_select, TOOLS_BACKGROUND)
+        self.filmstrip.frame.place(x=54, rely=1, y=-100-FILMSTRIP_HEIGHT, relwidth=1, width=-54, height=FILMSTRIP_HEIGHT)
+        self.hash_index = duplicates.HashIndex(self.filmstrip.store) # Perceptual hashes for finding near-duplicates, kept with the thumbnails
+        self.info_worker = metadata.InfoWorker()
+        self.info_panel = infopanel.InfoPanel(self.window, self.info_worker, TOOLS_BACKGROUND)
+        self.show_info.set(self.settings.get('show_info', False))
+        self.info_panel.set_visible(self.show_info.get())
+        self.writer = writer.BackgroundWriter()
+        self.tile_packs = tiles.PackStore(os.path.join(settings.config_dir(), "tiles"), self.settings.get('tile_disk_mb', TILE_DISK_MB) * 1024 * 1024)
+        self.writer_polling = False
+        self.resources = resources.ResourceManager(self.settings.get('memory_budget_mb', MEMORY_BUDGET_MB) * 1024 * 1024)
+        self.register_resources()
+        self.window.after(MEMORY_CHECK_MS, self.check_memory)
         self.active_tool = ""
         self.active_tool_data = {}
         # Key bindings
@@ -83,6 +159,7 @@ class AppWindow():
         self.window.bind('<Control-Key-Right>', self.keyboard_handler)
         self.window.bind('<Control-Key-r>', self.keyboard_handler)
         self.window.bind('<Control-Key-z>', self.keyboard_handler)
+        self.window.bind('<Control-Key-y>', self.keyboard_handler)
         self.window.bind('<Control-Key-s>', self.keyboard_handler)
         self.window.bind('<Control-Key-q>', self.keyboard_handler)
         self.window.bind('<Control-Key-c>', self.keyboard_handler)
@@ -91,11 +168,125 @@ class AppWindow():
         self.window.bind('<Down>', self.keyboard_handler)
         self.window.bind('<Key-plus>', self.keyboard_handler)
         self.window.bind('<Key-minus>', self.keyboard_handler)
+        self.window.bind('<Key-0>', self.keyboard_handler)
         self.window.bind('<Return>', self.keyboard_handler)
         # self.window.bind_all('<Key>', self.keyboard_test)
-        # Open most recent file
-        if "most_recent" in self.settings:
-            self.file_open(self.settings['most_recent'])
+        # Open the most recent file once the window is up (see open_most_recent)
+        self.startup['window'] = time.perf_counter()
+        self.window.bind('<Expose>', self.first_paint)
+        if "most_recent" in self.settings and os.path.isfile(self.settings['most_recent']):
+            self.window.after_idle(self.open_most_recent, self.settings['most_recent'])
+        else:
+            self.startup['image'] = False
+
+    def first_paint(self, event=None):
+        self.window.unbind('<Expose>')
+        self.startup['paint'] = time.perf_counter()
+        self.startup_report()
+
+    def open_most_recent(self, filename):
+        # Decode the most recent file in the background with a placeholder showing, so a huge image or
+        # a slow disk can't hold up the window appearing
+        if self.pending_open is None and not self.fileopen:
+            self.image_container.config(text=f"Opening {os.path.basename(filename)}...", font=("Arial", 16))
+            self.open_when_ready(filename)
+
+    def open_when_ready(self, filename, ahead=()):
+        # Open a file straight away if it has been prefetched. Otherwise decode it in the background (along
+        # with the files `ahead` of it, cancelling decodes no longer wanted) and open it once it is ready,
+        # leaving the current image up meanwhile. Skimming through a folder never waits on a decode
+        if filename in self.image_cache:
+            self.file_open(filename)
+            return
+        self.pending_open = filename
+        self.prefetcher.request([filename] + list(ahead), self.get_frame_size())
+        self.window.title("pbTools image editor - " + filename.split("/")[-1])
+        self.poll_pending_open()
+
+    def poll_pending_open(self):
+        if self.pending_open is None:
+            return # Opened, or replaced by something else, in the meantime
+        if not self.prefetcher.is_ready(self.pending_open):
+            self.window.after(20, self.poll_pending_open)
+            return
+        filename = self.pending_open
+        self.scheduler.flush('rotate')
+        if self.is_dirty():
+            # Edited while the next file was decoding
+            if messagebox.askyesno("Changes made", f"Save changes to {self.filename}?"):
+                self.file_save()
+        self.file_open(filename)
+
+    def startup_report(self):
+        # With --startup-profile, print how long it took to get the window painted and the first image shown
+        if not self.startup['profile'] or self.startup['paint'] is None or self.startup['image'] is None:
+            return
+        def ms(t):
+            return f"{(t - STARTED) * 1000:.0f} ms"
+        report = f"startup: window built {ms(self.startup['window'])}, first paint {ms(self.startup['paint'])}"
+        if self.startup['image']:
+            report += f", first image {ms(self.startup['image'])}"
+        print(report, flush=True)
+        self.startup['profile'] = False
+
+    def quit(self):
+        if self.writer.pending() > 0:
+            self.save_status_text.config(text=f"finishing {self.writer.pending()} save(s)...")
+            self.window.update_idletasks()
+        self.writer.shutdown()
+        self.prefetcher.shutdown()
+        if self.trace_file is not None:
+            events = trace.export_chrome(self.trace_file)
+            log.info("Wrote %d trace events to %s", events, self.trace_file)
+        self.hash_index.close()
+        self.info_worker.shutdown()
+        self.filmstrip.shutdown()
+        self.tile_packs.shutdown()
+        self.renderer.set_pack(None)
+        self.folder_indexes.save()
+        self.save_settings()
+        self.window.quit()
+
+    def register_resources(self):
+        # Everything holding decoded pixels, cheapest to lose first: prefetched neighbours can be decoded again, zoom
+        # tiles read back from their pack, display copies remade from the image, and undo snapshots spill to disk
+        self.resources.register("prefetch", self.image_cache.nbytes, self.image_cache.shrink, priority=0)
+        self.resources.register("tiles", self.tile_cache.nbytes, self.tile_cache.shrink, priority=1)
+        self.resources.register("display", self.renderer.nbytes, self.renderer.shrink, priority=2)
+        self.resources.register("edit preview", self.edit_base_bytes, self.drop_edit_base, priority=2)
+        self.resources.register("history", self.history.nbytes, self.history.store.shrink, priority=3)
+        self.resources.register("image", lambda: loader.image_bytes(self.image), priority=4)
+        self.resources.register("screen", self.renderer.photo_bytes, priority=4)
+
+    def edit_base_bytes(self):
+        # The reduced copy pending edits are previewed from, unless it is the image itself or one of the renderer's
+        base = self.edit_base
+        if base is None or base is self.image or any(level is base for level in self.renderer.levels.values()):
+            return 0
+        return loader.image_bytes(base)
+
+    def drop_edit_base(self, nbytes):
+        # It is made again (see edit_source) if the edits on screen change
+        freed = self.edit_base_bytes()
+        if freed > 0:
+            self.edit_base = None
+        return freed
+
+    def enforce_memory(self):
+        # Bring memory use back within budget, and show it in the status bar
+        self.resources.enforce()
+        self.memory_text.config(text=self.resources.describe() + "          ")
+
+    def check_memory(self):
+        self.enforce_memory()
+        self.window.after(MEMORY_CHECK_MS, self.check_memory)
+
+    def set_memory_limit(self):
+        budget = simpledialog.askinteger("Memory limit", "Memory for images, in MB", initialvalue=self.resources.budget // 1024 // 1024, minvalue=64, parent=self.window)
+        if budget is not None:
+            self.settings['memory_budget_mb'] = budget
+            self.resources.budget = budget * 1024 * 1024
+            self.enforce_memory()
 
     def is_dirty(self, val=None):
         if val is not None:
@@ -122,8 +313,9 @@ class AppWindow():
         # What tool do we forward the keystroke event to?
         if self.active_tool == "crop":
             self.crop(event)
-        else: # No active tool
-            print(event, event.state)
+        elif self.active_tool in drawing.TOOLS and event.keysym in ("plus", "minus", "Escape"):
+            self.drawing_key(event)
+        else: # No active tool, or a drawing tool (which leaves the other keys alone)
             if str(event.type) == "KeyPress" and event.keysym == "Left" and ctrl:
                 self.rotate_left()
             elif str(event.type) == "KeyPress" and event.keysym == "Left":
@@ -140,87 +332,182 @@ class AppWindow():
                 self.file_save()
             elif str(event.type) == "KeyPress" and event.keysym == "z" and ctrl:
                 self.undo()
+            elif str(event.type) == "KeyPress" and event.keysym == "y" and ctrl:
+                self.redo()
+            elif str(event.type) == "KeyPress" and event.keysym == "plus":
+                self.zoom(ZOOM_STEP)
+            elif str(event.type) == "KeyPress" and event.keysym == "minus":
+                self.zoom(1 / ZOOM_STEP)
+            elif str(event.type) == "KeyPress" and event.keysym == "0":
+                self.zoom(None)
             elif str(event.type) == "KeyPress" and event.keysym == "q" and ctrl:
+                self.scheduler.flush('rotate')
                 if self.is_dirty():
                     if messagebox.askyesno("Changes made", f"Save changes to {self.filename} before closing?"):
                         self.file_save()
-                quit()
+                self.quit()
             
+    def mouse_handler(self, event):
+        # Mouse button 1 on the image goes to the active tool, otherwise it drags a zoomed view around
+        if self.active_tool == "crop":
+            self.crop_mouse(event)
+        elif self.active_tool in drawing.TOOLS:
+            self.drawing_mouse(event)
+        elif str(event.type) == "ButtonPress":
+            self.pan_from = (event.x, event.y)
+        elif self.pan_from is not None and self.renderer.zoom is not None:
+            self.renderer.pan(event.x - self.pan_from[0], event.y - self.pan_from[1], self.get_frame_size())
+            self.pan_from = (event.x, event.y) if str(event.type) == "Motion" else None
+            self.schedule_render()
+
+    def mouse_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.zoom(ZOOM_STEP, (event.x, event.y))
+        else:
+            self.zoom(1 / ZOOM_STEP, (event.x, event.y))
+
+    def zoom(self, factor, anchor=None):
+        # Zoom in or out by `factor` around `anchor` (a point in the frame), or back to fitting the frame if factor is None
+        if not self.fileopen or self.active_tool != "" or self.renderer.size is None:
+            return
+        if factor is not None and len(self.history.pending) > 0 and self.materialize() is None:
+            return # Zoomed views are drawn from the edited pixels
+        frame_size = self.get_frame_size()
+        if factor is None:
+            zoom = None
+        else:
+            zoom = (self.renderer.zoom or self.renderer.fit_zoom(frame_size)) * factor
+        self.renderer.set_zoom(zoom, frame_size, anchor)
+        if self.renderer.zoom is not None and self.image is None and self.renderer.pack is None:
+            size = self.renderer.size
+            if size[0] * size[1] > TILE_THRESHOLD_MP * 1000000:
+                self.request_tiles(self.filename)
+            else:
+                self.load_full_image()
+        self.schedule_render()
+        if self.renderer.zoom is not None:
+            self.timing_text.config(text=f"zoom {self.renderer.zoom * 100:.0f}%          ")
+        else:
+            self.timing_text.config(text="zoom to fit          ")
+
+    def request_tiles(self, filename):
+        # Very large images are viewed from a tile pack (see app/tiles.py), built in the background the first time
+        if filename != self.filename or self.image is not None or self.renderer.pack is not None:
+            return
+        pack = self.tile_packs.get(filename, self.resources.available())
+        if pack is not None:
+            self.renderer.set_pack(pack)
+            self.show_image()
+        elif self.tile_packs.is_building(filename):
+            self.timing_text.config(text="building tiles for zooming...          ")
+            self.window.after(200, self.request_tiles, filename)
+
+    def toggle_hud(self):
+        # The HUD shows the cost breakdown of the last operation on the UI thread. Turning it on starts tracing
+        if self.hud.get():
+            trace.enable()
+            trace.on_frame = self.show_frame_cost
+            self.hud_text.place(x=250, y=0, width=440, height=100)
+        else:
+            trace.on_frame = None
+            self.hud_text.place_forget()
+            if not self.trace_requested:
+                trace.enable(False)
+
+    def toggle_info(self):
+        self.settings['show_info'] = self.show_info.get()
+        self.info_panel.set_visible(self.show_info.get())
+        self.update_info()
+
+    def update_info(self):
+        # Tell the info panel what is on screen. It does the work in the background, and only while it is open
+        if not self.fileopen or not self.info_panel.visible:
+            return
+        levels = self.renderer.levels
+        proxy = min((level for level in levels.values() if level.size[0] >= infopanel.GRAPH_SIZE[0]), key=lambda level: level.size[0], default=None)
+        if proxy is None:
+            proxy = max(levels.values(), key=lambda level: level.size[0], default=self.renderer.source)
+        self.info_panel.show(self.filename, self.file_info.get('mtime'), proxy, len(self.history))
+
+    def show_frame_cost(self, name, ms, children, attrs):
+        lines = [f"{name} {ms:.1f} ms " + " ".join(f"{k}={v}" for k, v in attrs.items() if k in ('size', 'mode', 'cache_hit', 'method'))]
+        for child, child_ms in sorted(children.items(), key=lambda item: -item[1])[:4]:
+            lines.append(f"  {child:18} {child_ms:7.1f} ms")
+        self.hud_text.config(text="\n".join(lines))
+
+    def save_trace(self):
+        self.trace_requested = True
+        if not trace.enabled:
+            trace.enable()
+            messagebox.showinfo("Performance trace", "Tracing is now on. Use the editor for a while, then save the trace again.")
+            return
+        filename = filedialog.asksaveasfilename(title="Save performance trace", defaultextension=".json", filetypes=(("Chrome trace","*.json"),))
+        if filename:
+            events = trace.export_chrome(filename)
+            self.timing_text.config(text=f"saved {events} trace events          ")
+
+    def folder_index(self, folder):
+        # Sorted, incrementally refreshed index of the images in a folder ('recursive_folders' includes sub folders)
+        return self.folder_indexes.get(folder, recursive=self.settings.get('recursive_folders', False), natural=self.settings.get('natural_sort', True))
+
     def get_images_in_folder(self, folder):
-        try:
-            files = os.listdir(folder)
-            image_files = []
-            for f in files:
-                extension = f.split(".")[-1]
-                if extension.lower() in SUPPORTED_IMAGE_EXTENSIONS:
-                    image_files.append(f)
-            return image_files
-        except:
-            return []
+        return list(self.folder_index(folder).files)
 
     def load_settings(self):
-        if os.path.exists(SETTINGS_FILE):
-            try:
-                with open(SETTINGS_FILE, "rb") as f:
-                    self.settings = pickle.load(f)
-            except:
-                print(f"Error reading {SETTINGS_FILE}. Invalid content?")
+        self.settings = settings.Settings(settings.config_path(SETTINGS_FILE), {'default_folder': os.curdir}, LEGACY_SETTINGS_FILE)
+        self.settings.on_change = self.settings_changed
+        if self.settings.load_error is not None:
+            messagebox.showwarning("Settings", self.settings.load_error)
+
+    def settings_changed(self):
+        # Write changes a little later, so a run of changes (eg: arrowing through a folder) costs a single write
+        if not self.settings_pending:
+            self.settings_pending = True
+            self.window.after(SETTINGS_DEBOUNCE_MS, self.save_settings)
 
     def save_settings(self):
-        with open(SETTINGS_FILE, "wb") as f:
-            pickle.dump(self.settings, f)
+        self.settings_pending = False
+        self.settings.save()
     
     def load_assets(self):
-        if not os.path.exists(os.path.join(self.application_path, "assets/icons8-back-50.png")):
+        assets = os.path.join(self.application_path, "assets")
+        if not os.path.exists(icons.atlas_path(assets, "enabled")) and not os.path.exists(os.path.join(assets, "icons-enabled")):
             messagebox.showerror("Sorry", f"Asset files not found! Can not continue.\n\nThe /assets folder must be in the same folder containing the executable.")
             exit()
+        self.icons = icons.IconAtlas(self.window, assets) # Icons are decoded on first use
+
+    def tool_button(self, target, text, command, icon, enabled=True):
         try:
-            self.icons = {
-                "previous" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-back-50.png")),
-                "crop" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-crop-50.png")),
-                "delete" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-delete-bin-50.png")),
-                "erase" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-erase-50.png")),
-                "fill-color" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-fill-color-50.png")),
-                "next" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-forward-50.png")),
-                "line" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-line-50.png")),
-                "ellipse" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-oval-50.png")),
-                "paint" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-paint-palette-50.png")),
-                "pen" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-pen-50.png")),
-                "rectangle" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-rectangular-50.png")),
-                "resize" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-resize-50.png")),
-                "save" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-save-50.png")),
-                "text" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-text-box-50.png")),
-                "rotate-left" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-rotate-left-50.png")),
-                "rotate-right" : tk.PhotoImage(file=os.path.join(self.application_path, "assets/icons8-rotate-right-50.png"))
-            }
-        except:
+            image = self.icons.get(icon, enabled)
+        except Exception:
             messagebox.showerror("Sorry", f"One or more asset files not found! Can not continue.")
             exit()
+        return tk.Button(target, text=text, command=command, image=image, state=tk.NORMAL if enabled else tk.DISABLED)
 
     def generate_toolbar(self, target):
         self.toolbar_buttons = [
-            tk.Button(target, text="Resize", command=self.resize, image=self.icons['resize'], state=tk.DISABLED, bg="gray50"),
-            tk.Button(target, text="Crop", command=self.crop, image=self.icons['crop']),
-            tk.Button(target, text="Rotate right", command=self.rotate_right, image=self.icons['rotate-right']),
-            tk.Button(target, text="Rotate left", command=self.rotate_left, image=self.icons['rotate-left']),
-            tk.Button(target, text="Text", command=self.text, image=self.icons['text'], state=tk.DISABLED),
-            tk.Button(target, text="Pen", command=self.pen, image=self.icons['pen'], state=tk.DISABLED),
-            tk.Button(target, text="Line", command=self.line, image=self.icons['line'], state=tk.DISABLED),
-            tk.Button(target, text="Rectangle", command=self.rectangle, image=self.icons['rectangle'], state=tk.DISABLED),
-            tk.Button(target, text="Elipse", command=self.elipse, image=self.icons['ellipse'], state=tk.DISABLED),
-            tk.Button(target, text="Erase", command=self.erase, image=self.icons['erase'], state=tk.DISABLED),
-            tk.Button(target, text="Foreground", command=self.setforeground, image=self.icons['fill-color'], state=tk.DISABLED),
-            tk.Button(target, text="Background", command=self.setbackground, image=self.icons['paint'], state=tk.DISABLED)
+            self.tool_button(target, "Resize", self.resize, 'resize'),
+            self.tool_button(target, "Crop", self.crop, 'crop'),
+            self.tool_button(target, "Rotate right", self.rotate_right, 'rotate-right'),
+            self.tool_button(target, "Rotate left", self.rotate_left, 'rotate-left'),
+            self.tool_button(target, "Text", self.text, 'text', enabled=False),
+            self.tool_button(target, "Pen", self.pen, 'pen'),
+            self.tool_button(target, "Line", self.line, 'line'),
+            self.tool_button(target, "Rectangle", self.rectangle, 'rectangle'),
+            self.tool_button(target, "Elipse", self.elipse, 'ellipse'),
+            self.tool_button(target, "Erase", self.erase, 'erase'),
+            self.tool_button(target, "Foreground", self.setforeground, 'fill-color'),
+            self.tool_button(target, "Background", self.setbackground, 'paint')
         ]
         for i in range(len(self.toolbar_buttons)):
             self.toolbar_buttons[i].grid(row=i, column=0, sticky='nesw')
     
     def generate_bottombar(self, target):
         self.toolbar_buttons = [
-            tk.Button(target, text="Previous", command=self.file_previous, image=self.icons['previous']),
-            tk.Button(target, text="Save", command=self.file_save, image=self.icons['save']),
-            tk.Button(target, text="Delete", command=self.file_delete, image=self.icons['delete']),
-            tk.Button(target, text="Next", command=self.file_next, image=self.icons['next']),
+            self.tool_button(target, "Previous", self.file_previous, 'previous'),
+            self.tool_button(target, "Save", self.file_save, 'save'),
+            self.tool_button(target, "Delete", self.file_delete, 'delete'),
+            self.tool_button(target, "Next", self.file_next, 'next'),
         ]
         for i in range(len(self.toolbar_buttons)):
             self.toolbar_buttons[i].grid(row=0, column=i, sticky='e')
@@ -233,16 +520,32 @@ class AppWindow():
         filemenu.add_command(label="Open", command=self.file_open)
         filemenu.add_command(label="Save (ctrl-s)", command=self.file_saveas)
         filemenu.add_command(label="Save as", command=self.file_saveas)
+        qualitymenu = tk.Menu(filemenu, tearoff=0)
+        for profile in encode.PROFILES:
+            qualitymenu.add_radiobutton(label=profile.capitalize(), variable=self.save_profile, value=profile, command=self.set_save_profile)
+        qualitymenu.add_separator()
+        qualitymenu.add_command(label="Size limit...", command=self.set_save_limit)
+        filemenu.add_cascade(label="Save quality", menu=qualitymenu)
         filemenu.add_separator()
-        filemenu.add_command(label="Exit", command=self.window.quit)
+        filemenu.add_command(label="Exit", command=self.quit)
         # Create a sub menu
         editmenu = tk.Menu(menubar, tearoff=0)
         editmenu.add_command(label="Undo (ctrl-z)", command=self.undo)
+        editmenu.add_command(label="Redo (ctrl-y)", command=self.redo)
         editmenu.add_command(label="Revert", command=self.revert)
+        editmenu.add_separator()
+        editmenu.add_command(label="Adjust...", command=self.adjust)
+        editmenu.add_command(label="Crop ratio for this folder", command=self.set_crop_ratio)
+        editmenu.add_command(label="Find duplicates...", command=self.find_duplicates)
         #filemenu.add_command(label="Copy", command=self.file_open)
         #filemenu.add_command(label="Paste", command=self.file_open)
         # Create a sub menu
         helpmenu = tk.Menu(menubar, tearoff=0)
+        helpmenu.add_checkbutton(label="Image info", variable=self.show_info, command=self.toggle_info)
+        helpmenu.add_checkbutton(label="Performance HUD", variable=self.hud, command=self.toggle_hud)
+        helpmenu.add_command(label="Save performance trace...", command=self.save_trace)
+        helpmenu.add_command(label="Memory limit...", command=self.set_memory_limit)
+        helpmenu.add_separator()
         helpmenu.add_command(label="About", command=self.about)
         # Link the sub menus to the menu bar
         menubar.add_cascade(label="File", menu=filemenu)
@@ -252,356 +555,783 @@ class AppWindow():
         self.window.config(menu=menubar)
     
     def show_properties(self):
-        # Display key information about the current image file
+        # Display key information about the current image file (more in the info panel, see update_info)
         if self.filename != "":
             filename_parts = self.filename.split("/")
             filename_display = filename_parts[ -1 ]
-            self.properties_filename_label = tk.Label(self.properties_frame, text=f"{filename_display}                              ", font=('Arial', 12), bg=TOOLS_BACKGROUND, justify=tk.LEFT) 
-            self.properties_dimensions_label = tk.Label(self.properties_frame, text=f"{self.properties['dimensions'][0]} x {self.properties['dimensions'][1]} {self.properties['mode']}                    ", font=('Arial', 12), bg=TOOLS_BACKGROUND, justify=tk.LEFT) 
-            self.properties_filename_label.place(x=0,y=0)
-            self.properties_dimensions_label.place(x=0,y=20)
+            self.properties_filename_label.config(text=filename_display)
+            self.properties_dimensions_label.config(text=f"{self.properties['dimensions'][0]} x {self.properties['dimensions'][1]} {self.properties['mode']}")
             self.window.title("pbTools image editor - "+filename_display)
     
-    def show_image(self, image=None):
-        # Render a PIL image object to the image_frame
+    def get_frame_size(self):
+        if self.image_frame.winfo_width() <= 1:
+            self.image_frame.update_idletasks()
+        return (self.image_frame.winfo_width(), self.image_frame.winfo_height())
+
+    @trace.traced("show_image")
+    def show_image(self, image=None, overlay=None):
+        # Render a PIL image object to the image_frame (drawing is done by self.renderer)
         if image is None:
             image = self.image
-        if image is None:
+        if len(self.history.pending) > 0 and image is self.image:
+            self.preview_edits(self.get_frame_size())
+        elif self.preview_key is not None:
+            self.show_unedited()
+        elif image is not None and image is not self.renderer.source:
+            self.renderer.set_source(image)
+        if self.renderer.size is None:
             return False
-        self.image_frame.update()
-        frame_size = (self.image_frame.winfo_width(), self.image_frame.winfo_height())
-        frame_ratio = frame_size[0] / frame_size[1] # 1.9 wide for every height 1146 600
-        image_ratio = image.size[0] / image.size[1] # 1.5 wide for every height 2480 1653 ... 900 600
-        if frame_ratio > image_ratio:
-            # Scale to fill vertically, empty space on the horizontal
-            image_scaled = image.resize((int(frame_size[1] * image_ratio), frame_size[1]))
-        else:
-            # Scale to fill horizontally, empty space on the vertical
-            image_scaled = image.resize((frame_size[0], int(frame_size[0] / image_ratio)))
-        self.properties['frame'] = frame_size
-        self.properties['dimensions'] = image.size
-        self.properties['frame_ratio'] = frame_ratio
-        self.properties['image_ratio'] = image_ratio
-        self.properties['scaled_size'] = image_scaled.size
-        self.properties['scale_ratio'] = image.size[0] / image_scaled.size[0]
-        self.properties['offset'] = (int(frame_size[0]/2 - image_scaled.size[0]/2), int(frame_size[1]/2 - image_scaled.size[1]/2))
-        self.imageTk = ImageTk.PhotoImage(image_scaled)
-        self.image_container.configure(image=self.imageTk)
-        self.show_properties()
+        image_size = self.renderer.size
+        frame_size = self.get_frame_size()
+        trace.annotate(size=image_size, frame=frame_size)
+        if self.renderer.source is None and not self.renderer.covers(loader.fit_size(image_size, frame_size)):
+            # Only a smaller draft preview has been decoded (see load_full_image), decode one to suit the frame
+            self.renderer.set_source(None, image_size, loader.open_preview(self.filename, frame_size, large=True)['preview'])
+        if self.properties.get('frame') != frame_size or self.properties.get('dimensions') != image_size or 'scaled_size' not in self.properties:
+            frame_ratio = frame_size[0] / frame_size[1] # 1.9 wide for every height 1146 600
+            image_ratio = image_size[0] / image_size[1] # 1.5 wide for every height 2480 1653 ... 900 600
+            scaled_size = loader.fit_size(image_size, frame_size)
+            self.properties['frame'] = frame_size
+            self.properties['dimensions'] = image_size
+            self.properties['frame_ratio'] = frame_ratio
+            self.properties['image_ratio'] = image_ratio
+            self.properties['scaled_size'] = scaled_size
+            self.properties['scale_ratio'] = image_size[0] / scaled_size[0]
+            self.properties['offset'] = (int(frame_size[0]/2 - scaled_size[0]/2), int(frame_size[1]/2 - scaled_size[1]/2))
+            self.show_properties()
+        self.renderer.render(frame_size, overlay)
+        self.imageTk = self.renderer.photo
+        self.update_info()
+
+    def edit_source(self, scale):
+        # The image as it is before its pending edits, reduced no further than `scale` (see editgraph.source_scale).
+        # Reuses what has already been decoded or drawn where it is large enough
+        size = self.unedited_size()
+        target = (max(1, int(size[0] * scale + 0.5)), max(1, int(size[1] * scale + 0.5)))
+        base = self.edit_base
+        if base is None and self.preview_key is None and len(self.renderer.levels) > 0:
+            base = self.renderer.source or max(self.renderer.levels.values(), key=lambda level: level.size[0])
+        if base is None or base.size[0] < target[0] or base.size[1] < target[1]:
+            if self.image is not None:
+                base = self.image
+            else:
+                base = loader.open_reduced(self.filename, target, large=True)
+                if base.size == size:
+                    self.image = base # Not a JPEG, so decoded in full anyway
+        if base.size[0] // 2 >= target[0] and base.size[1] // 2 >= target[1]:
+            base = loader.reducible(base)
+        while base.size[0] // 2 >= target[0] and base.size[1] // 2 >= target[1]:
+            base = base.reduce(2)
+        self.edit_base = base
+        return base
+
+    def unedited_size(self):
+        return self.image.size if self.image is not None else self.file_info['size']
+
+    @trace.traced("preview_edits")
+    def preview_edits(self, frame_size):
+        # Show the pending edits (see History.add) run on a reduced copy of the image, so rotating, cropping and
+        # resizing cost the same whatever the size of the image. The full resolution image is only edited by materialize
+        key = (list(self.history.pending), frame_size)
+        if key == self.preview_key:
+            return
+        size = self.unedited_size()
+        result = editgraph.result_size(self.history.pending, size)
+        scale = editgraph.source_scale(self.history.pending, size, loader.fit_size(result, frame_size))
+        preview = editgraph.preview(self.edit_source(scale), size, self.history.pending)
+        self.renderer.set_source(None, result, preview)
+        self.preview_key = key
+
+    def show_unedited(self):
+        # Every pending edit has been undone, go back to showing the image itself
+        self.renderer.set_source(self.image, self.unedited_size(), self.edit_base)
+        self.preview_key = None
 
+    @trace.traced("materialize")
+    def materialize(self):
+        # Run the pending edits on the full resolution image, as one optimised chain (see app/editgraph.py)
+        if self.load_full_image() is None:
+            return None
+        if len(self.history.pending) > 0:
+            started = time.perf_counter()
+            trace.annotate(size=self.image.size, edits=len(self.history.pending))
+            self.image = self.history.materialize(self.image)
+            self.image_changed()
+            elapsed = (time.perf_counter() - started) * 1000
+            self.timing_text.config(text=f"edits applied {elapsed:.0f} ms          ")
+            self.enforce_memory()
+        return self.image
+
+    def image_changed(self):
+        # self.image has been replaced by one the renderer and the edit preview know nothing about
+        self.edit_base = None
+        self.preview_key = None
+        self.renderer.set_source(self.image)
+
+    @trace.traced("file_open")
     def file_open(self, filename=None):
+        self.pending_open = None
         if filename is None or filename == "":
             filename = filedialog.askopenfilename(initialdir=self.settings['default_folder'], title="Select file", filetypes=ALLOWED_FILES)
+        if self.writer.is_pending(filename):
+            self.writer.wait(filename) # Don't read a file while our own save of it is still being written
         if os.path.exists(filename) and os.path.isfile(filename):
-            try:
-                self.image = Image.open(filename)
-            except:
-                messagebox.showerror("Sorry", f"Unable to open {filename}. Possibly not an image file? or permissions error?")
-                return False
+            started = time.perf_counter()
+            entry = self.prefetcher.get(filename)
+            cached = entry is not None
+            if entry is None:
+                try:
+                    entry = loader.load_image(filename, self.get_frame_size(), self.settings.get('draft_decoding', True), large=True)
+                except Image.DecompressionBombError as e:
+                    messagebox.showerror("Sorry", loader.too_large(filename, e))
+                    return False
+                except:
+                    messagebox.showerror("Sorry", f"Unable to open {filename}. Possibly not an image file? or permissions error?")
+                    return False
+            if self.fileopen and not self.is_dirty() and len(self.history) == 0:
+                # Unchanged since it was opened, so keep it around in case the user comes back
+                preview = self.renderer.cached_proxy(self.get_frame_size())
+                self.image_cache.put(self.filename, {'image': self.image, 'preview': preview, 'mtime': self.image_mtime, 'size': self.properties['dimensions'], 'mode': self.properties['mode'], 'method': "cached", 'format': self.file_info['format'], 'orientation': self.file_info['orientation']})
+            trace.annotate(file=os.path.basename(filename), size=entry['size'], mode=entry['mode'], cache_hit=cached, method=entry['method'])
+            self.image = entry['image']
+            self.image_mtime = entry['mtime']
+            self.file_info = {'format': entry['format'], 'size': entry['size'], 'orientation': entry['orientation'], 'angle': 0, 'mtime': entry['mtime']}
+            self.edit_base = None
+            self.preview_key = None
+            self.renderer.set_source(self.image, entry['size'], entry['preview'])
             filename_parts = filename.split("/")
             if len(filename_parts) > 1:
                 del filename_parts[ -1 ]
                 folder = "/".join(filename_parts)
-                self.settings['default_folder'] = folder
+                inside = not os.path.relpath(folder, self.settings['default_folder']).startswith("..")
+                if not (self.settings.get('recursive_folders', False) and inside):
+                    self.settings['default_folder'] = folder
             self.settings['most_recent'] = filename
-            self.save_settings()
-            self.properties['dimensions'] = self.image.size
-            self.properties['mode'] = self.image.mode
+            self.settings.set_folder(self.settings['default_folder'], 'last', os.path.relpath(filename, self.settings['default_folder']).replace(os.sep, "/"))
+            self.properties = {'dimensions': entry['size'], 'mode': entry['mode']}
             self.filename = filename
-            self.show_properties()
             self.show_image()
-            self.history = []
+            self.history.clear()
             self.is_dirty(False)
             self.fileopen = True
+            elapsed = (time.perf_counter() - started) * 1000
+            self.timing_text.config(text=f"open {elapsed:.0f} ms ({'prefetched' if cached else entry['method']})          ")
+            self.image_container.config(text="")
+            self.prefetch_neighbours()
+            self.enforce_memory()
+            if self.startup['image'] is None:
+                self.startup['image'] = time.perf_counter()
+                self.startup_report()
+
+    @trace.traced("load_full_image")
+    def load_full_image(self):
+        # Decode the full resolution image the first time something (saving, drawing, zooming in...) needs its pixels
+        if self.image is None and self.fileopen:
+            started = time.perf_counter()
+            try:
+                self.image = loader.open_full(self.filename, large=True)
+            except Image.DecompressionBombError as e:
+                messagebox.showerror("Sorry", loader.too_large(self.filename, e))
+                return None
+            except:
+                messagebox.showerror("Sorry", f"Unable to read {self.filename}")
+                return None
+            if len(self.history.pending) == 0:
+                self.renderer.set_full(self.image) # Otherwise the renderer is showing a preview of the edits
+            elapsed = (time.perf_counter() - started) * 1000
+            self.timing_text.config(text=f"full resolution decode {elapsed:.0f} ms          ")
+        return self.image
+
+    def prefetch_neighbours(self):
+        # Start decoding the images either side of the current one in the background
+        index = self.folder_index(self.settings['default_folder'])
+        position = index.position(index.relative_name(self.filename))
+        self.filmstrip.set_folder(index.folder, index.files, position)
+        if position >= 0:
+            neighbours = self.prefetcher.neighbours(index.files, position, self.nav_direction)
+            self.prefetcher.request([index.path(f) for f in neighbours], self.get_frame_size())
+        self.nav_direction = 0
     
+    @trace.traced("file_save")
     def file_save(self, event=None):
+        self.scheduler.flush('rotate')
         if self.is_dirty():
-            parts = self.filename.split(".")
-            if 'convert_all_to' in self.settings:
-                ext = self.settings['convert_all_to']
-                parts[-1] = ext
-            new_filename = ".".join(parts)
-            if parts[-1].lower() in ("jpg", "jpeg"):
-                self.image.save(new_filename,"jpeg")
+            new_filename = engine.output_filename(self.filename, self.settings.get('convert_all_to'))
+            self.image_cache.discard(new_filename)
+            max_kb = self.settings.get('save_max_kb')
+            keep_encoding = self.save_profile.get() == encode.DEFAULT_PROFILE and not max_kb # Other profiles and size limits need a re-encode
+            if new_filename == self.filename and keep_encoding and self.save_orientation():
+                trace.annotate(method="orientation")
                 self.is_dirty(False)
-            elif parts[-1].lower() in ("png"):
-                self.image.save(new_filename,"png")
+            elif engine.save_format(new_filename) is not None and self.materialize() is not None:
+                # Encode and write on the background writer from a snapshot, so we can carry on straight away
+                trace.annotate(method="encode", size=self.image.size, mode=self.image.mode)
+                with loader.large_images():
+                    source = encode.source_settings(self.filename)
+                self.writer.submit(new_filename, engine.encoder(self.image.copy(), new_filename, self.save_profile.get(), source, max_kb * 1024 if max_kb else None))
                 self.is_dirty(False)
+                self.file_info['angle'] = None # File now holds re-encoded pixels
+                self.poll_writer()
+
+    def poll_writer(self):
+        # Show pending and failed background saves next to the dirty flag, checking back until the queue is empty
+        for filename, error, report in self.writer.poll():
+            self.image_cache.discard(filename)
+            if error is not None:
+                log.warning("Saving %s failed: %s", filename, error)
+            else:
+                self.timing_text.config(text=f"saved {os.path.basename(filename)} {encode.describe(report)}          ")
+        pending = self.writer.pending()
+        text = ""
+        if pending > 0:
+            text = f"saving {pending}..."
+        failed = self.writer.failures()
+        if len(failed) > 0:
+            names = ", ".join(f.split("/")[-1] for f in failed)
+            text = f"{text} {len(failed)} save(s) failed: {names}".strip()
+        self.save_status_text.config(text=text + "          ")
+        if pending > 0 and not self.writer_polling:
+            self.writer_polling = True
+            self.window.after(100, self.poll_writer_again)
+
+    def poll_writer_again(self):
+        self.writer_polling = False
+        self.poll_writer()
+
+    def save_orientation(self):
+        # When the only edits are rotations, save a JPEG by rewriting its EXIF orientation tag rather than
+        # decoding and re-encoding it. Returns False if the normal save has to be used instead
+        angle = self.history.net_rotation()
+        if angle is None or self.file_info.get('format') != "JPEG" or self.file_info.get('angle') is None:
+            return False
+        try:
+            if os.stat(self.filename).st_mtime != self.file_info['mtime']:
+                return False # Changed by something else since we last read or wrote it
+            started = time.perf_counter()
+            orientation = exiforient.rotate(self.file_info['orientation'], angle - self.file_info['angle'])
+            if not exiforient.write_orientation(self.filename, orientation):
+                return False
+            self.file_info['orientation'] = orientation
+            self.file_info['angle'] = angle
+            self.file_info['mtime'] = os.stat(self.filename).st_mtime
+        except OSError:
+            return False
+        elapsed = (time.perf_counter() - started) * 1000
+        self.timing_text.config(text=f"saved orientation only {elapsed:.0f} ms          ")
+        return True
+
+    def set_save_profile(self):
+        self.settings['save_profile'] = self.save_profile.get()
+
+    def set_save_limit(self):
+        # JPEGs are saved at the highest quality under this size (see app/encode.py). 0 for no limit
+        max_kb = simpledialog.askinteger("Size limit", "Largest file to save, in KB (0 for no limit)", initialvalue=self.settings.get('save_max_kb') or 0, minvalue=0, parent=self.window)
+        if max_kb is not None:
+            self.settings['save_max_kb'] = max_kb or None
 
     def file_saveas(self):
         filename = filedialog.asksaveasfilename(initialdir=self.default_folder, title="Select file", filetypes=ALLOWED_FILES)
 
     def file_next(self, event=None): # The event is received if executed via the key binding
+        self.navigate(1)
+
+    def file_previous(self, event=None):  # The event is received if executed via the key binding
+        self.navigate(-1)
+
+    def navigate(self, step):
+        # Queue a move through the folder. Moves made before the next frame (eg: a held arrow key) add up
+        # and only the file they land on is opened
+        self.scheduler.flush('rotate')
         if self.is_dirty():
             if messagebox.askyesno("Changes made", f"Save changes to {self.filename}?"):
                 self.file_save()
-        images_in_folder = self.get_images_in_folder(self.settings['default_folder'])
-        images_in_folder.sort()
-        image_number = -1
-        for i in range(len(images_in_folder)):
-            if self.filename.split("/")[-1] == images_in_folder[i]:
-                image_number = i
-        if image_number >= 0:
-            image_number = (image_number + 1) % len(images_in_folder)
-            print(f"Opening {images_in_folder[image_number]}")
-            self.file_open(self.settings['default_folder']+"/"+images_in_folder[image_number])
-        else:
+        self.nav_steps += step
+        self.nav_direction = 1 if step > 0 else -1
+        self.scheduler.request('navigate', self.navigate_now)
+
+    @trace.traced("navigate")
+    def navigate_now(self):
+        steps = self.nav_steps
+        self.nav_steps = 0
+        if steps == 0:
+            return
+        index = self.folder_index(self.settings['default_folder'])
+        name = index.neighbour(self.current_name(index), steps)
+        if name is None:
             self.file_open("")
+            return
+        position = index.position(name)
+        ahead = [index.path(f) for f in self.prefetcher.neighbours(index.files, position, self.nav_direction)]
+        self.filmstrip.set_folder(index.folder, index.files, position)
+        self.open_when_ready(index.path(name), ahead)
+
+    def current_name(self, index):
+        # Where we are in the folder: the file on its way to being opened, the open file, or else the last one viewed there
+        if self.pending_open is not None:
+            return index.relative_name(self.pending_open)
+        if self.filename != "":
+            return index.relative_name(self.filename)
+        return self.settings.folder(index.folder).get('last')
+
+    def filmstrip_select(self, name):
+        # A thumbnail has been clicked
+        if self.is_dirty():
+            if messagebox.askyesno("Changes made", f"Save changes to {self.filename}?"):
+                self.file_save()
+        index = self.folder_index(self.settings['default_folder'])
+        self.file_open(index.path(name))
 
     def file_delete(self):
         if self.fileopen:
             confirm = messagebox.askyesno("Confirm file delete?", f"Delete file {self.filename}?")
             if confirm:
                 os.remove(self.filename)
-                del self.settings['most_recent']
-                self.is_dirty(False)
-                self.fileopen = False
-                self.filename = ""
-                self.image = None
-                self.imageTk = None
-                self.image_container.configure(image=None)
-                self.show_properties()
+                self.forget_file(self.filename)
         else:
             messagebox.showerror("I'm confused", "No file open")
 
-    def file_previous(self, event=None):  # The event is received if executed via the key binding
-        if self.is_dirty():
-            if messagebox.askyesno("Changes made", f"Save changes to {self.filename}?"):
-                self.file_save()
-        images_in_folder = self.get_images_in_folder(self.settings['default_folder'])
-        images_in_folder.sort()
-        image_number = -1
-        for i in range(len(images_in_folder)):
-            if self.filename.split("/")[-1] == images_in_folder[i]:
-                image_number = i
-        if image_number >= 0:
-            image_number = (image_number - 1) % len(images_in_folder)
-            print(f"Opening {images_in_folder[image_number]}")
-            self.file_open(self.settings['default_folder']+"/"+images_in_folder[image_number])
-        else:
-            self.file_open("")
+    def forget_file(self, filename):
+        # Drop everything held about a file that has been deleted (closing it if it is the one open)
+        self.image_cache.discard(filename)
+        self.hash_index.discard(filename)
+        self.filmstrip.store.discard(filename)
+        if self.settings.get('most_recent') == filename:
+            self.settings.pop('most_recent', None)
+        if filename == self.filename:
+            self.is_dirty(False)
+            self.fileopen = False
+            self.filename = ""
+            self.image = None
+            self.imageTk = None
+            self.renderer.clear()
+            self.filmstrip.clear()
+            self.show_properties()
+
+    def find_duplicates(self):
+        # Group near-duplicate shots (bursts) in the current folder, to keep the best of each and delete the rest
+        index = self.folder_index(self.settings['default_folder'])
+        duplicatewindow.DuplicatesWindow(self.window, self.hash_index, index.folder, [index.path(name) for name in index.files], lambda paths: self.delete_files(paths, index.folder))
+
+    def delete_files(self, paths, folder):
+        # Delete files chosen in the duplicates window for `folder`. Returns the ones deleted
+        deleted = []
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning("Unable to delete %s: %s", path, e)
+                continue
+            self.forget_file(path)
+            deleted.append(path)
+        index = self.folder_index(folder)
+        index.refresh(force=True)
+        if index.folder == self.filmstrip.folder: # Unless the filmstrip has moved on to another folder since
+            self.filmstrip.set_folder(index.folder, index.files, index.position(self.current_name(index)) if self.filename != "" else -1)
+        return deleted
 
     def about(self):
         about = app.AboutWindow(self.window)
     
     def resize(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        # The dialog previews on the display proxy; the full resolution image is only resized on Apply
+        if not self.fileopen:
+            return
+        self.scheduler.flush('rotate')
+        if self.active_tool != "":
+            self.tool_finish()
+        self.active_tool = "resize"
+        self.active_tool_text.config(text="resize          ")
+        self.renderer.set_zoom(None, self.get_frame_size())
+        resizewindow.ResizeWindow(self.window, self.properties['dimensions'], self.settings.get('resize', {}), self.resize_preview, self.resize_apply, self.resize_finish)
+
+    def resize_preview(self, size, filter):
+        if size is None:
+            self.schedule_render()
+        else:
+            self.schedule_render(lambda proxy: resize.preview(proxy, self.properties['dimensions'], size, filter))
+
+    def resize_apply(self, size, filter, choices):
+        self.settings['resize'] = choices
+        self.tool_finish()
+        if size != self.properties['dimensions']:
+            self.apply_edit(operations.resize(size, filter))
+        self.show_image()
 
-    def crop_attempt_1(self, event=None): # Mouse control
+    def resize_finish(self):
+        self.tool_finish()
+        self.show_image()
+
+    def adjust(self):
+        # The sliders make one lookup table, previewed on the display proxy as they move (see app/adjust.py)
+        if not self.fileopen:
+            return
+        if not adjust.can_adjust(self.properties['mode']):
+            messagebox.showinfo("Adjust", f"Sorry, {self.properties['mode']} images can't be adjusted")
+            return
+        self.scheduler.flush('rotate')
+        if self.active_tool != "":
+            self.tool_finish()
+        self.active_tool = "adjust"
+        self.active_tool_text.config(text="adjust          ")
+        self.renderer.set_zoom(None, self.get_frame_size())
+        adjustwindow.AdjustWindow(self.window, self.adjust_preview, self.adjust_auto, self.adjust_apply, self.adjust_finish)
+
+    def adjust_preview(self, op):
+        self.schedule_render(lambda proxy: operations.apply(proxy, op))
+
+    def adjust_auto(self):
+        # Auto levels from the histogram of what is on screen
+        return adjust.auto_levels(self.renderer.nearest_level(loader.fit_size(self.renderer.size, self.get_frame_size())))
+
+    def adjust_apply(self, op):
+        self.tool_finish()
+        if not adjust.is_identity(op):
+            self.apply_edit(op)
+        self.show_image()
+
+    def adjust_finish(self):
+        self.tool_finish()
+        self.show_image()
+
+    def crop_ratio(self):
         # Default crop is 1:1 ratio
-        if 'crop_ratio' in self.settings:
-            ratio = self.settings['crop_ratio']
+        folder_ratio = self.settings.folder(self.settings['default_folder']).get('crop_ratio')
+        if folder_ratio is not None:
+            return folder_ratio
+        elif 'crop_ratio' in self.settings:
+            return self.settings['crop_ratio']
         elif 'ratio' in self.active_tool_data:
-            ratio = self.active_tool_data['ratio']
+            return self.active_tool_data['ratio']
         else:
-            ratio = 1.0
-        if event is not None and self.active_tool == "crop":
-            left_edge = self.properties['offset'][0]
-            right_edge = self.properties['offset'][0] + self.properties['scaled_size'][0]
-            top_edge = self.properties['offset'][1]
-            bottom_edge = self.properties['offset'][1] + self.properties['scaled_size'][1]
-            if str(event.type) == "ButtonPress":
-                print('ButtonPress',event.x, event.y)
-                self.add_to_history()
-                self.active_tool_data['crop_start_x'] = int((max(min(event.x, right_edge), left_edge) - left_edge) * self.properties['scale_ratio'])
-                self.active_tool_data['crop_start_y'] = int((max(min(event.y, bottom_edge), top_edge) - top_edge) * self.properties['scale_ratio'])
-                draw = ImageDraw.Draw(self.image, 'RGBA')
-                draw.rectangle((0,0,self.properties['dimensions'][0],self.active_tool_data['crop_start_y']-1), fill="#00000080")
-                draw.rectangle((0,0,self.active_tool_data['crop_start_x']-1,self.properties['dimensions'][1]), fill="#00000080")
-                self.is_dirty(True)
-                self.active_tool_data['ButtonPress'] = True
-                print(self.active_tool_data)
-            elif str(event.type) == "ButtonRelease" and 'ButtonPress' in self.active_tool_data:
-                print('ButtonRelease',event.x, event.y)
-                self.active_tool_data['crop_end_x'] = int((max(min(event.x, right_edge), left_edge) - left_edge) * self.properties['scale_ratio'])
-                self.active_tool_data['crop_end_y'] = int((max(min(event.y, bottom_edge), top_edge) - top_edge) * self.properties['scale_ratio'])
-                print(self.active_tool_data)
-                w = self.active_tool_data['crop_end_x'] - self.active_tool_data['crop_start_x']
-                h = self.active_tool_data['crop_end_y'] - self.active_tool_data['crop_start_y']
-                if w > h:
-                    self.active_tool_data['crop_end_y'] = self.active_tool_data['crop_start_y'] + int(w * ratio)
-                else:
-                    self.active_tool_data['crop_end_x'] = self.active_tool_data['crop_start_x'] + int(h / ratio)
-                print(self.active_tool_data)
-                if self.active_tool_data['crop_start_x'] < self.active_tool_data['crop_end_x'] and self.active_tool_data['crop_start_y'] < self.active_tool_data['crop_end_y']:
-                    print("Cropping...")
-                    self.image = self.image.crop((self.active_tool_data['crop_start_x'], 
-                        self.active_tool_data['crop_start_y'], 
-                        self.active_tool_data['crop_end_x'], 
-                        self.active_tool_data['crop_end_y']))
-                else:
-                    print("Zero area selected, aborting crop...")
-                    self.undo()
-                self.active_tool = ""
-                self.active_tool_data = {}
-                self.window.bind('<Button-1>', None)
-                self.window.bind('<ButtonRelease-1>', None)
-            print("Showing image...")
-            self.show_image()
-        elif event is None:
-            print('Crop button')
-            self.window.bind('<Button-1>', self.crop)
-            self.window.bind('<ButtonRelease-1>', self.crop)
-            self.active_tool = "crop"
-            self.active_tool_data = {}
-            
+            return 1.0 # One x for every one y. Ratio > 1 are wider, ratio < 1 are taller
+
+    def set_crop_ratio(self):
+        # Remember a crop ratio (width / height) for the current folder
+        folder = self.settings['default_folder']
+        ratio = simpledialog.askfloat("Crop ratio", f"Width / height ratio for crops in {folder}\n(eg: 1.5 for 3:2, 0.75 for 3:4)", initialvalue=self.crop_ratio(), minvalue=0.05, maxvalue=20.0, parent=self.window)
+        if ratio is not None:
+            self.settings.set_folder(folder, 'crop_ratio', ratio)
 
+    def crop_overlay(self, proxy):
+        # Draw the crop selection onto a copy of the display proxy. The full resolution image is not touched until Return
+        scale = proxy.size[0] / self.properties['dimensions'][0]
+        x = int(self.active_tool_data['x'] * scale)
+        y = int(self.active_tool_data['y'] * scale)
+        w = int(self.active_tool_data['w'] * scale)
+        h = int(self.active_tool_data['h'] * scale)
+        if proxy.mode in ("RGB", "RGBA"):
+            image = proxy.copy()
+        else:
+            image = proxy.convert("RGB")
+        draw = ImageDraw.Draw(image, 'RGBA')
+        draw.rectangle((0,0,image.size[0],y), fill="#00000080") # Top
+        draw.rectangle((0,y,x,y+h), fill="#00000080") # Left
+        draw.rectangle((x+w,y,image.size[0],y+h), fill="#00000080") # Right
+        draw.rectangle((0,y+h,image.size[0],image.size[1]), fill="#00000080") # Bottom
+        draw.rectangle((x,y,x+w-1,y+h-1), outline="#ffffffc0")
+        return image
+
+    def tool_finish(self):
+        # Put down the active tool (crop, a drawing tool, resize or adjust)
+        self.scheduler.cancel('render')
+        self.active_tool = ""
+        self.active_tool_data = {}
+        self.active_tool_text.config(text="          ")
+
+    def crop_mouse(self, event): # Mouse control
+        # Drag out a selection, constrained to the crop ratio. Return locks it in as with the keyboard
+        if self.active_tool != "crop":
+            return
+        scaled_size = self.properties['scaled_size']
+        x = int(min(max(event.x - self.properties['offset'][0], 0), scaled_size[0]) * self.properties['scale_ratio'])
+        y = int(min(max(event.y - self.properties['offset'][1], 0), scaled_size[1]) * self.properties['scale_ratio'])
+        x = min(x, self.properties['dimensions'][0])
+        y = min(y, self.properties['dimensions'][1])
+        if str(event.type) == "ButtonPress":
+            self.active_tool_data['anchor'] = (x, y)
+            return
+        if 'anchor' not in self.active_tool_data:
+            return
+        if str(event.type) == "ButtonRelease":
+            anchor = self.active_tool_data.pop('anchor')
+        else:
+            anchor = self.active_tool_data['anchor']
+        ratio = self.crop_ratio()
+        w = abs(x - anchor[0])
+        h = abs(y - anchor[1])
+        if h == 0 or w / h > ratio:
+            w = int(h * ratio)
+        else:
+            h = int(w / ratio)
+        if w > 0 and h > 0:
+            self.active_tool_data['x'] = anchor[0] if x >= anchor[0] else anchor[0] - w
+            self.active_tool_data['y'] = anchor[1] if y >= anchor[1] else anchor[1] - h
+            self.active_tool_data['w'] = w
+            self.active_tool_data['h'] = h
+            self.schedule_render(self.crop_overlay)
+
+    @trace.traced("crop")
     def crop(self, event=None): # Keyboard control
-        if self.image is None:
+        if not self.fileopen:
             return False
-        def add_crop_mask(image, x,y,w,h): # Coordinates as per original image not the scaled image on display
-            print(x,y,w,h, image.size[0], image.size[1])
-            draw = ImageDraw.Draw(image, 'RGBA')
-            draw.rectangle((0,0,image.size[0],y), fill="#00000080") # Top
-            draw.rectangle((0,y,x,y+h), fill="#00000080") # Left
-            draw.rectangle((x+w,y,image.size[0],y+h), fill="#00000080") # Right
-            draw.rectangle((0,y+h,image.size[0],image.size[1]), fill="#00000080") # Bottom
-        # Default crop is 1:1 ratio 
-        if 'crop_ratio' in self.settings:
-            ratio = self.settings['crop_ratio']
-        elif 'ratio' in self.active_tool_data:
-            ratio = self.active_tool_data['ratio']
-        else:
-            ratio = 1.0 # One x for every one y. Ratio > 1 are wider, ratio < 1 are taller
+        image_size = self.properties['dimensions']
+        ratio = self.crop_ratio()
         # How many pixels to move for each key press
         if 'crop_step' in self.settings:
             step = self.settings['crop_step']
         elif 'step' in self.active_tool_data:
             step = self.active_tool_data['step']
         else:
-            step = int(self.image.size[0]/20.0)
+            step = int(image_size[0]/20.0)
         # Crop button has been pressed on toolbar
         # or Control-C key combination (event.state==4 is Control)
         if event is None or (str(event.type)=="KeyPress" and event.state==4 and event.keysym=="c"): 
-            print('Crop button')
-            self.add_to_history()
-            self.is_dirty(True)
-            if self.image.size[0] > self.image.size[1]: # Image is landscape orientation
-                y = 0
-                h = self.image.size[1] # Full height
-                w = int( h * ratio )
-                x = int(self.image.size[0] / 2) - int(w/2)
-            else: # Image is portrait orientation
-                x = 0
-                w = self.image.size[0] # Full width
-                h = int( w * ratio )
-                y = int(self.image.size[1] / 2) - int(h/2)
+            if self.active_tool == "crop":
+                return
+            self.scheduler.flush('rotate')
+            box = engine.ratio_crop_box(image_size, ratio) # Largest centred selection of the crop ratio
+            x, y, w, h = box[0], box[1], box[2] - box[0], box[3] - box[1]
             self.active_tool = "crop"
             self.active_tool_data = {'x':x, 'y':y, 'w':w, 'h':h}
             self.active_tool_text.config(text="crop")
-            self.crop_tool_original_image = self.image.copy()
-            add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
-            self.show_image()
+            self.renderer.set_zoom(None, self.get_frame_size()) # The crop selection is drawn over the whole image
+            self.show_image(overlay=self.crop_overlay)
         elif event is not None and self.active_tool == "crop": # Key press
-            print(event)
+            data = self.active_tool_data
             if str(event.type) == "KeyPress" and event.keysym == 'Left': # Move left
-                if self.active_tool_data['x'] > step:
-                    self.active_tool_data['x'] -= step
-                else:
-                    self.active_tool_data['x'] = 0
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                data['x'] = max(data['x'] - step, 0)
             elif str(event.type) == "KeyPress" and event.keysym == 'Down': # Move down
-                if self.active_tool_data['y']+self.active_tool_data['h']+step < self.image.size[1]:
-                    self.active_tool_data['y'] += step
-                else:
-                    self.active_tool_data['y'] = self.image.size[1] - self.active_tool_data['h']
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                data['y'] = min(data['y'] + step, image_size[1] - data['h'])
             elif str(event.type) == "KeyPress" and event.keysym == 'Right': # Move right
-                if self.active_tool_data['x']+self.active_tool_data['w']+step < self.image.size[0]:
-                    self.active_tool_data['x'] += step
-                else:
-                    self.active_tool_data['x'] = self.image.size[0] - self.active_tool_data['w']
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                data['x'] = min(data['x'] + step, image_size[0] - data['w'])
             elif str(event.type) == "KeyPress" and event.keysym == 'Up': # Move up
-                if self.active_tool_data['y'] > step:
-                    self.active_tool_data['y'] -= step
-                else:
-                    self.active_tool_data['y'] = 0
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                data['y'] = max(data['y'] - step, 0)
             elif str(event.type) == "KeyPress" and event.keysym == 'plus': # Increase selection size
-                if self.active_tool_data['w'] < self.image.size[0] and self.active_tool_data['h'] < self.image.size[1]:
-                    self.active_tool_data['w'] += step
-                    self.active_tool_data['h'] = self.active_tool_data['w'] / ratio
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                if data['w'] + step <= image_size[0] and int((data['w'] + step) / ratio) <= image_size[1]:
+                    data['w'] += step
+                    data['h'] = int(data['w'] / ratio)
+                    data['x'] = min(data['x'], image_size[0] - data['w'])
+                    data['y'] = min(data['y'], image_size[1] - data['h'])
             elif str(event.type) == "KeyPress" and event.keysym == 'minus': # Decrease selection size
-                if self.active_tool_data['w'] > 2*step and self.active_tool_data['h'] > 2*step:
-                    self.active_tool_data['w'] -= step
-                    self.active_tool_data['h'] = self.active_tool_data['w'] / ratio
-                self.image = self.crop_tool_original_image.copy()
-                add_crop_mask(self.image, self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['w'],self.active_tool_data['h'])
+                if data['w'] > 2*step and data['h'] > 2*step:
+                    data['w'] -= step
+                    data['h'] = int(data['w'] / ratio)
             elif str(event.type) == "KeyPress" and event.keysym == "Return": # Finalise the cropping
-                self.image = self.crop_tool_original_image.copy()
-                self.image = self.image.crop((self.active_tool_data['x'],self.active_tool_data['y'],self.active_tool_data['x']+self.active_tool_data['w'],self.active_tool_data['y']+self.active_tool_data['h']))
-                self.active_tool = ""
-                self.active_tool_text.config(text="          ")
-                self.active_tool_data = {}
+                box = (data['x'], data['y'], data['x']+data['w'], data['y']+data['h'])
+                self.tool_finish()
+                self.apply_edit(operations.crop(box))
+                self.show_image()
+                return
             elif event.keysym == "Escape":
-                self.undo()
-                self.active_tool = ""
-                self.active_tool_data = {}
-                self.active_tool_text.config(text="          ")
-            self.show_image()
+                self.tool_finish()
+                self.show_image()
+                return
+            self.schedule_render(self.crop_overlay)
+
+    @trace.traced("apply_edit")
+    def apply_edit(self, op):
+        # Remember an operation record (see app/operations.py). It is previewed straight away but only run on
+        # the full resolution image when its pixels are needed (see materialize)
+        trace.annotate(op=op['op'])
+        self.history.add(op)
+        self.is_dirty(True)
+        return True
 
     def rotate_left(self):
-        if self.image is not None:
-            self.add_to_history()
-            self.image = self.image.rotate(90, expand=True)
-            self.is_dirty(True)
-            self.show_image()
+        self.rotate(90)
 
     def rotate_right(self, event=None):
-        if self.image is not None:
-            self.add_to_history()
-            self.image = self.image.rotate(-90, expand=True)
-            self.is_dirty(True)
+        self.rotate(-90)
+
+    def rotate(self, angle):
+        # Rotations asked for before the next frame are merged and applied as one
+        if not self.fileopen:
+            return
+        self.pending_angle += angle
+        self.scheduler.request('rotate', self.rotate_now)
+
+    @trace.traced("rotate")
+    def rotate_now(self):
+        angle = self.pending_angle % 360
+        self.pending_angle = 0
+        trace.annotate(angle=angle)
+        if angle != 0:
+            self.apply_edit(operations.rotate(angle))
             self.show_image()
+
+    def schedule_render(self, overlay=None):
+        # Redraw at the next frame rather than for every event
+        self.scheduler.request('render', lambda: self.show_image(overlay=overlay))
     
     def text(self):
         messagebox.showerror("Sorry", "Feature not yet implemented :-/")
 
     def pen(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        self.start_drawing("pen")
 
     def line(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        self.start_drawing("line")
 
     def rectangle(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        self.start_drawing("rectangle")
 
     def elipse(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        self.start_drawing("ellipse")
 
     def erase(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        self.start_drawing("erase") # Paints with the background colour
 
     def setforeground(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        colour = colorchooser.askcolor(self.settings.get('foreground', "#000000"), title="Foreground colour", parent=self.window)[1]
+        if colour is not None:
+            self.settings['foreground'] = colour
+            self.show_drawing_tool()
 
     def setbackground(self):
-        messagebox.showerror("Sorry", "Feature not yet implemented :-/")
+        colour = colorchooser.askcolor(self.settings.get('background', "#ffffff"), title="Background colour", parent=self.window)[1]
+        if colour is not None:
+            self.settings['background'] = colour
+            self.show_drawing_tool()
 
+    def start_drawing(self, tool):
+        # Drawing tools stay active until Escape (or another tool is chosen)
+        if not self.fileopen:
+            return
+        if not drawing.can_draw(self.properties['mode']):
+            messagebox.showinfo("Drawing", f"Sorry, {self.properties['mode']} images can't be drawn on")
+            return
+        self.scheduler.flush('rotate')
+        if self.active_tool == "crop":
+            self.tool_finish()
+        if self.materialize() is None:
+            return # Strokes are drawn straight onto the full resolution image
+        self.active_tool = tool
+        self.active_tool_data = {'stroke': None}
+        self.renderer.set_zoom(None, self.get_frame_size()) # Strokes are drawn over the whole image
+        self.show_image()
+        self.show_drawing_tool()
+
+    def show_drawing_tool(self):
+        if self.active_tool in drawing.TOOLS:
+            colour = self.settings.get('background', "#ffffff") if self.active_tool == "erase" else self.settings.get('foreground', "#000000")
+            self.active_tool_text.config(text=f"{self.active_tool} {self.settings.get('pen_width', PEN_WIDTH)}px {colour}          ")
+
+    def drawing_key(self, event):
+        # +/- change the width of the drawing tools, Escape puts the tool down
+        if str(event.type) != "KeyPress":
+            return
+        width = self.settings.get('pen_width', PEN_WIDTH)
+        if event.keysym == "plus":
+            self.settings['pen_width'] = width + max(1, width // 4)
+        elif event.keysym == "minus":
+            self.settings['pen_width'] = max(1, width - max(1, width // 5))
+        elif event.keysym == "Escape":
+            self.drawing_mouse_release()
+            self.tool_finish()
+            return
+        self.show_drawing_tool()
+
+    def drawing_mouse(self, event):
+        # Strokes go onto the image as the mouse moves, a piece at a time (see app/drawing.py)
+        if not self.fileopen or self.materialize() is None:
+            return
+        scaled_size = self.properties['scaled_size']
+        x = min(max(event.x - self.properties['offset'][0], 0), scaled_size[0]) * self.properties['scale_ratio']
+        y = min(max(event.y - self.properties['offset'][1], 0), scaled_size[1]) * self.properties['scale_ratio']
+        point = (min(x, self.image.size[0] - 1), min(y, self.image.size[1] - 1))
+        if str(event.type) == "ButtonPress":
+            if self.active_tool == "erase":
+                colour = self.settings.get('background', "#ffffff")
+            else:
+                colour = self.settings.get('foreground', "#000000")
+            proxy = self.renderer.edit_surface(self.get_frame_size())
+            self.active_tool_data['stroke'] = drawing.Stroke(self.active_tool, colour, self.settings.get('pen_width', PEN_WIDTH), self.image, proxy, self.renderer, self.history)
+        stroke = self.active_tool_data.get('stroke')
+        if stroke is None:
+            return
+        stroke.add(point)
+        if str(event.type) == "ButtonRelease":
+            self.drawing_mouse_release()
+
+    def drawing_mouse_release(self):
+        stroke = self.active_tool_data.get('stroke')
+        if stroke is None:
+            return
+        self.active_tool_data['stroke'] = None
+        finished = stroke.finish()
+        if finished is not None:
+            op, snapshot = finished
+            self.add_to_history(op, self.image, snapshot=snapshot)
+            self.is_dirty(True)
+
+    @trace.traced("undo")
     def undo(self, event=None):
+        self.scheduler.flush('rotate')
         if len(self.history) > 0:
-            self.image = self.history.pop(-1)
+            image = self.history.undo(self.image)
+            if image is not self.image:
+                self.image = image
+                self.image_changed()
             self.show_image()
         if len(self.history) == 0:
             self.is_dirty(False)
 
-    def add_to_history(self):
-        self.history.append(self.image.copy())
+    @trace.traced("redo")
+    def redo(self, event=None):
+        self.scheduler.flush('rotate')
+        if self.history.can_redo() and (not self.history.redo_needs_image() or self.load_full_image() is not None):
+            op, image = self.history.redo(self.image)
+            if image is not self.image:
+                self.image = image
+                self.image_changed()
+            self.is_dirty(True)
+            self.show_image()
 
+    @trace.traced("add_to_history")
+    def add_to_history(self, op, before, bbox=None, snapshot=None):
+        # `op` has just been applied to `before`; bbox (if known) is the area it changed. Ops applied in
+        # place (strokes) pass the snapshot they made as they went
+        trace.annotate(op=op['op'], size=before.size, mode=before.mode)
+        self.history.record(op, before, bbox, snapshot)
+
+    @trace.traced("revert")
     def revert(self):
-        while len(self.history) > 0:
-            self.undo()
+        # Go straight back to the image as it was opened (everything can then be redone)
+        self.scheduler.flush('rotate')
+        if len(self.history) == 0:
+            return
+        try:
+            unchanged = os.stat(self.filename).st_mtime == self.image_mtime
+        except OSError:
+            unchanged = False
+        if unchanged:
+            try:
+                entry = loader.load_image(self.filename, self.get_frame_size(), self.settings.get('draft_decoding', True), large=True)
+            except:
+                unchanged = False
+        if unchanged:
+            self.history.rewind()
+            self.image = entry['image']
+            self.edit_base = None
+            self.preview_key = None
+            self.renderer.set_source(self.image, entry['size'], entry['preview'])
+            self.is_dirty(False)
+            self.show_image()
+        else:
+            # The file has been saved since it was opened, step back through the history instead
+            while len(self.history) > 0:
+                self.undo()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pbTools image editor")
+    parser.add_argument("--startup-profile", action="store_true", help="Print the time taken to first paint the window and to show the first image")
+    parser.add_argument("--trace", metavar="FILE", help="Record timings of the session and save them to FILE (Chrome trace format) on exit")
+    parser.add_argument("--hud", action="store_true", help="Show the cost of each operation under the image")
+    parser.add_argument("--log-level", default="WARNING", help="DEBUG, INFO, WARNING or ERROR")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
     root = tk.Tk()          # Initialise the tk system into an object called `root`
     root.withdraw()         # Hide the default window
-    main = AppWindow(root)   # Run our window, called AppWindow
+    main = AppWindow(root, startup_profile=args.startup_profile, trace_file=args.trace, hud=args.hud)   # Run our window, called AppWindow
     root.mainloop()         # Start the program loop until all windows exit
 
@@ -0,0 +1,111 @@
+import random
+import numpy as np
+import pytest
+from PIL import Image, ImageChops
+from app import editgraph, operations
+
+SIZE = (97, 61)     # Odd sides, so rounding in crop mapping shows up
+
+def picture(size=SIZE, mode="RGB"):
+    # Every pixel different, so a pixel out of place is noticed
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).convert(mode)
+
+def in_order(image, ops):
+    for op in ops:
+        image = operations.apply(image, op)
+    return image
+
+def same(a, b):
+    return a.size == b.size and a.mode == b.mode and ImageChops.difference(a.convert("RGB"), b.convert("RGB")).getbbox() is None
+
+def random_crop(size, rng):
+    x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+    return operations.crop((x0, y0, rng.randrange(x0 + 1, size[0] + 1), rng.randrange(y0 + 1, size[1] + 1)))
+
+def random_chain(rng, size, kinds, length):
+    ops = []
+    for i in range(length):
+        kind = rng.choice(kinds)
+        if kind == 'rotate':
+            op = operations.rotate(rng.choice((90, 180, 270, -90)))
+        elif kind == 'crop':
+            op = random_crop(size, rng)
+        elif kind == 'adjust':
+            op = operations.adjust(brightness=rng.randrange(-50, 51), gamma=rng.choice((0.8, 1.0, 1.3)))
+        else:
+            op = operations.resize((rng.randrange(1, 2 * size[0]), rng.randrange(1, 2 * size[1])), "nearest")
+        ops.append(op)
+        size = operations.result_size(size, op)
+    return ops
+
+@pytest.mark.parametrize("seed", range(200))
+def test_rotations_and_crops_give_the_same_pixels(seed):
+    rng = random.Random(seed)
+    ops = random_chain(rng, SIZE, ('rotate', 'crop'), rng.randrange(1, 8))
+    image = picture()
+    assert same(editgraph.apply(image, ops), in_order(image, ops))
+
+@pytest.mark.parametrize("seed", range(100))
+def test_adjustments_move_past_rotations_and_crops(seed):
+    rng = random.Random(seed)
+    ops = random_chain(rng, SIZE, ('rotate', 'crop', 'adjust'), rng.randrange(1, 8))
+    image = picture()
+    assert same(editgraph.apply(image, ops), in_order(image, ops))
+
+@pytest.mark.parametrize("seed", range(100))
+def test_resizes_give_the_same_size(seed):
+    # A resize moved ahead of a rotation may round differently (see app/editgraph.py), so only sizes are compared
+    rng = random.Random(seed)
+    ops = random_chain(rng, SIZE, ('rotate', 'crop', 'resize'), rng.randrange(1, 8))
+    image = picture()
+    result = editgraph.apply(image, ops)
+    assert result.size == in_order(image, ops).size == editgraph.result_size(ops, SIZE)
+
+@pytest.mark.parametrize("seed", range(100))
+def test_crops_then_a_resize_give_the_same_pixels(seed):
+    rng = random.Random(seed)
+    ops = random_chain(rng, SIZE, ('crop',), rng.randrange(1, 4))
+    ops += random_chain(rng, editgraph.result_size(ops, SIZE), ('resize',), 1)
+    image = picture()
+    assert same(editgraph.apply(image, ops), in_order(image, ops))
+
+def test_full_turn_costs_nothing():
+    assert editgraph.optimize([operations.rotate(90)] * 4, SIZE) == []
+    assert editgraph.optimize([operations.rotate(90), operations.rotate(-90)], SIZE) == []
+
+def test_chain_becomes_one_crop_resize_and_rotation():
+    ops = [operations.rotate(90), operations.crop((5, 5, 50, 40)), operations.rotate(90), operations.crop((0, 0, 30, 30)), operations.resize((15, 15))]
+    assert [op['op'] for op in editgraph.optimize(ops, SIZE)] == ['crop', 'resize', 'rotate']
+
+def test_consecutive_resizes_are_kept():
+    ops = [operations.resize((10, 6)), operations.resize((97, 61))]
+    assert editgraph.optimize(ops, SIZE) == ops
+
+def test_crop_after_a_resize_is_kept_after_it():
+    ops = [operations.resize((50, 30), "nearest"), operations.crop((10, 10, 40, 20))]
+    optimized = editgraph.optimize(ops, SIZE)
+    assert [op['op'] for op in optimized] == ['resize', 'crop']
+    image = picture()
+    assert same(editgraph.apply(image, ops), in_order(image, ops))
+
+def test_strokes_stay_where_they_are():
+    stroke = operations.stroke("line", ((0, 0), (20, 20)), "#ff0000", 3)
+    ops = [operations.rotate(90), stroke, operations.rotate(-90)]
+    assert [op['op'] for op in editgraph.optimize(ops, SIZE)] == ['rotate', 'stroke', 'rotate']
+    image = picture()
+    assert same(editgraph.apply(image, ops), in_order(image, ops))
+
+def test_unrotate_box_maps_back():
+    for angle in (0, 90, 180, 270):
+        image = picture()
+        rotated = operations.apply(image, operations.rotate(angle))
+        box = (3, 7, 20, 30)
+        original = editgraph.unrotate_box(box, image.size, angle)
+        assert same(operations.apply(image.crop(original), operations.rotate(angle)), rotated.crop(box))
+
+def test_preview_matches_the_full_image_scaled():
+    ops = [operations.rotate(90), operations.crop((10, 10, 50, 90))]
+    full = (194, 122)
+    proxy = picture(SIZE)
+    assert editgraph.preview(proxy, full, ops).size == (20, 40)
@@ -0,0 +1,40 @@
+import pytest
+from app import engine, operations
+
+def test_parse_recipe():
+    steps = engine.parse_recipe("rotate:-90, crop:ratio=1.5:top, resize:long=2048:filter=bicubic, convert:PNG, save:web:kb=300")
+    assert steps[0] == operations.rotate(-90)
+    assert steps[1] == {'op': 'ratio_crop', 'ratio': 1.5, 'anchor': "top"}
+    assert steps[2]['mode'] == "long_edge" and steps[2]['long_edge'] == 2048 and steps[2]['filter'] == "bicubic"
+    assert steps[3] == {'op': 'convert', 'format': "png"}
+    assert steps[4] == {'op': 'save', 'profile': "web", 'max_bytes': 300 * 1024}
+
+@pytest.mark.parametrize("text, mode, values", [
+    ("resize:50%", "percent", {'percent': 50.0}),
+    ("resize:1920x1080", "pixels", {'width': 1920, 'height': 1080}),
+    ("resize:width=640", "pixels", {'width': 640, 'height': None}),
+    ("resize:height=480", "pixels", {'width': None, 'height': 480}),
+])
+def test_parse_resize(text, mode, values):
+    step = engine.parse_recipe(text)[0]
+    assert step['mode'] == mode
+    assert {key: step[key] for key in values} == values
+
+def test_crop_defaults_and_spelling():
+    assert engine.parse_recipe("crop:0.5:centre")[0] == {'op': 'ratio_crop', 'ratio': 0.5, 'anchor': "center"}
+    assert engine.parse_recipe("crop")[0] == {'op': 'ratio_crop', 'ratio': 1.0, 'anchor': "center"}
+
+def test_empty_recipe():
+    assert engine.parse_recipe("") == []
+    assert engine.parse_recipe(" , ") == []
+
+@pytest.mark.parametrize("text", ["rotate:45", "crop:0", "crop:1:middle", "resize:big", "resize:0%", "resize:width=0",
+                                  "resize:50%:filter=blurry", "convert:gif", "save:best", "save:web:kb=0", "save:kb=lots", "flip"])
+def test_invalid_recipes(text):
+    with pytest.raises(ValueError):
+        engine.parse_recipe(text)
+
+def test_resolve():
+    ops, convert_to = engine.resolve(engine.parse_recipe("rotate:90,crop:1:left,resize:50%,convert:jpg,save:small"), (400, 300))
+    assert ops == [operations.rotate(90), operations.crop((0, 50, 300, 350)), operations.resize((150, 150), "lanczos")]
+    assert convert_to == "jpg"
@@ -0,0 +1,73 @@
+import io
+import pytest
+from PIL import Image, ImageChops
+from app import exiforient
+
+def picture():
+    image = Image.new("RGB", (48, 32))
+    image.putdata([(x * 5, y * 7, (x + y) * 3) for y in range(32) for x in range(48)])
+    return image
+
+def jpeg(exif=None):
+    buffer = io.BytesIO()
+    picture().save(buffer, "JPEG", quality=95, **({'exif': exif} if exif is not None else {}))
+    return buffer.getvalue()
+
+def orientation_of(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return exiforient.get_orientation(image)
+
+def scan(data):
+    # The compressed image data, which changing the orientation must leave alone
+    return data[data.index(b"\xff\xda"):]
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_set_orientation_without_exif(orientation):
+    data = jpeg()
+    assert orientation_of(data) == 1
+    changed = exiforient.set_orientation(data, orientation)
+    assert orientation_of(changed) == orientation
+    assert scan(changed) == scan(data)
+
+def test_set_orientation_round_trip():
+    exif = Image.Exif()
+    exif[exiforient.ORIENTATION_TAG] = 1
+    data = jpeg(exif.tobytes())
+    for orientation in (6, 3, 8, 1):
+        changed = exiforient.set_orientation(data, orientation)
+        assert len(changed) == len(data)   # Patched in place
+        assert orientation_of(changed) == orientation
+        data = changed
+
+def test_exif_without_orientation_is_left_alone():
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"     # Make
+    assert exiforient.set_orientation(jpeg(exif.tobytes()), 6) is None
+
+def test_not_a_jpeg():
+    with pytest.raises(ValueError):
+        exiforient.set_orientation(b"\x89PNG\r\n\x1a\n", 6)
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+@pytest.mark.parametrize("angle", (0, 90, 180, 270, -90))
+def test_rotate_matches_rotating_the_pixels(orientation, angle):
+    stored = picture()
+    shown = exiforient.orient(stored, orientation)
+    if angle % 360 in exiforient.ROTATE_TRANSPOSE:
+        shown = shown.transpose(exiforient.ROTATE_TRANSPOSE[angle % 360])
+    rotated = exiforient.orient(stored, exiforient.rotate(orientation, angle))
+    assert rotated.size == shown.size and ImageChops.difference(rotated, shown).getbbox() is None
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_rotating_back_restores_the_orientation(orientation):
+    assert exiforient.rotate(exiforient.rotate(orientation, 90), -90) == orientation
+    assert exiforient.rotate(exiforient.rotate(orientation, 180), 180) == orientation
+
+def test_write_orientation(tmp_path):
+    filename = str(tmp_path / "a.jpg")
+    with open(filename, "wb") as f:
+        f.write(jpeg())
+    assert exiforient.write_orientation(filename, 6)
+    assert exiforient.write_orientation(filename, 3)
+    with open(filename, "rb") as f:
+        assert orientation_of(f.read()) == 3
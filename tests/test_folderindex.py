@@ -0,0 +1,66 @@
+import os
+import json
+from app import folderindex
+
+EXTENSIONS = ("jpg", "png")
+
+def touch(folder, *names):
+    for name in names:
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+def test_natural_sort():
+    names = ["img10.jpg", "IMG2.jpg", "img1.jpg", "img2b.jpg", "a.jpg", "img02.jpg"]
+    assert sorted(names, key=folderindex.natural_key) == ["a.jpg", "img1.jpg", "IMG2.jpg", "img02.jpg", "img2b.jpg", "img10.jpg"]
+
+def test_index_lists_images_in_order(tmp_path):
+    touch(str(tmp_path), "b10.jpg", "b9.png", "notes.txt", "sub/a1.jpg")
+    index = folderindex.FolderIndex(str(tmp_path), EXTENSIONS)
+    index.refresh(force=True)
+    assert list(index.files) == ["b9.png", "b10.jpg"]
+    index = folderindex.FolderIndex(str(tmp_path), EXTENSIONS, natural=False)
+    index.refresh(force=True)
+    assert list(index.files) == ["b10.jpg", "b9.png"]
+    index = folderindex.FolderIndex(str(tmp_path), EXTENSIONS, recursive=True)
+    index.refresh(force=True)
+    assert list(index.files) == ["b9.png", "b10.jpg", "sub/a1.jpg"]
+
+def test_neighbours_wrap_around(tmp_path):
+    touch(str(tmp_path), "1.jpg", "2.jpg", "3.jpg")
+    index = folderindex.FolderIndex(str(tmp_path), EXTENSIONS)
+    index.refresh(force=True)
+    assert index.neighbour("3.jpg", 1) == "1.jpg"
+    assert index.neighbour("1.jpg", -1) == "3.jpg"
+    # A file that has just gone still has neighbours where it used to sort
+    assert index.neighbour("2b.jpg", 1) == "3.jpg"
+    assert index.neighbour("2b.jpg", -1) == "2.jpg"
+
+def test_store_round_trip(tmp_path):
+    folder = tmp_path / "photos"
+    touch(str(folder), "x2.jpg", "x11.jpg")
+    filename = str(tmp_path / "index.json")
+    store = folderindex.FolderIndexStore(filename, EXTENSIONS)
+    assert list(store.get(str(folder)).files) == ["x2.jpg", "x11.jpg"]
+    store.save()
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")] == []
+    again = folderindex.FolderIndexStore(filename, EXTENSIONS)
+    assert list(again.get(str(folder)).files) == ["x2.jpg", "x11.jpg"]
+
+def test_store_keeps_the_newest_folders(tmp_path):
+    filename = str(tmp_path / "index.json")
+    store = folderindex.FolderIndexStore(filename, EXTENSIONS)
+    for i in range(folderindex.MAX_FOLDERS + 5):
+        folder = tmp_path / f"f{i}"
+        folder.mkdir()
+        store.get(str(folder))
+    store.save()
+    with open(filename) as f:
+        folders = json.load(f)['folders']
+    assert list(folders) == [str(tmp_path / f"f{i}") for i in range(5, folderindex.MAX_FOLDERS + 5)]
+
+def test_unreadable_store_starts_empty(tmp_path):
+    filename = str(tmp_path / "index.json")
+    with open(filename, "w") as f:
+        f.write("{not json")
+    assert folderindex.FolderIndexStore(filename, EXTENSIONS).saved == {}
@@ -0,0 +1,104 @@
+import random
+import numpy as np
+import pytest
+from PIL import Image, ImageChops
+from app import history, operations
+
+SIZE = (300, 200)   # More than one snapshot tile each way
+
+def picture():
+    rng = np.random.default_rng(2)
+    return Image.fromarray(rng.integers(0, 256, (SIZE[1], SIZE[0], 3), dtype=np.uint8))
+
+def same(a, b):
+    return a.size == b.size and a.mode == b.mode and ImageChops.difference(a, b).getbbox() is None
+
+def stroke(history_, image, rng):
+    # Draw a stroke the way the editor does: pending edits applied first, then drawn and recorded
+    image = history_.materialize(image)
+    op = operations.stroke("pen", [(rng.randrange(image.size[0]), rng.randrange(image.size[1])) for i in range(3)], "#ff0000", 9)
+    history_.record(op, image)
+    return operations.apply(image, op)
+
+def edit(history_, image, rng):
+    kind = rng.choice(("rotate", "crop", "stroke", "materialize"))
+    size = history.editgraph.result_size(history_.pending, image.size)
+    if kind == "rotate":
+        history_.add(operations.rotate(rng.choice((90, -90, 180))))
+    elif kind == "crop":
+        x0, y0 = rng.randrange(size[0] // 2), rng.randrange(size[1] // 2)
+        history_.add(operations.crop((x0, y0, x0 + rng.randrange(20, size[0] - x0 + 1), y0 + rng.randrange(20, size[1] - y0 + 1))))
+    elif kind == "stroke":
+        image = stroke(history_, image, rng)
+    else:
+        image = history_.materialize(image) # eg: saving
+    return image
+
+def shown(history_, image):
+    # What the editor shows: the image with its pending edits run
+    return history.editgraph.apply(image, history_.pending)
+
+@pytest.mark.parametrize("budget", (64 * 1024 * 1024, 0))
+@pytest.mark.parametrize("seed", range(40))
+def test_undo_and_redo_round_trip(seed, budget):
+    # With no budget every snapshot tile spills to the temporary file
+    rng = random.Random(seed)
+    history_ = history.History(budget)
+    image = picture()
+    states = [shown(history_, image)]
+    for i in range(rng.randrange(1, 8)):
+        image = edit(history_, image, rng)
+        if len(history_) == len(states) - 1:
+            continue # Materializing alone isn't a step
+        states.append(shown(history_, image))
+    if budget == 0 and len(history_.store.blobs) > 0:
+        assert history_.store.spilled() > 0
+    for state in reversed(states[:-1]):
+        image = history_.undo(image)
+        assert same(shown(history_, image), state)
+    assert len(history_) == 0
+    for state in states[1:]:
+        if history_.redo_needs_image():
+            image = history_.materialize(image)
+        op, image = history_.redo(image)
+        assert same(shown(history_, image), state)
+    assert not history_.can_redo()
+
+def test_pending_edits_are_free_to_undo():
+    history_ = history.History(1024 * 1024)
+    image = picture()
+    history_.add(operations.rotate(90))
+    history_.add(operations.crop((0, 0, 50, 50)))
+    assert history_.undo(image) is image
+    assert history_.pending == [operations.rotate(90)]
+
+def test_a_new_edit_forgets_redo():
+    history_ = history.History(1024 * 1024)
+    image = picture()
+    history_.add(operations.rotate(90))
+    history_.undo(image)
+    assert history_.can_redo()
+    history_.add(operations.rotate(-90))
+    assert not history_.can_redo()
+
+def test_rewind_makes_everything_redoable():
+    history_ = history.History(1024 * 1024)
+    original = picture()
+    image = stroke(history_, original, random.Random(1))
+    history_.add(operations.rotate(90))
+    edited = shown(history_, image)
+    history_.rewind()
+    image = original
+    while history_.can_redo():
+        if history_.redo_needs_image():
+            image = history_.materialize(image)
+        op, image = history_.redo(image)
+    assert same(shown(history_, image), edited)
+
+def test_net_rotation():
+    history_ = history.History(1024 * 1024)
+    history_.add(operations.rotate(90))
+    history_.add(operations.rotate(180))
+    assert history_.net_rotation() == 270
+    history_.add(operations.crop((0, 0, 10, 10)))
+    assert history_.net_rotation() is None
@@ -0,0 +1,56 @@
+import os
+import json
+import pickle
+from app import settings
+
+def test_changes_mark_the_settings_dirty(tmp_path):
+    calls = []
+    values = settings.Settings(str(tmp_path / "settings.json"), {'a': 1})
+    values.on_change = lambda: calls.append(1)
+    values['a'] = 1
+    values.update(a=1)
+    values.setdefault('a', 2)
+    values.pop('missing', None)
+    assert not values.dirty and calls == []
+    values['a'] = 2
+    assert values.dirty and len(calls) == 1
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / "settings.json")
+    values = settings.Settings(filename, {'a': 1})
+    values['b'] = [1, 2]
+    values.set_folder(str(tmp_path), 'last', "x.jpg")
+    assert values.save()
+    assert not values.dirty
+    again = settings.Settings(filename, {'a': 0, 'c': 3})
+    assert dict(again) == {'a': 1, 'b': [1, 2], 'c': 3}
+    assert again.folder(str(tmp_path)) == {'last': "x.jpg"}
+
+def test_migrates_pickled_settings(tmp_path):
+    legacy = str(tmp_path / "image-editor-settings.pickle")
+    with open(legacy, "wb") as f:
+        pickle.dump({'default_folder': "/photos", 'most_recent': "/photos/a.jpg"}, f)
+    filename = str(tmp_path / "settings.json")
+    values = settings.Settings(filename, {'default_folder': os.curdir}, legacy)
+    assert values['most_recent'] == "/photos/a.jpg"
+    assert values.dirty    # So the migrated settings are written out as JSON
+    values.save()
+    with open(filename) as f:
+        assert json.load(f)['settings']['default_folder'] == "/photos"
+
+def test_unreadable_file_is_kept(tmp_path):
+    filename = str(tmp_path / "settings.json")
+    with open(filename, "w") as f:
+        json.dump({'version': settings.SETTINGS_VERSION + 1, 'settings': {}}, f)
+    values = settings.Settings(filename, {'a': 1})
+    assert dict(values) == {'a': 1}
+    assert values.load_error is not None
+    assert os.path.exists(filename + ".bad")
+
+def test_only_recent_folders_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_FOLDERS", 3)
+    values = settings.Settings(str(tmp_path / "settings.json"))
+    for name in ("a", "b", "c", "d"):
+        values.set_folder(str(tmp_path / name), 'last', "1.jpg")
+    values.set_folder(str(tmp_path / "b"), 'last', "2.jpg")
+    assert list(values.folders) == [str(tmp_path / name) for name in ("c", "d", "b")]